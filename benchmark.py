@@ -0,0 +1,273 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from wallet import (
+    ColumnarLedger,
+    DataManager,
+    FilePriceProvider,
+    LedgerState,
+    PortfolioEngine,
+    TransactionProcessor,
+    create_storage,
+    format_timestamp,
+    load_numpy,
+    parse_timestamp,
+    write_json_atomic,
+    TRANSACTION_TIMESTAMP_FORMAT,
+)
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_BASELINE = "benchmark_baseline.json"
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_MIN_DELTA = 0.005  # sotto questo scarto assoluto (secondi) le differenze sono solo rumore
+DEFAULT_REPEAT = 3
+
+# Coppie sintetiche: (coppia, id CoinGecko, prezzo iniziale in USDT)
+CRYPTO_PAIRS = [
+    ("BTC/USDT", "bitcoin", 30000.0),
+    ("ETH/USDT", "ethereum", 1800.0),
+    ("SOL/USDT", "solana", 25.0),
+    ("ADA/USDT", "cardano", 0.3),
+    ("LINK/USDT", "chainlink", 7.0),
+    ("AVAX/USDT", "avalanche-2", 12.0),
+    ("MATIC/USDT", "matic-network", 0.6),
+    ("NEXO/USDT", "nexo", 0.7),
+    ("APT/USDT", "aptos", 8.0),
+    ("NEAR/USDT", "near", 1.5),
+    ("DOT/USDT", "polkadot", 5.0),
+    ("ATOM/USDT", "cosmos", 9.0),
+]
+ETF_NAMES = [("MSCI World", 90.0), ("MSCI EM", 40.0), ("Global Clean Energy", 8.0)]
+EUR_USD_RATE = 0.92
+
+
+# ======================= Generazione dei dati sintetici =======================
+
+def synthetic_id(seed, index):
+    return f"{seed:016x}{index:016x}"
+
+
+def generate_crypto_transactions(count, seed=0):
+    rng = random.Random(seed)
+    start = datetime(2018, 1, 1)
+    step = timedelta(seconds=max(1, int(6 * 365 * 24 * 3600 / max(count, 1))))
+    transactions = []
+    for index in range(count):
+        timestamp = (start + step * index).strftime(TRANSACTION_TIMESTAMP_FORMAT)
+        roll = rng.random()
+        if roll < 0.1:
+            # Acquisto di USDT con EUR
+            amount = round(rng.uniform(100, 5000), 2)
+            tx = {"Pair": "USDT/EUR", "Base": "USDT", "Quote": "EUR", "Side": "Buy", "Price": EUR_USD_RATE,
+                  "Order Amount": amount, "Filled Amount": amount, "Executed Amount": round(amount * EUR_USD_RATE, 4),
+                  "Trade Fee": 0.0, "Fee Currency": "USDT", "Info": "Transazione"}
+        elif roll < 0.2:
+            etf_name, base_price = rng.choice(ETF_NAMES)
+            units = float(rng.randint(1, 10))
+            price = round(base_price * rng.uniform(0.8, 1.3), 2)
+            tx = {"Pair": f"{etf_name}/EUR", "Base": etf_name, "Quote": "EUR", "Side": "Buy" if rng.random() < 0.85 else "Sell",
+                  "Price": price, "Order Amount": units, "Filled Amount": units, "Executed Amount": round(units * price, 4),
+                  "Trade Fee": 1.0, "Fee Currency": "EUR", "Info": "Etf"}
+        else:
+            pair, _, base_price = rng.choice(CRYPTO_PAIRS)
+            base, quote = pair.split("/")
+            price = round(base_price * rng.uniform(0.5, 2.0), 6)
+            amount = round(rng.uniform(10, 2000) / price, 6)
+            info = "Earn" if roll < 0.25 else "Transazione"
+            side = "Buy" if info == "Earn" or rng.random() < 0.7 else "Sell"
+            tx = {"Pair": pair, "Base": base, "Quote": quote, "Side": side, "Price": price,
+                  "Order Amount": amount, "Filled Amount": amount, "Executed Amount": round(amount * price, 6),
+                  "Trade Fee": round(amount * 0.001, 8), "Fee Currency": base, "Info": info}
+        # ID deterministici: a parità di seed il dataset generato è identico
+        tx = {"ID": synthetic_id(seed, index), "Timestamp": timestamp, **tx}
+        transactions.append(tx)
+    # Come negli export reali, le righe arrivano dalla più recente alla più vecchia
+    transactions.reverse()
+    return transactions
+
+
+def generate_fiat_transactions(count, seed=0):
+    rng = random.Random(seed + 1)
+    start = datetime(2018, 1, 1)
+    step = timedelta(seconds=max(1, int(6 * 365 * 24 * 3600 / max(count, 1))))
+    transactions = []
+    for index in range(count):
+        top_up = rng.random() < 0.8
+        transactions.append({
+            "ID": synthetic_id(seed + 1, index),
+            "Timestamp": (start + step * index).strftime(TRANSACTION_TIMESTAMP_FORMAT),
+            "Type": "Top Up FIAT" if top_up else "Withdraw FIAT",
+            "Filled Amount": round(rng.uniform(50, 5000 if top_up else 1000), 2),
+            "Currency": "EUR",
+            "Info": "Normale"
+        })
+    return transactions
+
+
+def generate_prices():
+    # Sorgente di prezzi fittizia: nessuna chiamata di rete durante il benchmark
+    prices = {"tether": {"usd": 1.0, "eur": EUR_USD_RATE}}
+    for _, coin_id, base_price in CRYPTO_PAIRS:
+        prices[coin_id] = {"usd": base_price, "eur": base_price * EUR_USD_RATE}
+    return prices
+
+
+def write_dataset(data_dir, crypto_count, fiat_count, seed=0):
+    os.makedirs(data_dir, exist_ok=True)
+    write_json_atomic(os.path.join(data_dir, "crypto_valute.json"), {pair: coin_id for pair, coin_id, _ in CRYPTO_PAIRS + [("USDT/EUR", "tether", 1.0)]}, indent=4)
+    write_json_atomic(os.path.join(data_dir, "etf_valute.json"), {name: price for name, price in ETF_NAMES}, indent=4)
+    write_json_atomic(os.path.join(data_dir, "percentuali_target.json"), {
+        "liquidita": 20, "Conto deposito": 10, "Immobili": 15, "BTC": 20, "ETH": 10, "SOL": 3, "altcoin": 1,
+        "etf": {name: 7 for name, _ in ETF_NAMES}
+    }, indent=4)
+    write_json_atomic(os.path.join(data_dir, "conto_deposito.json"), {"Conto deposito": []}, indent=4)
+    write_json_atomic(os.path.join(data_dir, "immobili.json"), {"Immobili": []}, indent=4)
+    write_json_atomic(os.path.join(data_dir, "selling_prices.json"), {}, indent=4)
+    # Prezzi fissi serviti da file: il benchmark non fa richieste di rete
+    write_json_atomic(os.path.join(data_dir, "prices.json"), generate_prices(), indent=4)
+
+    storage = create_storage("json", data_dir)
+    storage.save_crypto_transactions(generate_crypto_transactions(crypto_count, seed))
+    storage.save_fiat_transactions({"EUR_Balance": 0, "Transactions": generate_fiat_transactions(fiat_count, seed)})
+
+
+# ======================= Misurazione =======================
+
+def measure(function, repeat):
+    # Restituisce il tempo migliore su più ripetizioni, meno sensibile al rumore della macchina
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_size(size, storage_kind, repeat, seed):
+    work_dir = tempfile.mkdtemp(prefix="wallet-benchmark-")
+    previous_dir = os.getcwd()
+    try:
+        # DataManager usa percorsi relativi alla directory corrente (data/...)
+        os.chdir(work_dir)
+        data_dir = "data"
+        write_dataset(data_dir, size, max(1, size // 10), seed)
+
+        storage = create_storage(storage_kind, data_dir)
+        data_manager = DataManager(storage, price_provider=FilePriceProvider(os.path.join(data_dir, "prices.json")))
+        processor = TransactionProcessor(data_manager)
+        prices = data_manager.get_current_crypto_prices()
+
+        crypto_transactions = storage.load_crypto_transactions()
+        fiat_data = storage.load_fiat_transactions()
+        display_timestamps = [format_timestamp(tx["Timestamp"]) for tx in crypto_transactions]
+
+        timings = {}
+        # I file di configurazione sono letti al primo accesso: l'avvio non dipende dalla loro dimensione
+        timings["data_manager_init"] = measure(lambda: DataManager(storage, price_provider=data_manager.price_provider), repeat)
+        timings["load_crypto"] = measure(storage.load_crypto_transactions, repeat)
+        timings["load_fiat"] = measure(storage.load_fiat_transactions, repeat)
+        timings["save_crypto"] = measure(lambda: storage.save_crypto_transactions(crypto_transactions), repeat)
+        timings["sort_transactions"] = measure(lambda: sorted(crypto_transactions, key=lambda tx: tx["Timestamp"]), repeat)
+        # Cache del parser svuotata a ogni giro per misurare anche il primo parsing
+        timings["parse_timestamps"] = measure(lambda: (parse_timestamp.cache_clear(), [parse_timestamp(value) for value in display_timestamps]), repeat)
+        timings["format_timestamps"] = measure(lambda: [format_timestamp(tx["Timestamp"]) for tx in crypto_transactions], repeat)
+
+        crypto_transactions.sort(key=lambda tx: tx["Timestamp"])
+        timings["process_fiat"] = measure(lambda: processor.process_fiat_transactions(fiat_data["Transactions"], 0), repeat)
+        timings["process_crypto"] = measure(lambda: processor.process_crypto_transactions(crypto_transactions, 0), repeat)
+        np = load_numpy()
+        if np is not None:
+            timings["process_crypto_columnar"] = measure(lambda: ColumnarLedger(np, LedgerState(), crypto_transactions).states([len(crypto_transactions)])[0].results(0), repeat)
+
+        # Aggiunta di una transazione a un ledger già calcolato (e ritorno allo stato iniziale)
+        processor.ledger.sync(crypto_transactions)
+        appended = crypto_transactions + [dict(crypto_transactions[-1], Timestamp=datetime.now().strftime(TRANSACTION_TIMESTAMP_FORMAT))]
+        timings["ledger_append"] = measure(lambda: (processor.ledger.sync(crypto_transactions), processor.ledger.sync(appended)), repeat)
+
+        engine = PortfolioEngine(data_manager, processor)
+        timings["engine_load"] = measure(engine.load, repeat)
+        timings["valuation"] = measure(lambda: engine.valuation(prices), repeat)
+        timings["cost_basis_fifo"] = measure(lambda: engine.cost_basis("FIFO", prices), repeat)
+        timings["cost_basis_hifo"] = measure(lambda: engine.cost_basis("HIFO", prices), repeat)
+        timings["rebalance"] = measure(lambda: engine.rebalance(prices), repeat)
+        # Serie storica calcolata da zero e poi ripresa dal file salvato
+        history_path = data_manager.portfolio_history_path
+        timings["history_build"] = measure(lambda: (os.path.exists(history_path) and os.remove(history_path), engine.history()), repeat)
+        timings["history_resume"] = measure(engine.history, repeat)
+        return timings
+    finally:
+        os.chdir(previous_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def compare(results, baseline, tolerance, min_delta=DEFAULT_MIN_DELTA):
+    regressions = []
+    for size, timings in results.items():
+        for stage, elapsed in timings.items():
+            reference = baseline.get(size, {}).get(stage)
+            if reference and elapsed > reference * (1 + tolerance) and elapsed - reference > min_delta:
+                regressions.append((size, stage, reference, elapsed))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark dei percorsi di caricamento e calcolo del portafoglio")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="numero di transazioni crypto per ogni ledger sintetico (fino a 1000000)")
+    parser.add_argument("--storage", choices=("json", "sqlite"), default="json", help="backend di salvataggio da misurare")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="ripetizioni per ogni fase (viene tenuto il tempo migliore)")
+    parser.add_argument("--seed", type=int, default=0, help="seed del generatore dei dati sintetici")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="file JSON con i tempi di riferimento")
+    parser.add_argument("--save-baseline", action="store_true", help="salva i tempi misurati come nuovo riferimento")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="rallentamento massimo ammesso rispetto al riferimento (0.25 = +25%%)")
+    parser.add_argument("--min-delta", type=float, default=DEFAULT_MIN_DELTA, help="rallentamento assoluto minimo in secondi per segnalare una regressione")
+    parser.add_argument("--allow-missing-baseline", action="store_true", help="non considera un errore l'assenza del riferimento per le dimensioni misurate")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for size in args.sizes:
+        print(f"Ledger sintetico con {size} transazioni ({args.storage})...")
+        timings = run_size(size, args.storage, args.repeat, args.seed)
+        results[f"{args.storage}:{size}"] = timings
+        for stage, elapsed in timings.items():
+            print(f"  {stage:<24} {elapsed * 1000:10.2f} ms")
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r") as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        write_json_atomic(args.baseline, baseline, indent=4)
+        print(f"Riferimento salvato in {args.baseline}")
+        return 0
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+    # Senza riferimento il confronto non verifica nulla: è un errore, salvo richiesta esplicita
+    missing = [size for size in results if size not in baseline]
+    for size in missing:
+        print(f"{'Attenzione' if args.allow_missing_baseline else 'Errore'}: nessun riferimento per {size} in {args.baseline} (usa --save-baseline per crearlo)")
+    if missing and not args.allow_missing_baseline:
+        return 2
+
+    regressions = compare(results, baseline, args.tolerance, args.min_delta)
+    for size, stage, reference, elapsed in regressions:
+        print(f"Errore: regressione in {stage} ({size}): {reference * 1000:.2f} ms -> {elapsed * 1000:.2f} ms")
+    if regressions:
+        return 1
+    print("Nessuna regressione rispetto al riferimento.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
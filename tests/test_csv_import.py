@@ -0,0 +1,35 @@
+import pytest
+
+import wallet
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("0.25BTC", (0.25, "BTC")),
+    ("7125.1 USDT", (7125.1, "USDT")),
+    ("1e-05 BTC", (1e-05, "BTC")),
+    ("-3", (-3.0, None)),
+    # Formato europeo
+    ("1.234,56", (1234.56, None)),
+    ("1.234.567,8 EUR", (1234567.8, "EUR")),
+    ("0,5", (0.5, None)),
+    ("1.234.567", (1234567.0, None)),
+    # Formato statunitense
+    ("1,234.56", (1234.56, None)),
+    ("1,234,567.8 USD", (1234567.8, "USD")),
+    ("1,234,567", (1234567.0, None)),
+])
+def test_parse_csv_amount_detects_the_decimal_separator(text, expected):
+    assert wallet.parse_csv_amount(text) == expected
+
+
+def test_parse_csv_amount_with_explicit_separator():
+    assert wallet.parse_csv_amount("1,234") == (1.234, None)
+    assert wallet.parse_csv_amount("1,234", ".") == (1234.0, None)
+    assert wallet.parse_csv_amount("1.234", ",") == (1234.0, None)
+    assert wallet.parse_csv_amount("1.234,56", ",") == (1234.56, None)
+
+
+@pytest.mark.parametrize("text", ["", "BTC", "1.2.3,4,5", "abc1"])
+def test_parse_csv_amount_rejects_invalid_amounts(text):
+    with pytest.raises(ValueError):
+        wallet.parse_csv_amount(text)
@@ -0,0 +1,63 @@
+import json
+
+import wallet
+
+
+def record(tx_id, amount=1.0):
+    return {"ID": tx_id, "Filled Amount": amount}
+
+
+def test_apply_journal_replays_records_and_deletes_by_id():
+    transactions = [record("a"), record("b")]
+    entries = [
+        {"Seq": 1, "Record": record("c")},
+        {"Seq": 2, "Record": record("a", 5.0)},
+        {"Seq": 3, "Delete": "b"},
+        {"Seq": 4, "Delete": "missing"},
+    ]
+    assert wallet.apply_journal(transactions, entries) == [record("a", 5.0), record("c")]
+    assert wallet.apply_journal(transactions, []) is transactions
+
+
+def test_journal_skips_truncated_lines_and_keeps_sequence(tmp_path):
+    journal = wallet.TransactionJournal(str(tmp_path / "crypto_transactions.journal"))
+    journal.append(record("a"))
+    with open(journal.path, "a") as f:
+        f.write('{"Seq": 2, "Record": {"ID": "b"')
+
+    reopened = wallet.TransactionJournal(journal.path)
+    assert [entry["Record"]["ID"] for entry in reopened.read()] == ["a"]
+    assert reopened.append(record("c")) == 2
+    assert [entry["Seq"] for entry in reopened.read()] == [1, 2]
+
+
+def test_storage_replays_journal_after_snapshot(tmp_path):
+    storage = wallet.JsonStorage(str(tmp_path))
+    storage.save_crypto_transactions([record("a"), record("b")])
+    storage.append_crypto_transaction(record("c"))
+    storage.update_crypto_transaction(record("a", 3.0))
+    storage.delete_crypto_transaction("b")
+
+    with open(storage.crypto_transactions_path) as f:
+        assert len(json.load(f)["Transactions"]) == 2
+    reopened = wallet.JsonStorage(str(tmp_path))
+    assert reopened.load_crypto_transactions() == [record("a", 3.0), record("c")]
+
+
+def test_compaction_consolidates_journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(wallet, "JOURNAL_COMPACTION_THRESHOLD", 3)
+    storage = wallet.JsonStorage(str(tmp_path))
+    storage.save_crypto_transactions([])
+    for tx_id in "abc":
+        storage.append_crypto_transaction(record(tx_id))
+
+    with open(storage.crypto_transactions_path) as f:
+        snapshot = json.load(f)
+    assert [tx["ID"] for tx in snapshot["Transactions"]] == ["a", "b", "c"]
+    assert snapshot["Journal Seq"] == 3
+    assert storage.crypto_journal.read() == []
+
+    storage.append_crypto_transaction(record("d"))
+    reopened = wallet.JsonStorage(str(tmp_path))
+    assert [tx["ID"] for tx in reopened.load_crypto_transactions()] == ["a", "b", "c", "d"]
+    assert reopened.crypto_journal.last_seq == 4
@@ -0,0 +1,125 @@
+import copy
+import random
+
+import pytest
+
+import wallet
+
+
+def make_transactions(count, seed=1):
+    rng = random.Random(seed)
+    transactions = []
+    for i in range(count):
+        kind = rng.random()
+        side = "Buy" if rng.random() < 0.7 else "Sell"
+        amount = round(rng.uniform(0.01, 2), 6)
+        price = round(rng.uniform(10, 1000), 2)
+        if kind < 0.2:
+            base, quote, info = "USDT", "EUR", "Transazione"
+        elif kind < 0.3:
+            base, quote, info = "VWCE", "EUR", "Etf"
+        else:
+            base, quote, info = rng.choice(["BTC", "ETH", "SOL"]), "USDT", rng.choice(["Transazione", "Transazione", "Earn"])
+        transactions.append({
+            "ID": f"tx{i}",
+            "Timestamp": f"2024-01-01 00:{i // 60 % 60:02d}:{i % 60:02d}",
+            "Pair": f"{base}/{quote}",
+            "Base": base,
+            "Quote": quote,
+            "Side": side,
+            "Price": price,
+            "Order Amount": amount,
+            "Filled Amount": amount,
+            "Executed Amount": round(amount * price, 6),
+            "Trade Fee": round(amount * 0.001, 8),
+            "Fee Currency": base if rng.random() < 0.5 else quote,
+            "Info": info,
+        })
+    return transactions
+
+
+def replay(transactions, eur_balance=1000.0):
+    state = wallet.LedgerState()
+    for tx in transactions:
+        state.apply(tx)
+    return state.results(eur_balance)
+
+
+def fail(*args):
+    raise AssertionError("ledger rielaborato senza modifiche")
+
+
+def test_incremental_ledger_matches_full_replay():
+    transactions = make_transactions(250)
+    ledger = wallet.IncrementalLedger(checkpoint_interval=50)
+
+    ledger.sync(transactions[:100], ("v", 1))
+    assert ledger.results(1000.0) == replay(transactions[:100])
+
+    ledger.sync(transactions, ("v", 2))
+    assert ledger.results(1000.0) == replay(transactions)
+    assert sorted(ledger.checkpoints) == [0, 50, 100, 150, 200, 250]
+
+    edited = copy.deepcopy(transactions)
+    edited[120]["Filled Amount"] *= 2
+    del edited[180]
+    ledger.sync(edited, ("v", 3))
+    assert ledger.results(1000.0) == replay(edited)
+    assert sorted(ledger.checkpoints) == [0, 50, 100, 150, 200]
+
+
+def test_unchanged_fingerprint_skips_the_comparison(monkeypatch):
+    transactions = make_transactions(120)
+    ledger = wallet.IncrementalLedger(checkpoint_interval=50)
+    ledger.sync(transactions, ("v", 1))
+
+    monkeypatch.setattr(ledger, "apply_from", fail)
+    monkeypatch.setattr(ledger, "replay_from", fail)
+    # Copie nuove degli stessi record, come dopo una rilettura dal disco
+    ledger.sync(copy.deepcopy(transactions), ("v", 1))
+    assert ledger.results(1000.0) == replay(transactions)
+
+
+def test_checkpoints_are_saved_only_when_changed(tmp_path, monkeypatch):
+    path = str(tmp_path / "ledger_checkpoints.json")
+    transactions = make_transactions(120)
+    writes = []
+    write_json_atomic = wallet.write_json_atomic
+    monkeypatch.setattr(wallet, "write_json_atomic", lambda *args, **kwargs: (writes.append(args[0]), write_json_atomic(*args, **kwargs)))
+
+    ledger = wallet.IncrementalLedger(path, checkpoint_interval=50)
+    ledger.sync(transactions, ("v", 1))
+    ledger.sync(copy.deepcopy(transactions), ("v", 1))
+    assert writes == [path]
+
+    restored = wallet.IncrementalLedger(path, checkpoint_interval=50)
+    monkeypatch.setattr(restored, "apply_from", fail)
+    restored.sync(copy.deepcopy(transactions), ("v", 1))
+    assert restored.results(1000.0) == replay(transactions)
+    assert writes == [path]
+
+    # Un file diverso invalida i checkpoint: l'impronta va aggiornata su disco
+    ledger.sync(transactions, ("v", 2))
+    assert writes == [path, path]
+
+
+def test_columnar_ledger_matches_row_by_row():
+    np = pytest.importorskip("numpy")
+    transactions = make_transactions(3000, seed=7)
+
+    states = wallet.ColumnarLedger(np, wallet.LedgerState(), transactions).states([1000, 3000])
+
+    assert states[0].results(1000.0) == replay(transactions[:1000])
+    assert states[1].results(1000.0) == replay(transactions)
+
+
+def test_columnar_ledger_continues_from_a_state():
+    np = pytest.importorskip("numpy")
+    transactions = make_transactions(2000, seed=3)
+    start = wallet.LedgerState()
+    for tx in transactions[:500]:
+        start.apply(tx)
+
+    state = wallet.ColumnarLedger(np, start, transactions[500:]).states([1500])[0]
+
+    assert state.results(1000.0) == replay(transactions)
@@ -0,0 +1,96 @@
+import pytest
+
+import wallet
+
+
+def trade(side, pair, amount, price, timestamp="2024-01-01T00:00:00", fee=0.0, fee_currency=None, info="Transazione"):
+    base, quote = pair.split("/")
+    return {
+        "Timestamp": timestamp,
+        "Pair": pair,
+        "Base": base,
+        "Quote": quote,
+        "Side": side,
+        "Price": price,
+        "Order Amount": amount,
+        "Filled Amount": amount,
+        "Executed Amount": amount * price,
+        "Trade Fee": fee,
+        "Fee Currency": fee_currency or quote,
+        "Info": info,
+    }
+
+
+def run(method, transactions, prices=None):
+    tracker = wallet.LotTracker(method)
+    for tx in transactions:
+        tracker.apply(tx)
+    return tracker.report(prices)
+
+
+BUYS_THEN_SELL = [
+    trade("Buy", "BTC/EUR", 1.0, 100.0),
+    trade("Buy", "BTC/EUR", 1.0, 200.0),
+    trade("Buy", "BTC/EUR", 1.0, 150.0),
+    trade("Sell", "BTC/EUR", 1.5, 300.0, timestamp="2025-03-01T00:00:00"),
+]
+
+
+@pytest.mark.parametrize("method, cost, remaining", [
+    ("FIFO", 200.0, 250.0),
+    ("LIFO", 250.0, 200.0),
+    ("HIFO", 275.0, 175.0),
+    ("AVG", 225.0, 225.0),
+])
+def test_methods_match_lots_in_their_order(method, cost, remaining):
+    report = run(method, BUYS_THEN_SELL, {"BTC": 400.0})
+
+    assert report["Realised"] == [{"Asset": "BTC", "Year": "2025", "Proceeds EUR": 450.0, "Cost Basis EUR": cost, "Realised EUR": 450.0 - cost}]
+    [position] = report["Assets"]
+    assert position["Units"] == pytest.approx(1.5)
+    assert position["Cost Basis EUR"] == pytest.approx(remaining)
+    assert position["Unrealised EUR"] == pytest.approx(600.0 - remaining)
+    assert report["Totals"]["Realised EUR"] == pytest.approx(450.0 - cost)
+
+
+def test_sale_beyond_recorded_lots_is_unmatched():
+    report = run("FIFO", [trade("Buy", "ETH/EUR", 1.0, 100.0), trade("Sell", "ETH/EUR", 3.0, 50.0)])
+
+    [position] = report["Assets"]
+    assert position["Units"] == 0.0
+    assert position["Unmatched Units"] == pytest.approx(2.0)
+    assert position["Realised EUR"] == pytest.approx(150.0 - 100.0)
+
+
+def test_fees_and_quote_currency_conversion():
+    report = run("FIFO", [
+        trade("Buy", "USDT/EUR", 1000.0, 0.9),
+        # Commissione in BTC: riduce le unità acquistate, il costo resta quello pagato in USDT
+        trade("Buy", "BTC/USDT", 0.02, 25000.0, fee=0.0001, fee_currency="BTC"),
+    ], {"BTC": 30000.0, "USDT": 0.9})
+
+    positions = {position["Asset"]: position for position in report["Assets"]}
+    assert positions["BTC"]["Units"] == pytest.approx(0.0199)
+    assert positions["BTC"]["Cost Basis EUR"] == pytest.approx(500.0 * 0.9)
+    assert positions["USDT"]["Units"] == pytest.approx(500.0)
+    assert positions["USDT"]["Cost Basis EUR"] == pytest.approx(450.0)
+    # La spesa in USDT è una cessione al cambio corrente: nessuna plusvalenza
+    assert positions["USDT"]["Realised EUR"] == pytest.approx(0.0)
+
+
+def test_etf_and_earn_lots():
+    report = run("FIFO", [
+        trade("Buy", "VWCE/EUR", 2.0, 100.0, info="Etf"),
+        trade("Buy", "SOL/USDT", 1.0, 20.0, info="Earn"),
+    ])
+
+    positions = {position["Asset"]: position for position in report["Assets"]}
+    assert positions["ETF_VWCE"]["Cost Basis EUR"] == pytest.approx(200.0)
+    # Le ricompense Earn non consumano la valuta di quotazione
+    assert "USDT" not in positions
+    assert positions["SOL"]["Cost Basis EUR"] == pytest.approx(20.0)
+
+
+def test_unknown_method_is_rejected():
+    with pytest.raises(ValueError):
+        wallet.LotTracker("LOFO")
@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+import wallet
+
+
+LEGACY_CRYPTO = {
+    "Timestamp": "2024-01-02 10:00:00",
+    "Pair": "BTC/EUR",
+    "Side": "Buy",
+    "Price": "40000",
+    "Order Amount": "0.5 BTC",
+    "Filled Amount": "0.5 BTC",
+    "Executed Amount": "20000 EUR",
+    "Trade Fee": "0.001 BTC",
+}
+
+LEGACY_FIAT = {
+    "Timestamp": "2024-01-01 09:00:00",
+    "Type": "Deposit",
+    "Filled Amount": "1000,50 EUR",
+}
+
+
+def write(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+
+def read(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def test_migrate_crypto_transaction_parses_legacy_strings():
+    tx = wallet.migrate_crypto_transaction(LEGACY_CRYPTO)
+    assert tx["ID"]
+    assert (tx["Base"], tx["Quote"]) == ("BTC", "EUR")
+    assert tx["Price"] == 40000.0
+    assert tx["Filled Amount"] == 0.5
+    assert tx["Executed Amount"] == 20000.0
+    assert tx["Trade Fee"] == 0.001
+    assert tx["Fee Currency"] == "BTC"
+    assert tx["Info"] == "Transazione"
+
+
+def test_migrate_crypto_transaction_keeps_typed_records():
+    typed = dict(wallet.migrate_crypto_transaction(LEGACY_CRYPTO))
+    assert wallet.migrate_crypto_transaction(typed) is typed
+    del typed["ID"]
+    assert wallet.migrate_crypto_transaction(typed)["ID"]
+
+
+def test_migrate_fiat_transaction_parses_comma_decimals():
+    tx = wallet.migrate_fiat_transaction(LEGACY_FIAT)
+    assert tx["Filled Amount"] == 1000.5
+    assert tx["Currency"] == "EUR"
+    assert tx["Info"] == "N/D"
+
+
+def test_legacy_list_is_migrated_and_backed_up(tmp_path):
+    storage = wallet.JsonStorage(str(tmp_path))
+    write(storage.crypto_transactions_path, [LEGACY_CRYPTO])
+
+    transactions = storage.load_crypto_transactions()
+
+    assert len(transactions) == 1 and transactions[0]["Filled Amount"] == 0.5
+    assert read(storage.crypto_transactions_path)["Schema"] == wallet.TRANSACTIONS_SCHEMA_VERSION
+    assert read(storage.crypto_transactions_path + ".v1.bak") == [LEGACY_CRYPTO]
+
+
+def test_lower_fiat_schema_is_migrated(tmp_path):
+    storage = wallet.JsonStorage(str(tmp_path))
+    write(storage.fiat_transactions_path, {"Schema": 2, "EUR_Balance": 5, "Transactions": [LEGACY_FIAT]})
+
+    fiat_data = storage.load_fiat_transactions()
+
+    assert fiat_data["Schema"] == wallet.TRANSACTIONS_SCHEMA_VERSION
+    assert fiat_data["EUR_Balance"] == 5
+    assert fiat_data["Transactions"][0]["Filled Amount"] == 1000.5
+
+
+@pytest.mark.parametrize("kind", ["crypto", "fiat"])
+def test_newer_schema_is_rejected_untouched(tmp_path, kind):
+    storage = wallet.JsonStorage(str(tmp_path))
+    path = getattr(storage, f"{kind}_transactions_path")
+    data = {"Schema": wallet.TRANSACTIONS_SCHEMA_VERSION + 1, "Transactions": [{"ID": "x", "Future": True}]}
+    write(path, data)
+
+    with pytest.raises(ValueError, match="più recente"):
+        getattr(storage, f"load_{kind}_transactions")()
+
+    assert read(path) == data
+    assert not list(tmp_path.glob("*.bak"))
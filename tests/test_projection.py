@@ -0,0 +1,90 @@
+import math
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import wallet
+
+pytest.importorskip("numpy")
+
+TODAY = datetime(2025, 1, 1)
+TOTALS = {"Liquidity": 1000.0, "Deposits": 2000.0, "Real Estate": 10000.0}
+ASSETS = [
+    ("crypto", "bitcoin", "BTC", 5000.0),
+    ("etf", "VWCE", "VWCE", 3000.0),
+    ("crypto", "newcoin", "NEW", 100.0),
+    ("crypto", None, "XYZ", 50.0),
+]
+DEPOSITS = [{"Type": "Vincolato", "Amount EUR": 2000.0, "Expiry": TODAY + timedelta(days=400)}]
+REAL_ESTATE = [{"ID": 1, "Mortgage": True, "Instalments": 24, "Instalments Paid": 4, "Instalment EUR": 500.0}]
+
+
+@pytest.fixture
+def price_history(tmp_path):
+    store = wallet.PriceHistoryStore(str(tmp_path / "price_history.db"))
+    rng = random.Random(0)
+    btc, vwce = 30000.0, 100.0
+    rows = []
+    for day in range(200, 0, -1):
+        timestamp = (TODAY - timedelta(days=day)).timestamp()
+        shock = rng.gauss(0, 1)
+        btc *= math.exp(0.001 + 0.03 * shock)
+        vwce *= math.exp(0.0003 + 0.01 * (0.5 * shock + rng.gauss(0, 1)))
+        rows += [("crypto", "bitcoin", timestamp, None, btc), ("etf", "VWCE", timestamp, None, vwce)]
+        if day <= 10:
+            rows.append(("crypto", "newcoin", timestamp, None, 1.0 + day))
+    store.append_rows(rows)
+    return store
+
+
+def project(price_history, seed=7, paths=2000):
+    projection = wallet.MonteCarloProjection(price_history, years=2, paths=paths, workers=0, seed=seed, today=TODAY)
+    return projection.run(ASSETS, TOTALS, DEPOSITS, REAL_ESTATE)
+
+
+def test_fixed_seed_is_reproducible(price_history):
+    first = project(price_history)
+    assert project(price_history) == first
+    assert project(price_history, seed=8)["Series"] != first["Series"]
+
+
+def test_bands_start_at_current_value_and_stay_ordered(price_history):
+    result = project(price_history)
+    series = result["Series"]
+
+    assert len(series) == 2 * 12 + 1
+    start = sum(asset[3] for asset in ASSETS) + sum(TOTALS.values())
+    assert all(series[0][f"P{percentile}"] == pytest.approx(start, rel=1e-6) for percentile in result["Percentiles"])
+    for point in series[1:]:
+        bands = [point[f"P{percentile}"] for percentile in result["Percentiles"]]
+        assert bands == sorted(bands)
+    assert series[-1]["P95"] > series[-1]["P5"]
+
+
+def test_only_assets_with_enough_history_are_modelled(price_history):
+    assets = {asset["Asset"]: asset for asset in project(price_history)["Assets"]}
+    assert assets["BTC"]["Modelled"] and assets["VWCE"]["Modelled"]
+    assert assets["BTC"]["Annual Volatility"] > assets["VWCE"]["Annual Volatility"] > 0
+    assert not assets["NEW"]["Modelled"] and assets["NEW"]["Annual Return"] is None
+    assert not assets["XYZ"]["Modelled"]
+
+
+def test_cash_flows_move_value_between_buckets(price_history):
+    result = project(price_history)
+    series = result["Series"]
+
+    # Scadenza del deposito al primo passo mensile successivo (400 giorni -> passo 14)
+    assert series[13]["Deposits"] == 2000.0 and series[14]["Deposits"] == 0.0
+    # 20 rate residue da 500 EUR: dalla liquidità all'immobile
+    assert series[20]["Real Estate"] == series[24]["Real Estate"] == 10000.0 + 20 * 500.0
+    for point in series:
+        assert point["Liquidity"] + point["Deposits"] + point["Real Estate"] == pytest.approx(sum(TOTALS.values()))
+    assert [flow["Amount EUR"] for flow in result["Cash Flows"]] == [2000.0, -10000.0]
+
+
+def test_result_does_not_depend_on_the_number_of_workers(price_history, monkeypatch):
+    monkeypatch.setattr(wallet, "MONTE_CARLO_CHUNK_PATHS", 500)
+    single = project(price_history)
+    parallel = wallet.MonteCarloProjection(price_history, years=2, paths=2000, workers=2, seed=7, today=TODAY).run(ASSETS, TOTALS, DEPOSITS, REAL_ESTATE)
+    assert parallel == single
@@ -0,0 +1,116 @@
+import pytest
+
+import wallet
+
+
+TARGETS = {"liquidita": 20, "Conto deposito": 10, "Immobili": 0, "BTC": 40, "altcoin": 10, "etf": {"VWCE": 20}}
+
+
+def planner(tolerance=2.0, min_trade=10.0, fee_rate=0.01):
+    return wallet.RebalancePlanner(wallet.AllocationEngine(TARGETS), {}, fee_rate, tolerance, min_trade)
+
+
+def totals(cash, holdings, deposits=1000.0):
+    value = sum(holding[2] for holding in holdings if holding[3])
+    return {"Portfolio Value": cash + value + deposits, "Liquidity": cash, "Deposits": deposits, "Real Estate": 0.0}
+
+
+def holdings(btc=6000.0, ada=600.0, dot=400.0, vwce=1000.0, btc_price=30000.0, dot_price=5.0):
+    return [
+        ("crypto", "BTC", btc if btc_price else 0.0, btc_price),
+        ("crypto", "ADA", ada, 0.5),
+        ("crypto", "DOT", dot if dot_price else 0.0, dot_price),
+        ("etf", "VWCE", vwce, 100.0),
+    ]
+
+
+def by_asset(plan):
+    return {order["Asset"]: order for order in plan["Orders"]}
+
+
+def test_orders_stop_at_the_band_edge():
+    assets = holdings()
+    plan = planner().plan(assets, totals(2000.0, assets))
+    orders = by_asset(plan)
+
+    # Patrimonio liquidabile 10000, target riproporzionati su 90 punti, banda 200 EUR
+    assert set(orders) == {"BTC", "VWCE"}
+    assert orders["BTC"]["Amount EUR"] == pytest.approx(-(6000.0 - 40 / 90 * 10000 - 200))
+    assert orders["BTC"]["Units"] == pytest.approx(-orders["BTC"]["Amount EUR"] / 30000.0)
+    # L'acquisto impegna la distanza dal bordo della banda, commissione compresa
+    buy = orders["VWCE"]
+    assert buy["Amount EUR"] + buy["Fee EUR"] == pytest.approx(20 / 90 * 10000 - 1000.0 - 200)
+    assert buy["Fee EUR"] == pytest.approx(buy["Amount EUR"] * 0.01)
+
+    sells = -orders["BTC"]["Amount EUR"] - orders["BTC"]["Fee EUR"]
+    buys = buy["Amount EUR"] + buy["Fee EUR"]
+    assert plan["Totals"]["Cash After EUR"] == pytest.approx(2000.0 + sells - buys)
+
+
+def test_balanced_portfolio_needs_no_orders():
+    assets = holdings(btc=4444.0, ada=700.0, dot=400.0, vwce=2222.0)
+    plan = planner().plan(assets, totals(2234.0, assets))
+    assert plan["Orders"] == []
+    assert plan["Skipped"] == []
+
+
+def test_unpriced_assets_are_excluded_and_reported():
+    assets = holdings(btc_price=None)
+    plan = planner().plan(assets, totals(2000.0, assets))
+
+    assert "BTC" not in by_asset(plan)
+    assert {"Category": "BTC", "Asset": "BTC", "Reason": "Prezzo non disponibile", "Amount EUR": None} in plan["Skipped"]
+    # Senza BTC restano 50 punti di target sul patrimonio noto (2000 + 1000 + 1000)
+    buy = by_asset(plan)["VWCE"]
+    assert buy["Amount EUR"] + buy["Fee EUR"] == pytest.approx(20 / 50 * 4000 - 1000.0 - 80)
+    assert all(order["Price EUR"] and order["Units"] > 0 for order in plan["Orders"])
+
+
+def test_category_with_an_unpriced_member_is_left_out():
+    assets = holdings(dot_price=None, ada=3000.0)
+    plan = planner().plan(assets, totals(2000.0, assets))
+
+    assert not {"ADA", "DOT"} & set(by_asset(plan))
+    assert plan["Totals"]["Excluded EUR"] == pytest.approx(3000.0)
+    assert [skipped["Asset"] for skipped in plan["Skipped"]] == ["DOT"]
+
+
+def test_empty_category_is_reported_instead_of_ordered():
+    assets = holdings(vwce=0.0)[:3]
+    plan = planner().plan(assets, totals(2000.0, assets))
+
+    assert "VWCE" not in by_asset(plan)
+    [skipped] = plan["Skipped"]
+    assert (skipped["Asset"], skipped["Reason"]) == ("VWCE", "Nessun asset posseduto")
+    assert skipped["Amount EUR"] > 0
+
+
+def test_buys_are_scaled_to_the_available_cash():
+    # Le vendite delle altcoin sono tutte sotto l'ordine minimo: gli acquisti contano solo sulla liquidità
+    engine = wallet.AllocationEngine({"liquidita": 0, "Conto deposito": 0, "Immobili": 0, "BTC": 100, "altcoin": 0})
+    assets = [("crypto", "BTC", 500.0, 30000.0)] + [("crypto", f"ALT{i}", 40.0, 1.0) for i in range(10)]
+    plan = wallet.RebalancePlanner(engine, {}, 0.01, 2.0, 50.0).plan(assets, totals(100.0, assets, deposits=0.0))
+
+    [order] = plan["Orders"]
+    assert order["Asset"] == "BTC" and order["Side"] == "Buy"
+    assert plan["Totals"]["Buy Scale"] == pytest.approx(100.0 / 480.0)
+    assert order["Amount EUR"] + order["Fee EUR"] == pytest.approx(100.0)
+    assert plan["Totals"]["Cash After EUR"] == pytest.approx(0.0, abs=1e-9)
+
+
+def test_band_is_measured_on_the_free_value():
+    # Con 90000 EUR di depositi una banda sul patrimonio totale (2000 EUR) nasconderebbe lo scarto di BTC
+    assets = holdings(btc=5000.0)
+    plan = planner(fee_rate=0.0).plan(assets, totals(2000.0, assets, deposits=90000.0))
+    free_value = 2000.0 + 5000.0 + 1000.0 + 1000.0
+    assert by_asset(plan)["BTC"]["Amount EUR"] == pytest.approx(-(5000.0 - 40 / 90 * free_value - 0.02 * free_value))
+
+
+def test_trade_fee_rates_are_keyed_like_positions():
+    transactions = [
+        {"Base": "VWCE", "Quote": "EUR", "Price": 100.0, "Executed Amount": 1000.0, "Trade Fee": 2.0, "Fee Currency": "EUR", "Info": "Etf"},
+        {"Base": "BTC", "Quote": "USDT", "Price": 30000.0, "Executed Amount": 3000.0, "Trade Fee": 0.0001, "Fee Currency": "BTC"},
+    ]
+    rates, default_rate = wallet.trade_fee_rates(transactions)
+    assert rates == {"VWCE": pytest.approx(0.002), "BTC": pytest.approx(0.001)}
+    assert default_rate == pytest.approx(5.0 / 4000.0)
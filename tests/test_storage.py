@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+import wallet
+
+
+def crypto_record(tx_id, amount=1.0):
+    return {
+        "ID": tx_id,
+        "Timestamp": "2024-01-02T10:00:00",
+        "Pair": "BTC/USDT",
+        "Base": "BTC",
+        "Quote": "USDT",
+        "Side": "Buy",
+        "Price": 40000.0,
+        "Order Amount": amount,
+        "Filled Amount": amount,
+        "Executed Amount": 40000.0 * amount,
+        "Trade Fee": 0.0,
+        "Fee Currency": "USDT",
+        "Info": "Transazione",
+    }
+
+
+def fiat_record(tx_id, amount=100.0):
+    return {
+        "ID": tx_id,
+        "Timestamp": "2024-01-01T09:00:00",
+        "Type": "Top Up FIAT",
+        "Filled Amount": amount,
+        "Currency": "EUR",
+        "Info": "N/D",
+    }
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def storage(request, tmp_path):
+    if request.param == "json":
+        storage = wallet.JsonStorage(str(tmp_path))
+    else:
+        storage = wallet.SqliteStorage(str(tmp_path / "wallet.db"))
+    storage.save_crypto_transactions([crypto_record("a"), crypto_record("b")])
+    storage.save_fiat_transactions({"EUR_Balance": 0, "Transactions": [fiat_record("f")]})
+    return storage
+
+
+def test_update_and_delete_unknown_ids_return_false(storage):
+    assert storage.update_crypto_transaction(crypto_record("missing")) is False
+    assert storage.delete_crypto_transaction("missing") is False
+    assert storage.update_fiat_transaction(fiat_record("missing")) is False
+    assert storage.delete_fiat_transaction("missing") is False
+
+    assert [tx["ID"] for tx in storage.load_crypto_transactions()] == ["a", "b"]
+    assert [tx["ID"] for tx in storage.load_fiat_transactions()["Transactions"]] == ["f"]
+
+
+def test_update_and_delete_by_id(storage):
+    assert storage.update_crypto_transaction(crypto_record("b", 2.0)) is True
+    assert storage.delete_crypto_transaction("a") is True
+    assert storage.delete_crypto_transaction("a") is False
+    assert storage.update_fiat_transaction(fiat_record("f", 50.0)) is True
+
+    assert storage.load_crypto_transactions() == [crypto_record("b", 2.0)]
+    assert storage.load_fiat_transactions()["Transactions"] == [fiat_record("f", 50.0)]
+
+
+def test_appended_ids_can_be_updated(storage):
+    storage.append_crypto_transaction(crypto_record("c"))
+    storage.append_fiat_transaction(fiat_record("g"))
+
+    assert storage.update_crypto_transaction(crypto_record("c", 3.0)) is True
+    assert storage.delete_fiat_transaction("g") is True
+    assert crypto_record("c", 3.0) in storage.load_crypto_transactions()
+
+
+def test_data_manager_paths_follow_storage(storage, tmp_path):
+    manager = wallet.DataManager(storage)
+    for path in (manager.price_history_path, manager.csv_import_mapping_path, manager.ledger_checkpoints_path, manager.portfolio_history_path):
+        assert os.path.dirname(path) == str(tmp_path)
+
+
+def test_backends_keep_separate_derived_files(tmp_path):
+    json_storage = wallet.JsonStorage(str(tmp_path))
+    sqlite_storage = wallet.SqliteStorage(str(tmp_path / "wallet.db"))
+    assert json_storage.state_path("ledger_checkpoints.json") != sqlite_storage.state_path("ledger_checkpoints.json")
+    assert json_storage.state_path("portfolio_history.json") != sqlite_storage.state_path("portfolio_history.json")
@@ -1,36 +1,796 @@
+import argparse
+import csv
+import functools
+import hashlib
+import heapq
 import json
+import operator
+import os
+import queue
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
 import tkinter as tk
-from tkinter import ttk, messagebox
-from datetime import datetime
-import requests
-import dateparser
+from tkinter import ttk, messagebox, filedialog
+from datetime import datetime, timedelta
+
+# Durata (in secondi) per cui un prezzo in cache è considerato fresco
+PRICE_CACHE_TTL = 60
+# Oltre il TTL il prezzo è "stale": viene servito subito e aggiornato in background,
+# oltre questa soglia invece viene richiesto di nuovo in modo sincrono
+PRICE_CACHE_STALE_TTL = 15 * 60
+# Timeout delle richieste HTTP verso CoinGecko
+PRICE_REQUEST_TIMEOUT = 10
+# Endpoint di CoinGecko (sovrascrivibile con WALLET_COINGECKO_URL, es. per un server di test locale)
+COINGECKO_BASE_URL = "https://api.coingecko.com/api/v3"
+# Limiti di una singola richiesta /simple/price
+COINGECKO_MAX_IDS_PER_REQUEST = 100
+COINGECKO_MAX_URL_LENGTH = 2000
+# Limite di frequenza dell'API pubblica e nuovi tentativi su 429/5xx (attesa base e massima in secondi)
+COINGECKO_REQUESTS_PER_MINUTE = 10
+COINGECKO_BURST = 5
+COINGECKO_MAX_RETRIES = 4
+COINGECKO_BACKOFF = 1.0
+COINGECKO_BACKOFF_MAX = 60.0
+COINGECKO_POOL_SIZE = 4
+# Fonti dei prezzi crypto in ordine di priorità (sovrascrivibili con WALLET_PRICE_SOURCES)
+PRICE_SOURCES = "coingecko"
+# Intervallo di aggiornamento dei prezzi in background e di polling della GUI
+PRICE_REFRESH_INTERVAL = 60
+PRICE_POLL_INTERVAL_MS = 500
+# Pausa fra le fasi del caricamento iniziale della GUI, per lasciare ridisegnare la finestra
+STARTUP_STEP_DELAY_MS = 1
+# Parti dei dati che la GUI aggiorna separatamente e attesa prima di applicare le modifiche accumulate
+REFRESH_PARTS = ("ledger", "prices", "deposits", "properties")
+REFRESH_DELAY_MS = 50
+# Intervallo minimo (in secondi) fra due controlli su disco di un dato già caricato da DataManager
+DATASET_CHECK_INTERVAL = 1.0
+
+# Formato con cui l'applicazione scrive i timestamp; i formati noti vengono letti
+# con strptime e solo gli input insoliti passano da dateparser
+TIMESTAMP_FORMAT = "%b %d, %Y %H:%M:%S"
+KNOWN_TIMESTAMP_FORMATS = (TIMESTAMP_FORMAT, "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S")
+TIMESTAMP_CACHE_SIZE = 1 << 17
+# Le transazioni salvano il timestamp in ISO 8601, ordinabile come stringa
+TRANSACTION_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+# Versione del formato su disco dei file delle transazioni
+TRANSACTIONS_SCHEMA_VERSION = 3
+
+# Ogni quante transazioni il ledger incrementale salva un checkpoint dello stato
+LEDGER_CHECKPOINT_INTERVAL = 1000
+LEDGER_ENGINE = "python"
+COLUMNAR_LEDGER_MIN_ROWS = 5000  # sotto questa soglia il motore colonnare non conviene comunque
+# Numero di record nel journal oltre il quale vengono consolidati nel file JSON principale
+JOURNAL_COMPACTION_THRESHOLD = 500
+# Backend di salvataggio predefinito ("json" o "sqlite"), sovrascrivibile con WALLET_STORAGE
+STORAGE_BACKEND = "json"
 
 def datetime_to_string(obj):
     if isinstance(obj, datetime):
         return obj.strftime("%Y-%m-%d %H:%M:%S")
     raise TypeError("Tipo non serializzabile")
 
-    
-# ======================= DataManager Class =======================
+def parse_date_text(value):
+    # dateparser carica all'import le tabelle di tutte le lingue: viene importato
+    # solo alla prima data in formato libero invece che all'avvio
+    import dateparser
+    return dateparser.parse(value, languages=['it', 'en'])
 
-class DataManager:
-    def __init__(self):
-        self.crypto_transactions_path = "data/crypto_transactions.json"
-        self.fiat_transactions_path = "data/fiat_transactions.json"
-        self.crypto_valute_path = "data/crypto_valute.json"
-        self.etf_valute_path = "data/etf_valute.json"
-        self.percentuali_target_path = "data/percentuali_target.json"
-        self.conto_deposito_path = "data/conto_deposito.json"
-        self.immobili_data_path = "data/immobili.json"
-        self.selling_prices_path = "data/selling_prices.json"
-
-        self.manual_etf_prices = self.load_manual_etf_prices()
-        self.percentuali_target = self.load_percentuali_target()
-        self.crypto_mapping = self.load_crypto_valute_mapping()
-        self.etf_mapping = self.load_etf_valute_mapping()
-        self.conto_deposito = self.load_conto_deposito()  
-        self.immobili_data = self.load_immobili_data()
-        self.selling_prices = self.load_selling_prices()
+@functools.lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def parse_timestamp(value):
+    for timestamp_format in KNOWN_TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(value, timestamp_format)
+        except ValueError:
+            pass
+    return parse_date_text(value)
+
+def now_timestamp():
+    return datetime.now().strftime(TRANSACTION_TIMESTAMP_FORMAT)
+
+def format_timestamp(value):
+    parsed = parse_timestamp(value)
+    return parsed.strftime(TIMESTAMP_FORMAT) if parsed else value
+
+def format_number(value):
+    return f"{value:.8f}".rstrip("0").rstrip(".")
+
+
+def write_json_atomic(path, data, **kwargs):
+    # Scrive su un file temporaneo e lo sostituisce all'originale: un crash a metà
+    # scrittura lascia intatto il file precedente
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, **kwargs)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# ======================= Transaction Schema =======================
+
+def parse_legacy_number(text):
+    # Nel vecchio formato gli importi sono stringhe come "0.25 BTC"; Price e Trade Fee
+    # non numerici (es. "--") valevano 0
+    number = text.split()[0]
+    return float(number) if number.replace(".", "", 1).isdigit() else 0.0
+
+def legacy_currency(text, default):
+    parts = text.split()
+    return parts[1] if len(parts) > 1 else default
+
+def normalize_timestamp(value):
+    parsed = parse_timestamp(value)
+    return parsed.strftime(TRANSACTION_TIMESTAMP_FORMAT) if parsed else value
+
+def new_transaction_id():
+    return uuid.uuid4().hex
+
+def transactions_schema(data, path):
+    # Il formato originale era una lista senza versione; uno schema più recente
+    # viene da una versione successiva dell'applicazione e non va toccato
+    schema = 1 if isinstance(data, list) else data.get("Schema", 1)
+    if schema > TRANSACTIONS_SCHEMA_VERSION:
+        raise ValueError(f"{path}: schema {schema} più recente di quello supportato ({TRANSACTIONS_SCHEMA_VERSION}), aggiornare l'applicazione")
+    return schema
+
+def migrate_crypto_transaction(tx):
+    # Schema 2 -> 3: i record tipizzati ricevono solo l'ID
+    if isinstance(tx.get("Filled Amount"), (int, float)):
+        return tx if "ID" in tx else {"ID": new_transaction_id(), **tx}
+
+    base_currency, quote_currency = tx["Pair"].split("/")
+    return {
+        "ID": new_transaction_id(),
+        "Timestamp": normalize_timestamp(tx["Timestamp"]),
+        "Pair": tx["Pair"],
+        "Base": base_currency,
+        "Quote": quote_currency,
+        "Side": tx["Side"],
+        "Price": parse_legacy_number(tx["Price"]),
+        "Order Amount": float(tx["Order Amount"].split()[0]),
+        "Filled Amount": float(tx["Filled Amount"].split()[0]),
+        "Executed Amount": float(tx["Executed Amount"].split()[0]),
+        "Trade Fee": parse_legacy_number(tx["Trade Fee"]),
+        "Fee Currency": legacy_currency(tx["Trade Fee"], base_currency),
+        "Info": tx.get("Info", "Transazione")
+    }
+
+def migrate_fiat_transaction(tx):
+    if isinstance(tx.get("Filled Amount"), (int, float)):
+        return tx if "ID" in tx else {"ID": new_transaction_id(), **tx}
+
+    return {
+        "ID": new_transaction_id(),
+        "Timestamp": normalize_timestamp(tx["Timestamp"]),
+        "Type": tx["Type"],
+        "Filled Amount": float(tx["Filled Amount"].replace(',', '.').split()[0]),
+        "Currency": legacy_currency(tx["Filled Amount"], "EUR"),
+        "Info": tx.get("Info", "N/D")
+    }
+
+def apply_journal(transactions, entries):
+    # Le voci del journal sono inserimenti/modifiche ("Record", per ID) o eliminazioni ("Delete")
+    if not entries:
+        return transactions
+    by_id = {tx["ID"]: tx for tx in transactions}
+    for entry in entries:
+        if "Delete" in entry:
+            by_id.pop(entry["Delete"], None)
+        else:
+            by_id[entry["Record"]["ID"]] = entry["Record"]
+    return list(by_id.values())
+
+
+# ======================= TransactionJournal Class =======================
+
+class TransactionJournal:
+    def __init__(self, path):
+        self.path = path
+        self.last_seq = None
+        self.count = None
+
+    def read(self, after_seq=0):
+        entries = []
+        last_seq = 0
+        count = 0
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Riga troncata da un crash durante la scrittura: viene ignorata
+                        continue
+                    last_seq = max(last_seq, entry.get("Seq", 0))
+                    if "Record" in entry or "Delete" in entry:
+                        count += 1
+                        if entry["Seq"] > after_seq:
+                            entries.append(entry)
+        except FileNotFoundError:
+            pass
+        # La sequenza riparte dall'ultimo valore noto, incluso quello già consolidato nello snapshot
+        self.last_seq = max(last_seq, after_seq, self.last_seq or 0)
+        self.count = count
+        return entries
+
+    def append(self, record):
+        return self.write_entry({"Record": record})
+
+    def delete(self, tx_id):
+        return self.write_entry({"Delete": tx_id})
+
+    def write_entry(self, entry):
+        if self.last_seq is None:
+            self.read()
+        self.last_seq += 1
+        line = json.dumps({"Seq": self.last_seq, **entry}) + "\n"
+        with open(self.path, 'a+b') as f:
+            # Se l'ultima riga è stata troncata la si chiude, così il nuovo record resta leggibile
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    line = "\n" + line
+            f.write(line.encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        self.count = (self.count or 0) + 1
+        return self.last_seq
+
+    def reset(self):
+        # Dopo la compattazione il journal conserva solo l'ultimo numero di sequenza
+        if self.last_seq is None:
+            self.read()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps({"Seq": self.last_seq}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.count = 0
+
+
+# ======================= CoinGeckoClient Class =======================
+
+class PriceFetchError(Exception):
+    # Richiesta di prezzi fallita in tutto o in parte: porta con sé i prezzi ottenuti comunque
+    def __init__(self, message, prices=None):
+        super().__init__(message)
+        self.prices = prices or {}
+
+
+class TokenBucket:
+    # Limita le richieste a `rate` al secondo, con raffiche fino a `capacity`
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, sleep=time.sleep):
+        # Il gettone viene prenotato subito (il saldo può andare in negativo) e si attende
+        # fuori dal lock il tempo necessario a ripagarlo
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            sleep(wait)
+
+
+class CoinGeckoClient:
+    # Client HTTP per CoinGecko: sessione con connessioni riutilizzate, richieste suddivise in
+    # blocchi di ID, limite di frequenza e nuovi tentativi con attesa esponenziale su 429/5xx
+    def __init__(self, base_url=None, session=None, timeout=PRICE_REQUEST_TIMEOUT, rate_limiter=None,
+                 max_ids=COINGECKO_MAX_IDS_PER_REQUEST, max_url_length=COINGECKO_MAX_URL_LENGTH,
+                 max_retries=COINGECKO_MAX_RETRIES, backoff=COINGECKO_BACKOFF, sleep=time.sleep):
+        self.base_url = (base_url or os.environ.get("WALLET_COINGECKO_URL", COINGECKO_BASE_URL)).rstrip("/")
+        # La sessione (e l'import di requests) viene creata alla prima richiesta
+        self.session = session
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter or TokenBucket(COINGECKO_REQUESTS_PER_MINUTE / 60, COINGECKO_BURST)
+        self.max_ids = max_ids
+        self.max_url_length = max_url_length
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.sleep = sleep
+
+    def create_session(self):
+        import requests
+        session = requests.Session()
+        session.headers["Accept"] = "application/json"
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=COINGECKO_POOL_SIZE)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def chunks(self, coin_ids, fixed_length):
+        # Blocchi che rispettano sia il numero massimo di ID sia la lunghezza massima dell'URL
+        chunk = []
+        length = fixed_length
+        for coin_id in coin_ids:
+            # Nella query la virgola tra gli ID viene codificata come %2C
+            extra = len(coin_id) + (3 if chunk else 0)
+            if chunk and (len(chunk) >= self.max_ids or length + extra > self.max_url_length):
+                yield chunk
+                chunk = []
+                length = fixed_length
+                extra = len(coin_id)
+            chunk.append(coin_id)
+            length += extra
+        if chunk:
+            yield chunk
+
+    def simple_price(self, coin_ids, vs_currencies=("usd", "eur")):
+        # Un blocco che fallisce non annulla gli altri: l'errore riporta i prezzi ottenuti
+        url = f"{self.base_url}/simple/price"
+        currencies = ",".join(vs_currencies)
+        fixed_length = len(url) + len("?ids=&vs_currencies=") + len(currencies) + 2 * (len(vs_currencies) - 1)
+        import requests
+        prices = {}
+        errors = []
+        for chunk in self.chunks(coin_ids, fixed_length):
+            try:
+                prices.update(self.get_json(url, {"ids": ",".join(chunk), "vs_currencies": currencies}))
+            except (requests.RequestException, ValueError) as e:
+                errors.append(f"Errore durante la richiesta API ({len(chunk)} ID): {e}")
+        if errors:
+            raise PriceFetchError("; ".join(errors), prices)
+        return prices
+
+    def get_json(self, url, params):
+        import requests
+        if self.session is None:
+            self.session = self.create_session()
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire(self.sleep)
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                self.sleep(self.retry_delay(attempt))
+                continue
+
+            if response.status_code == 429 or response.status_code >= 500:
+                if attempt == self.max_retries:
+                    response.raise_for_status()
+                self.sleep(self.retry_delay(attempt, response.headers.get("Retry-After")))
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    def retry_delay(self, attempt, retry_after=None):
+        # Retry-After (in secondi) ha la precedenza; altrimenti attesa esponenziale con jitter
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), COINGECKO_BACKOFF_MAX)
+            except ValueError:
+                pass
+        delay = min(self.backoff * (2 ** attempt), COINGECKO_BACKOFF_MAX)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+# ======================= PriceProvider Classes =======================
+
+# Ogni fonte espone prices(coin_ids) -> {coin_id: {"usd": ..., "eur": ...}} e restituisce solo gli ID che conosce
+
+class CoinGeckoPriceProvider:
+    def __init__(self, client=None, price_history=None):
+        self.client = client or CoinGeckoClient()
+        self.price_history = price_history
+
+    def prices(self, coin_ids):
+        try:
+            prices = self.client.simple_price(coin_ids)
+        except PriceFetchError as e:
+            self.record(e.prices)
+            raise
+        self.record(prices)
+        return prices
+
+    def record(self, prices):
+        if self.price_history is not None and prices:
+            self.price_history.append_crypto_snapshot(prices)
+
+
+class FilePriceProvider:
+    # Prezzi da un file JSON {coin_id: {"usd": ..., "eur": ...}}, riletto solo quando cambia
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.data = {}
+
+    def load(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self.mtime:
+            with open(self.path, 'r') as f:
+                self.data = self.read(f)
+            self.mtime = mtime
+        return self.data
+
+    def read(self, f):
+        return json.load(f)
+
+    def prices(self, coin_ids):
+        data = self.load()
+        return {coin_id: data[coin_id] for coin_id in coin_ids if coin_id in data}
+
+
+class ReplayPriceProvider(FilePriceProvider):
+    # Riproduce una registrazione di RecordingPriceProvider: per ogni ID vale l'ultimo prezzo registrato
+    def read(self, f):
+        data = {}
+        for line in f:
+            try:
+                data.update(json.loads(line)["Prices"])
+            except (json.JSONDecodeError, KeyError):
+                # Riga troncata da un'interruzione durante la registrazione
+                continue
+        return data
+
+
+class RecordingPriceProvider:
+    # Registra ogni risposta della fonte sottostante in un file JSON lines riproducibile offline
+    def __init__(self, provider, path):
+        self.provider = provider
+        self.path = path
+        self.lock = threading.Lock()
+
+    def prices(self, coin_ids):
+        try:
+            prices = self.provider.prices(coin_ids)
+        except PriceFetchError as e:
+            self.record(e.prices)
+            raise
+        self.record(prices)
+        return prices
+
+    def record(self, prices):
+        if prices:
+            line = json.dumps({"Timestamp": time.time(), "Prices": prices}) + "\n"
+            with self.lock, open(self.path, 'a') as f:
+                f.write(line)
+
+
+class HistoryPriceProvider:
+    # Ultimi prezzi salvati nello storico SQLite
+    def __init__(self, price_history):
+        self.price_history = price_history
+
+    def prices(self, coin_ids):
+        latest = self.price_history.latest_prices("crypto")
+        return {coin_id: latest[coin_id][1] for coin_id in coin_ids if coin_id in latest}
+
+
+class CompositePriceProvider:
+    # Interroga le fonti in ordine di priorità, chiedendo a ciascuna solo gli ID ancora mancanti
+    def __init__(self, providers):
+        self.providers = providers
+
+    def prices(self, coin_ids):
+        prices = {}
+        errors = []
+        missing = list(coin_ids)
+        for provider in self.providers:
+            if not missing:
+                break
+            try:
+                prices.update(provider.prices(missing))
+            except PriceFetchError as e:
+                prices.update(e.prices)
+                errors.append(f"Errore nella fonte di prezzi {type(provider).__name__}: {e}")
+            except (OSError, ValueError) as e:
+                errors.append(f"Errore nella fonte di prezzi {type(provider).__name__}: {e}")
+            missing = [coin_id for coin_id in missing if coin_id not in prices]
+        if errors:
+            raise PriceFetchError("; ".join(errors), prices)
+        return prices
+
+
+def create_price_provider(sources=None, price_history=None, recording_path=None):
+    # sources: elenco separato da virgole, in ordine di priorità, es. "replay:data/prices.jsonl,coingecko,history"
+    sources = sources or os.environ.get("WALLET_PRICE_SOURCES", PRICE_SOURCES)
+    recording_path = recording_path or os.environ.get("WALLET_PRICE_RECORDING")
+    providers = []
+    for source in sources.split(","):
+        kind, _, path = source.strip().partition(":")
+        if kind == "coingecko":
+            provider = CoinGeckoPriceProvider(price_history=price_history)
+            # Si registrano solo i prezzi scaricati, non quelli già letti da file o dallo storico
+            providers.append(RecordingPriceProvider(provider, recording_path) if recording_path else provider)
+        elif kind == "file" and path:
+            providers.append(FilePriceProvider(path))
+        elif kind == "replay" and path:
+            providers.append(ReplayPriceProvider(path))
+        elif kind == "history" and price_history is not None:
+            providers.append(HistoryPriceProvider(price_history))
+        else:
+            raise ValueError(f"Fonte di prezzi non valida: {source}")
+    return providers[0] if len(providers) == 1 else CompositePriceProvider(providers)
+
+
+# ======================= PriceCache Class =======================
+
+class PriceCache:
+    def __init__(self, fetch_prices, ttl=PRICE_CACHE_TTL, stale_ttl=PRICE_CACHE_STALE_TTL):
+        self.fetch_prices = fetch_prices
+        self.ttl = ttl
+        self.stale_ttl = max(stale_ttl, ttl)
+        self.entries = {}  # coin_id -> (istante di fetch, {"usd": ..., "eur": ...})
+        self.failures = {}  # coin_id -> istante dell'ultimo fetch fallito
+        self.in_flight = set()
+        self.last_error = None
+        self.lock = threading.Lock()
+
+    def get(self, coin_ids):
+        now = time.time()
+        prices = {}
+        stale = []
+        missing = []
+
+        with self.lock:
+            for coin_id in coin_ids:
+                entry = self.entries.get(coin_id)
+                age = now - entry[0] if entry else None
+                if entry is not None and age <= self.stale_ttl:
+                    prices[coin_id] = entry[1]
+                    if age > self.ttl and coin_id not in self.in_flight:
+                        stale.append(coin_id)
+                elif now - self.failures.get(coin_id, 0) > self.ttl and coin_id not in self.in_flight:
+                    # Dopo un errore non si riprova prima del TTL, per non bloccare ogni refresh
+                    missing.append(coin_id)
+                elif entry is not None:
+                    # Richiesta fallita da poco: meglio l'ultimo prezzo noto che un valore nullo
+                    prices[coin_id] = entry[1]
+
+        if missing:
+            # Un'unica richiesta sincrona per i prezzi mancanti, che rinfresca anche quelli stale;
+            # un errore resta in last_error e si usano i prezzi ottenuti comunque
+            try:
+                prices.update(self.refresh(missing + stale))
+            except PriceFetchError as e:
+                prices.update(e.prices)
+            with self.lock:
+                for coin_id in missing:
+                    if coin_id not in prices and coin_id in self.entries:
+                        prices[coin_id] = self.entries[coin_id][1]
+        elif stale:
+            self.revalidate(stale)
+
+        return prices
+
+    def prime(self, entries):
+        # Carica prezzi noti (es. dallo storico su disco) senza sovrascrivere quelli più recenti
+        with self.lock:
+            for coin_id, (timestamp, prices) in entries.items():
+                current = self.entries.get(coin_id)
+                if current is None or current[0] < timestamp:
+                    self.entries[coin_id] = (timestamp, prices)
+
+    def peek(self, coin_ids):
+        # Restituisce i prezzi già in cache, di qualsiasi età, senza mai fare richieste
+        with self.lock:
+            return {coin_id: self.entries[coin_id][1] for coin_id in coin_ids if coin_id in self.entries}
+
+    def refresh(self, coin_ids):
+        with self.lock:
+            coin_ids = [coin_id for coin_id in coin_ids if coin_id not in self.in_flight]
+            self.in_flight.update(coin_ids)
+        if not coin_ids:
+            return {}
+
+        error = None
+        try:
+            fetched = self.fetch_prices(coin_ids)
+        except PriceFetchError as e:
+            fetched = e.prices
+            error = e
+        finally:
+            now = time.time()
+            with self.lock:
+                self.in_flight.difference_update(coin_ids)
+
+        with self.lock:
+            for coin_id in coin_ids:
+                if coin_id in fetched:
+                    self.entries[coin_id] = (now, fetched[coin_id])
+                    self.failures.pop(coin_id, None)
+                else:
+                    self.failures[coin_id] = now
+            self.last_error = str(error) if error is not None else None
+        prices = {coin_id: fetched[coin_id] for coin_id in coin_ids if coin_id in fetched}
+        if error is not None:
+            raise PriceFetchError(str(error), prices)
+        return prices
+
+    def revalidate(self, coin_ids):
+        threading.Thread(target=self.revalidate_quietly, args=(coin_ids,), daemon=True).start()
+
+    def revalidate_quietly(self, coin_ids):
+        # L'errore resta in last_error: lo riporta il prossimo aggiornamento del worker
+        try:
+            self.refresh(coin_ids)
+        except PriceFetchError:
+            pass
+
+    def invalidate(self, coin_ids=None):
+        with self.lock:
+            if coin_ids is None:
+                self.entries.clear()
+                self.failures.clear()
+            else:
+                for coin_id in coin_ids:
+                    self.entries.pop(coin_id, None)
+                    self.failures.pop(coin_id, None)
+
+
+# ======================= PriceRefreshWorker Class =======================
+
+class PriceRefreshWorker:
+    def __init__(self, data_manager, interval=PRICE_REFRESH_INTERVAL):
+        self.data_manager = data_manager
+        self.interval = interval
+        self.snapshots = queue.Queue()
+        self.wakeup = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.run, name="price-refresh", daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                prices = self.data_manager.refresh_crypto_prices()
+            except PriceFetchError as e:
+                # Aggiornamento parziale: si pubblicano i prezzi disponibili e poi l'errore
+                if e.prices:
+                    self.snapshots.put(("prices", e.prices))
+                self.snapshots.put(("error", f"Errore durante l'aggiornamento dei prezzi: {e}"))
+                prices = {}
+            except Exception as e:
+                # L'errore viaggia sulla stessa coda degli snapshot e lo mostra la GUI
+                self.snapshots.put(("error", f"Errore durante l'aggiornamento dei prezzi: {e}"))
+                prices = {}
+            if prices:
+                self.snapshots.put(("prices", prices))
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+    def request_refresh(self):
+        self.wakeup.set()
+
+    def stop(self):
+        self.stop_event.set()
+        self.wakeup.set()
+
+    def poll(self):
+        # Restituisce solo lo snapshot più recente tra quelli in coda e l'ultimo errore,
+        # a meno che dopo l'errore non sia arrivato uno snapshot valido
+        latest = None
+        error = None
+        while True:
+            try:
+                kind, value = self.snapshots.get_nowait()
+            except queue.Empty:
+                return latest, error
+            if kind == "error":
+                error = value
+            else:
+                latest = value
+                error = None
+
+
+# ======================= PriceHistoryStore Class =======================
+
+class PriceHistoryStore:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.initialize()
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=PRICE_REQUEST_TIMEOUT)
+
+    def initialize(self):
+        # Una riga per (tipo, asset, istante): la chiave primaria fa anche da indice per le query per intervallo
+        with self.lock, closing(self.connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS prices (
+                    kind TEXT NOT NULL,
+                    asset TEXT NOT NULL,
+                    timestamp REAL NOT NULL,
+                    usd REAL,
+                    eur REAL,
+                    PRIMARY KEY (kind, asset, timestamp)
+                ) WITHOUT ROWID
+            """)
+
+    def append_rows(self, rows):
+        with self.lock, closing(self.connect()) as conn, conn:
+            conn.executemany("INSERT OR REPLACE INTO prices (kind, asset, timestamp, usd, eur) VALUES (?, ?, ?, ?, ?)", rows)
+
+    def append_crypto_snapshot(self, prices, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        rows = [("crypto", coin_id, timestamp, values.get('usd'), values.get('eur')) for coin_id, values in prices.items()]
+        if rows:
+            self.append_rows(rows)
+
+    def append_etf_price(self, etf_name, price, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        self.append_rows([("etf", etf_name, timestamp, None, price)])
+
+    def latest_prices(self, kind="crypto"):
+        # SQLite restituisce usd/eur della riga con il timestamp massimo per ogni asset
+        with self.lock, closing(self.connect()) as conn:
+            rows = conn.execute(
+                "SELECT asset, MAX(timestamp), usd, eur FROM prices WHERE kind = ? GROUP BY asset", (kind,)
+            ).fetchall()
+        return {asset: (timestamp, {'usd': usd, 'eur': eur}) for asset, timestamp, usd, eur in rows}
+
+    def price_range(self, asset, start=None, end=None, kind="crypto"):
+        start = float('-inf') if start is None else start
+        end = float('inf') if end is None else end
+        with self.lock, closing(self.connect()) as conn:
+            return conn.execute(
+                "SELECT timestamp, usd, eur FROM prices WHERE kind = ? AND asset = ? AND timestamp BETWEEN ? AND ? ORDER BY timestamp",
+                (kind, asset, start, end)
+            ).fetchall()
+
+    def price_at(self, asset, timestamp, kind="crypto"):
+        # Ultimo prezzo noto all'istante richiesto
+        with self.lock, closing(self.connect()) as conn:
+            row = conn.execute(
+                "SELECT timestamp, usd, eur FROM prices WHERE kind = ? AND asset = ? AND timestamp <= ? ORDER BY timestamp DESC LIMIT 1",
+                (kind, asset, timestamp)
+            ).fetchone()
+        return row
+
+
+# ======================= JsonStorage Class =======================
+
+class JsonStorage:
+    def __init__(self, data_dir="data"):
+        self.data_dir = data_dir
+        self.crypto_transactions_path = os.path.join(data_dir, "crypto_transactions.json")
+        self.fiat_transactions_path = os.path.join(data_dir, "fiat_transactions.json")
+        self.crypto_valute_path = os.path.join(data_dir, "crypto_valute.json")
+        self.etf_valute_path = os.path.join(data_dir, "etf_valute.json")
+        self.percentuali_target_path = os.path.join(data_dir, "percentuali_target.json")
+        self.conto_deposito_path = os.path.join(data_dir, "conto_deposito.json")
+        self.immobili_data_path = os.path.join(data_dir, "immobili.json")
+        self.selling_prices_path = os.path.join(data_dir, "selling_prices.json")
+        self.dataset_paths = {
+            "etf_prices": self.etf_valute_path,
+            "percentuali_target": self.percentuali_target_path,
+            "crypto_mapping": self.crypto_valute_path,
+            "conto_deposito": self.conto_deposito_path,
+            "immobili": self.immobili_data_path,
+            "selling_prices": self.selling_prices_path
+        }
+        self.crypto_journal = TransactionJournal(os.path.join(data_dir, "crypto_transactions.journal"))
+        self.fiat_journal = TransactionJournal(os.path.join(data_dir, "fiat_transactions.journal"))
+        # ID presenti dopo l'ultima lettura: modifiche ed eliminazioni di ID sconosciuti non finiscono nel journal
+        self.crypto_ids = None
+        self.fiat_ids = None
+
+    def state_path(self, name):
+        return os.path.join(self.data_dir, name)
 
     def load_immobili_data(self):
         try:
@@ -42,42 +802,55 @@ class DataManager:
                 json.dump(immobili_data, f, indent=4)
         return immobili_data
 
-    def save_immobili_data(self):
-        with open(self.immobili_data_path, 'w') as f:
-            json.dump(self.immobili_data, f, indent=4)
+    def save_immobili_data(self, immobili_data):
+        write_json_atomic(self.immobili_data_path, immobili_data, indent=4)
+
+    def insert_immobile(self, immobile, immobili_data):
+        self.save_immobili_data(immobili_data)
+
+    def update_immobile(self, immobile, immobili_data):
+        self.save_immobili_data(immobili_data)
 
     def load_conto_deposito(self):
         try:
             with open(self.conto_deposito_path, 'r') as f:
                 conto_deposito_data = json.load(f)
                 for deposito in conto_deposito_data["Conto deposito"]:
-                    # Usa dateparser.parse per convertire la data in un oggetto datetime
-                    deposito["Scadenza"] = dateparser.parse(deposito["Scadenza"], languages=['it', 'en'])
+                    # Converte la data in un oggetto datetime (dateparser solo per formati non standard)
+                    deposito["Scadenza"] = parse_timestamp(deposito["Scadenza"])
                 return conto_deposito_data
         except FileNotFoundError:
             return {"Conto deposito": []}
 
+    def save_conto_deposito(self, conto_deposito):
+        write_json_atomic(self.conto_deposito_path, conto_deposito, indent=4, default=datetime_to_string)
 
-    
-    def load_manual_etf_prices(self):
+    def load_etf_prices(self):
         with open(self.etf_valute_path, 'r') as f:
             etf_data = json.load(f)
         return etf_data
 
+    def save_etf_prices(self, etf_prices):
+        write_json_atomic(self.etf_valute_path, etf_prices, indent=4)
+
+    def update_etf_price(self, etf_name, price, etf_prices):
+        self.save_etf_prices(etf_prices)
+
     def load_percentuali_target(self):
         with open(self.percentuali_target_path, 'r') as f:
             percentuali_target = json.load(f)
         return percentuali_target
 
-    def load_crypto_valute_mapping(self):
+    def save_percentuali_target(self, percentuali_target):
+        write_json_atomic(self.percentuali_target_path, percentuali_target, indent=4)
+
+    def load_crypto_mapping(self):
         with open(self.crypto_valute_path, 'r') as f:
             crypto_mapping = json.load(f)
         return crypto_mapping
 
-    def load_etf_valute_mapping(self):
-        with open(self.etf_valute_path, 'r') as f:
-            etf_mapping = json.load(f)
-        return etf_mapping
+    def save_crypto_mapping(self, crypto_mapping):
+        write_json_atomic(self.crypto_valute_path, crypto_mapping, indent=4)
 
     def load_selling_prices(self):
         try:
@@ -87,56 +860,1305 @@ class DataManager:
             return {}
 
     def save_selling_prices(self, selling_prices):
-        with open(self.selling_prices_path, 'w') as f:
-            json.dump(selling_prices, f, indent=4)
+        write_json_atomic(self.selling_prices_path, selling_prices, indent=4)
 
-    def get_current_crypto_prices(self):
-        ids = ','.join(set(v for v in self.crypto_mapping.values() if isinstance(v, str)))
-        url = f"https://api.coingecko.com/api/v3/simple/price?ids={ids}&vs_currencies=usd,eur"
-
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            prices = response.json()
-            return prices
-        except requests.RequestException as e:
-            print(f"Errore durante la richiesta API: {e}")
-            return {}
-    
     def load_crypto_transactions(self):
         with open(self.crypto_transactions_path, 'r') as f:
-            crypto_transactions = json.load(f)
-        return crypto_transactions
+            crypto_data = json.load(f)
+        if transactions_schema(crypto_data, self.crypto_transactions_path) < TRANSACTIONS_SCHEMA_VERSION:
+            crypto_data = self.migrate_crypto_transactions(crypto_data)
+        # Lo snapshot viene completato con le modifiche registrate nel journal dopo l'ultima compattazione
+        transactions = apply_journal(crypto_data["Transactions"], self.crypto_journal.read(crypto_data.get("Journal Seq", 0)))
+        self.crypto_ids = {tx["ID"] for tx in transactions}
+        return transactions
 
     def save_crypto_transactions(self, transactions):
-        with open(self.crypto_transactions_path, 'w') as f:
-            json.dump(transactions, f, indent=4)
+        # Riscrittura completa (eliminazioni, migrazione, compattazione): il journal viene svuotato
+        if self.crypto_journal.last_seq is None:
+            self.crypto_journal.read()
+        write_json_atomic(self.crypto_transactions_path, {
+            "Schema": TRANSACTIONS_SCHEMA_VERSION,
+            "Journal Seq": self.crypto_journal.last_seq,
+            "Transactions": transactions
+        }, indent=4)
+        self.crypto_journal.reset()
+        self.crypto_ids = {tx["ID"] for tx in transactions}
+
+    def append_crypto_transaction(self, tx):
+        if self.crypto_journal.last_seq is None:
+            self.load_crypto_transactions()
+        self.crypto_journal.append(tx)
+        self.crypto_ids.add(tx["ID"])
+        self.compact_crypto_journal_if_needed()
+
+    def append_crypto_transactions(self, transactions):
+        # Import in blocco: una sola riscrittura dello snapshot invece di una voce di journal per riga
+        self.save_crypto_transactions(self.load_crypto_transactions() + transactions)
+
+    def update_crypto_transaction(self, tx):
+        # Il journal sostituisce il record con lo stesso ID
+        if self.crypto_ids is None:
+            self.load_crypto_transactions()
+        if tx.get("ID") not in self.crypto_ids:
+            return False
+        self.append_crypto_transaction(tx)
+        return True
+
+    def delete_crypto_transaction(self, tx_id):
+        if self.crypto_ids is None:
+            self.load_crypto_transactions()
+        if tx_id not in self.crypto_ids:
+            return False
+        self.crypto_journal.delete(tx_id)
+        self.crypto_ids.discard(tx_id)
+        self.compact_crypto_journal_if_needed()
+        return True
+
+    def compact_crypto_journal_if_needed(self):
+        if self.crypto_journal.count >= JOURNAL_COMPACTION_THRESHOLD:
+            self.compact_crypto_transactions()
+
+    def compact_crypto_transactions(self):
+        self.save_crypto_transactions(self.load_crypto_transactions())
+
+    def migrate_crypto_transactions(self, crypto_data):
+        # Conversione una tantum dai formati precedenti: record tipizzati (schema 2) e ID stabili (schema 3).
+        # Le voci ancora nel journal vengono consolidate nello snapshot migrato
+        legacy_transactions = crypto_data if isinstance(crypto_data, list) else crypto_data.get("Transactions", [])
+        journal_seq = 0 if isinstance(crypto_data, list) else crypto_data.get("Journal Seq", 0)
+        self.backup_file(self.crypto_transactions_path, crypto_data)
+        pending = [entry["Record"] for entry in self.crypto_journal.read(journal_seq) if "Record" in entry]
+        transactions = [migrate_crypto_transaction(tx) for tx in legacy_transactions + pending]
+        self.save_crypto_transactions(transactions)
+        return {"Schema": TRANSACTIONS_SCHEMA_VERSION, "Journal Seq": self.crypto_journal.last_seq, "Transactions": transactions}
 
     def load_fiat_transactions(self):
         try:
             with open(self.fiat_transactions_path, 'r') as f:
                 fiat_data = json.load(f)
         except (FileNotFoundError, json.JSONDecodeError):
-            fiat_data = {"Transactions": [], "EUR_Balance": 0}
+            fiat_data = {"Schema": TRANSACTIONS_SCHEMA_VERSION, "Transactions": [], "EUR_Balance": 0}
             with open(self.fiat_transactions_path, 'w') as f:
                 json.dump(fiat_data, f, indent=4)
+        if transactions_schema(fiat_data, self.fiat_transactions_path) < TRANSACTIONS_SCHEMA_VERSION:
+            fiat_data = self.migrate_fiat_transactions(fiat_data)
+        fiat_data["Transactions"] = apply_journal(fiat_data["Transactions"], self.fiat_journal.read(fiat_data.get("Journal Seq", 0)))
+        self.fiat_ids = {tx["ID"] for tx in fiat_data["Transactions"]}
         return fiat_data
 
+    def save_fiat_transactions(self, fiat_data):
+        if self.fiat_journal.last_seq is None:
+            self.fiat_journal.read()
+        fiat_data["Schema"] = TRANSACTIONS_SCHEMA_VERSION
+        fiat_data["Journal Seq"] = self.fiat_journal.last_seq
+        write_json_atomic(self.fiat_transactions_path, fiat_data, indent=4)
+        self.fiat_journal.reset()
+        self.fiat_ids = {tx["ID"] for tx in fiat_data.get("Transactions", [])}
+
+    def append_fiat_transaction(self, tx):
+        if self.fiat_journal.last_seq is None:
+            self.load_fiat_transactions()
+        self.fiat_journal.append(tx)
+        self.fiat_ids.add(tx["ID"])
+        self.compact_fiat_journal_if_needed()
+
+    def update_fiat_transaction(self, tx):
+        if self.fiat_ids is None:
+            self.load_fiat_transactions()
+        if tx.get("ID") not in self.fiat_ids:
+            return False
+        self.append_fiat_transaction(tx)
+        return True
+
+    def delete_fiat_transaction(self, tx_id):
+        if self.fiat_ids is None:
+            self.load_fiat_transactions()
+        if tx_id not in self.fiat_ids:
+            return False
+        self.fiat_journal.delete(tx_id)
+        self.fiat_ids.discard(tx_id)
+        self.compact_fiat_journal_if_needed()
+        return True
+
+    def compact_fiat_journal_if_needed(self):
+        if self.fiat_journal.count >= JOURNAL_COMPACTION_THRESHOLD:
+            self.compact_fiat_transactions()
+
+    def compact_fiat_transactions(self):
+        self.save_fiat_transactions(self.load_fiat_transactions())
+
+    def migrate_fiat_transactions(self, fiat_data):
+        self.backup_file(self.fiat_transactions_path, fiat_data)
+        pending = [entry["Record"] for entry in self.fiat_journal.read(fiat_data.get("Journal Seq", 0)) if "Record" in entry]
+        migrated = {
+            "Schema": TRANSACTIONS_SCHEMA_VERSION,
+            "EUR_Balance": fiat_data.get("EUR_Balance", 0),
+            "Transactions": [migrate_fiat_transaction(tx) for tx in fiat_data.get("Transactions", []) + pending]
+        }
+        self.save_fiat_transactions(migrated)
+        return migrated
+
+    def crypto_transactions_fingerprint(self):
+        fingerprint = []
+        for path in (self.crypto_transactions_path, self.crypto_journal.path):
+            try:
+                stat = os.stat(path)
+                fingerprint.extend((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                fingerprint.extend((0, 0))
+        return tuple(fingerprint)
+
+    def dataset_version(self, dataset):
+        try:
+            return os.stat(self.dataset_paths[dataset]).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def crypto_asset_totals(self):
+        totals = {}
+        for tx in self.load_crypto_transactions():
+            side_totals = totals.setdefault(tx["Base"], {}).setdefault(tx["Side"], {"Filled Amount": 0.0, "Executed Amount": 0.0, "Count": 0})
+            side_totals["Filled Amount"] += tx["Filled Amount"]
+            side_totals["Executed Amount"] += tx["Executed Amount"]
+            side_totals["Count"] += 1
+        return totals
+
+    def backup_file(self, path, data):
+        schema = transactions_schema(data, path)
+        with open(f"{path}.v{schema}.bak", 'w') as f:
+            json.dump(data, f, indent=4)
+
+    def dump(self):
+        return {
+            "crypto_transactions": self.load_crypto_transactions(),
+            "fiat_transactions": self.load_fiat_transactions(),
+            "conto_deposito": self.load_conto_deposito(),
+            "immobili": self.load_immobili_data(),
+            "etf_prices": self.load_etf_prices(),
+            "percentuali_target": self.load_percentuali_target(),
+            "crypto_mapping": self.load_crypto_mapping(),
+            "selling_prices": self.load_selling_prices()
+        }
+
+    def restore(self, datasets):
+        self.save_crypto_transactions(datasets["crypto_transactions"])
+        self.save_fiat_transactions(datasets["fiat_transactions"])
+        self.save_conto_deposito(datasets["conto_deposito"])
+        self.save_immobili_data(datasets["immobili"])
+        self.save_etf_prices(datasets["etf_prices"])
+        self.save_percentuali_target(datasets["percentuali_target"])
+        self.save_crypto_mapping(datasets["crypto_mapping"])
+        self.save_selling_prices(datasets["selling_prices"])
+
+
+# ======================= SqliteStorage Class =======================
+
+# Colonne SQL -> chiavi dei record usati dal resto dell'applicazione
+CRYPTO_TRANSACTION_COLUMNS = (
+    ("uid", "ID"), ("timestamp", "Timestamp"), ("pair", "Pair"), ("base", "Base"), ("quote", "Quote"), ("side", "Side"),
+    ("price", "Price"), ("order_amount", "Order Amount"), ("filled_amount", "Filled Amount"),
+    ("executed_amount", "Executed Amount"), ("trade_fee", "Trade Fee"), ("fee_currency", "Fee Currency"), ("info", "Info")
+)
+FIAT_TRANSACTION_COLUMNS = (
+    ("uid", "ID"), ("timestamp", "Timestamp"), ("type", "Type"), ("filled_amount", "Filled Amount"), ("currency", "Currency"), ("info", "Info")
+)
+DEPOSITO_COLUMNS = (
+    ("timestamp", "Timestamp"), ("type", "Type"), ("filled_amount", "Filled Amount"), ("scadenza", "Scadenza")
+)
+
+class SqliteStorage:
+    def __init__(self, path="data/wallet.db"):
+        self.path = path
+        self.lock = threading.RLock()
+        self.data_dir = os.path.dirname(path) or "."
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.initialize()
+
+    def state_path(self, name):
+        # File derivati (checkpoint, storico) separati da quelli del backend JSON: data/wallet_<nome>
+        prefix = os.path.splitext(os.path.basename(self.path))[0]
+        return os.path.join(self.data_dir, f"{prefix}_{name}")
+
+    def initialize(self):
+        crypto_columns = ", ".join(f"{column} {'REAL' if column.endswith(('price', 'amount', 'fee')) else 'TEXT'}" for column, _ in CRYPTO_TRANSACTION_COLUMNS)
+        with self.lock, self.connection:
+            self.connection.executescript(f"""
+                CREATE TABLE IF NOT EXISTS crypto_transactions (id INTEGER PRIMARY KEY, {crypto_columns});
+                CREATE INDEX IF NOT EXISTS idx_crypto_transactions_timestamp ON crypto_transactions (timestamp);
+                CREATE INDEX IF NOT EXISTS idx_crypto_transactions_base ON crypto_transactions (base, side);
+                CREATE TABLE IF NOT EXISTS fiat_transactions (
+                    id INTEGER PRIMARY KEY, uid TEXT, timestamp TEXT, type TEXT, filled_amount REAL, currency TEXT, info TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_fiat_transactions_timestamp ON fiat_transactions (timestamp);
+                CREATE TABLE IF NOT EXISTS conto_deposito (
+                    id INTEGER PRIMARY KEY, timestamp TEXT, type TEXT, filled_amount TEXT, scadenza TEXT
+                );
+                CREATE TABLE IF NOT EXISTS immobili (id TEXT PRIMARY KEY, position INTEGER, data TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS etf_prices (name TEXT PRIMARY KEY, price REAL);
+                CREATE TABLE IF NOT EXISTS targets (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS crypto_mapping (pair TEXT PRIMARY KEY, coin_id TEXT);
+                CREATE TABLE IF NOT EXISTS selling_prices (currency TEXT PRIMARY KEY, price REAL);
+                CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            """)
+            # I database creati prima degli ID stabili ricevono la colonna uid, valorizzata per le righe esistenti
+            for table in ("crypto_transactions", "fiat_transactions"):
+                columns = [row[1] for row in self.connection.execute(f"PRAGMA table_info({table})")]
+                if "uid" not in columns:
+                    self.connection.execute(f"ALTER TABLE {table} ADD COLUMN uid TEXT")
+                self.connection.execute(f"UPDATE {table} SET uid = lower(hex(randomblob(16))) WHERE uid IS NULL")
+                self.connection.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_uid ON {table} (uid)")
+
+    def is_empty(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM settings").fetchone()[0] == 0
+
+    def get_setting(self, key, default=None):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_setting(self, key, value):
+        self.connection.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def bump_crypto_version(self):
+        # Contatore delle modifiche: fa da fingerprint per i checkpoint del ledger
+        self.set_setting("crypto_version", self.get_setting("crypto_version", 0) + 1)
+
+    def load_immobili_data(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT data FROM immobili ORDER BY position").fetchall()
+        return {"Immobili": [json.loads(data) for data, in rows]}
+
+    def save_immobili_data(self, immobili_data):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM immobili")
+            self.connection.executemany(
+                "INSERT INTO immobili (id, position, data) VALUES (?, ?, ?)",
+                [(immobile["ID"], position, json.dumps(immobile)) for position, immobile in enumerate(immobili_data["Immobili"])]
+            )
+
+    def insert_immobile(self, immobile, immobili_data):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO immobili (id, position, data) VALUES (?, (SELECT COALESCE(MAX(position), -1) + 1 FROM immobili), ?)",
+                (immobile["ID"], json.dumps(immobile))
+            )
+
+    def update_immobile(self, immobile, immobili_data):
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE immobili SET data = ? WHERE id = ?", (json.dumps(immobile), immobile["ID"]))
+
+    def load_conto_deposito(self):
+        columns = ", ".join(column for column, _ in DEPOSITO_COLUMNS)
+        with self.lock:
+            rows = self.connection.execute(f"SELECT {columns} FROM conto_deposito ORDER BY id").fetchall()
+        depositi = [dict(zip((key for _, key in DEPOSITO_COLUMNS), row)) for row in rows]
+        for deposito in depositi:
+            deposito["Scadenza"] = parse_timestamp(deposito["Scadenza"])
+        return {"Conto deposito": depositi}
+
+    def save_conto_deposito(self, conto_deposito):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM conto_deposito")
+            self.connection.executemany(
+                "INSERT INTO conto_deposito (timestamp, type, filled_amount, scadenza) VALUES (?, ?, ?, ?)",
+                [
+                    (deposito["Timestamp"], deposito["Type"], deposito["Filled Amount"], datetime_to_string(deposito["Scadenza"]) if isinstance(deposito["Scadenza"], datetime) else deposito["Scadenza"])
+                    for deposito in conto_deposito["Conto deposito"]
+                ]
+            )
+
+    def load_etf_prices(self):
+        with self.lock:
+            return dict(self.connection.execute("SELECT name, price FROM etf_prices ORDER BY rowid").fetchall())
+
+    def save_etf_prices(self, etf_prices):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM etf_prices")
+            self.connection.executemany("INSERT INTO etf_prices (name, price) VALUES (?, ?)", etf_prices.items())
+
+    def update_etf_price(self, etf_name, price, etf_prices):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO etf_prices (name, price) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET price = excluded.price",
+                (etf_name, price)
+            )
+
+    def load_percentuali_target(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT key, value FROM targets ORDER BY rowid").fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def save_percentuali_target(self, percentuali_target):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM targets")
+            self.connection.executemany(
+                "INSERT INTO targets (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value)) for key, value in percentuali_target.items()]
+            )
+
+    def load_crypto_mapping(self):
+        with self.lock:
+            return dict(self.connection.execute("SELECT pair, coin_id FROM crypto_mapping ORDER BY rowid").fetchall())
+
+    def save_crypto_mapping(self, crypto_mapping):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM crypto_mapping")
+            self.connection.executemany("INSERT INTO crypto_mapping (pair, coin_id) VALUES (?, ?)", crypto_mapping.items())
+
+    def load_selling_prices(self):
+        with self.lock:
+            return dict(self.connection.execute("SELECT currency, price FROM selling_prices ORDER BY rowid").fetchall())
+
+    def save_selling_prices(self, selling_prices):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM selling_prices")
+            self.connection.executemany("INSERT INTO selling_prices (currency, price) VALUES (?, ?)", selling_prices.items())
+
+    def load_crypto_transactions(self):
+        columns = ", ".join(column for column, _ in CRYPTO_TRANSACTION_COLUMNS)
+        keys = [key for _, key in CRYPTO_TRANSACTION_COLUMNS]
+        with self.lock:
+            rows = self.connection.execute(f"SELECT {columns} FROM crypto_transactions ORDER BY timestamp, id").fetchall()
+        return [dict(zip(keys, row)) for row in rows]
+
+    def insert_crypto_transactions(self, transactions):
+        columns = ", ".join(column for column, _ in CRYPTO_TRANSACTION_COLUMNS)
+        placeholders = ", ".join("?" for _ in CRYPTO_TRANSACTION_COLUMNS)
+        self.connection.executemany(
+            f"INSERT INTO crypto_transactions ({columns}) VALUES ({placeholders})",
+            [tuple(tx.get(key) for _, key in CRYPTO_TRANSACTION_COLUMNS) for tx in transactions]
+        )
+        self.bump_crypto_version()
+
+    def save_crypto_transactions(self, transactions):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM crypto_transactions")
+            self.insert_crypto_transactions(transactions)
+
+    def append_crypto_transaction(self, tx):
+        with self.lock, self.connection:
+            self.insert_crypto_transactions([tx])
+
+    def append_crypto_transactions(self, transactions):
+        with self.lock, self.connection:
+            self.insert_crypto_transactions(transactions)
+
+    def update_crypto_transaction(self, tx):
+        assignments = ", ".join(f"{column} = ?" for column, _ in CRYPTO_TRANSACTION_COLUMNS[1:])
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                f"UPDATE crypto_transactions SET {assignments} WHERE uid = ?",
+                tuple(tx.get(key) for _, key in CRYPTO_TRANSACTION_COLUMNS[1:]) + (tx["ID"],)
+            )
+            if cursor.rowcount:
+                self.bump_crypto_version()
+        return cursor.rowcount > 0
+
+    def delete_crypto_transaction(self, tx_id):
+        with self.lock, self.connection:
+            cursor = self.connection.execute("DELETE FROM crypto_transactions WHERE uid = ?", (tx_id,))
+            if cursor.rowcount:
+                self.bump_crypto_version()
+        return cursor.rowcount > 0
+
+    def load_fiat_transactions(self):
+        columns = ", ".join(column for column, _ in FIAT_TRANSACTION_COLUMNS)
+        keys = [key for _, key in FIAT_TRANSACTION_COLUMNS]
+        with self.lock:
+            rows = self.connection.execute(f"SELECT {columns} FROM fiat_transactions ORDER BY timestamp, id").fetchall()
+        return {
+            "Schema": TRANSACTIONS_SCHEMA_VERSION,
+            "EUR_Balance": self.get_setting("EUR_Balance", 0),
+            "Transactions": [dict(zip(keys, row)) for row in rows]
+        }
+
+    def insert_fiat_transactions(self, transactions):
+        columns = ", ".join(column for column, _ in FIAT_TRANSACTION_COLUMNS)
+        placeholders = ", ".join("?" for _ in FIAT_TRANSACTION_COLUMNS)
+        self.connection.executemany(
+            f"INSERT INTO fiat_transactions ({columns}) VALUES ({placeholders})",
+            [tuple(tx.get(key) for _, key in FIAT_TRANSACTION_COLUMNS) for tx in transactions]
+        )
+
+    def save_fiat_transactions(self, fiat_data):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM fiat_transactions")
+            self.set_setting("EUR_Balance", fiat_data.get("EUR_Balance", 0))
+            self.insert_fiat_transactions(fiat_data.get("Transactions", []))
+
+    def append_fiat_transaction(self, tx):
+        with self.lock, self.connection:
+            self.insert_fiat_transactions([tx])
+
+    def update_fiat_transaction(self, tx):
+        assignments = ", ".join(f"{column} = ?" for column, _ in FIAT_TRANSACTION_COLUMNS[1:])
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                f"UPDATE fiat_transactions SET {assignments} WHERE uid = ?",
+                tuple(tx.get(key) for _, key in FIAT_TRANSACTION_COLUMNS[1:]) + (tx["ID"],)
+            )
+        return cursor.rowcount > 0
+
+    def delete_fiat_transaction(self, tx_id):
+        with self.lock, self.connection:
+            cursor = self.connection.execute("DELETE FROM fiat_transactions WHERE uid = ?", (tx_id,))
+        return cursor.rowcount > 0
+
+    def crypto_transactions_fingerprint(self):
+        return (self.get_setting("crypto_version", 0),)
+
+    def dataset_version(self, dataset):
+        # data_version cambia solo quando un'altra connessione modifica il database:
+        # le scritture di questa istanza aggiornano già i dati in memoria
+        with self.lock:
+            return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def crypto_asset_totals(self):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT base, side, SUM(filled_amount), SUM(executed_amount), COUNT(*) FROM crypto_transactions GROUP BY base, side"
+            ).fetchall()
+        totals = {}
+        for base, side, filled_amount, executed_amount, count in rows:
+            totals.setdefault(base, {})[side] = {"Filled Amount": filled_amount, "Executed Amount": executed_amount, "Count": count}
+        return totals
+
+    def dump(self):
+        return {
+            "crypto_transactions": self.load_crypto_transactions(),
+            "fiat_transactions": self.load_fiat_transactions(),
+            "conto_deposito": self.load_conto_deposito(),
+            "immobili": self.load_immobili_data(),
+            "etf_prices": self.load_etf_prices(),
+            "percentuali_target": self.load_percentuali_target(),
+            "crypto_mapping": self.load_crypto_mapping(),
+            "selling_prices": self.load_selling_prices()
+        }
+
+    def restore(self, datasets):
+        self.save_crypto_transactions(datasets["crypto_transactions"])
+        self.save_fiat_transactions(datasets["fiat_transactions"])
+        self.save_conto_deposito(datasets["conto_deposito"])
+        self.save_immobili_data(datasets["immobili"])
+        self.save_etf_prices(datasets["etf_prices"])
+        self.save_percentuali_target(datasets["percentuali_target"])
+        self.save_crypto_mapping(datasets["crypto_mapping"])
+        self.save_selling_prices(datasets["selling_prices"])
+
+
+def copy_storage(source, target):
+    # Importazione/esportazione tra backend (es. JSON -> SQLite e viceversa)
+    target.restore(source.dump())
+
+def create_storage(kind=None, data_dir="data"):
+    kind = kind or os.environ.get("WALLET_STORAGE", STORAGE_BACKEND)
+    if kind == "json":
+        return JsonStorage(data_dir)
+    if kind == "sqlite":
+        storage = SqliteStorage(os.path.join(data_dir, "wallet.db"))
+        # Al primo avvio il database viene popolato con i dati JSON esistenti
+        if storage.is_empty() and os.path.exists(os.path.join(data_dir, "crypto_transactions.json")):
+            copy_storage(JsonStorage(data_dir), storage)
+        return storage
+    raise ValueError(f"Backend di salvataggio sconosciuto: {kind}")
+
+
+# ======================= StorageDataset Class =======================
+
+class StorageDataset:
+    # Attributo di DataManager letto dallo storage solo al primo accesso e riletto
+    # quando la sua versione (mtime del file, data_version di SQLite) cambia
+    def __init__(self, dataset, loader):
+        self.dataset = dataset
+        self.loader = loader
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        entry = instance.datasets.get(self.dataset)
+        now = time.monotonic()
+        if entry is not None and now - entry[2] < DATASET_CHECK_INTERVAL:
+            return entry[1]
+        version = instance.storage.dataset_version(self.dataset)
+        if entry is not None and entry[0] == version:
+            value = entry[1]
+        else:
+            value = getattr(instance, self.loader)()
+            # Il caricamento può creare il file mancante: la versione si legge dopo
+            version = instance.storage.dataset_version(self.dataset)
+        instance.datasets[self.dataset] = (version, value, now)
+        return value
+
+    def __set__(self, instance, value):
+        instance.datasets[self.dataset] = (instance.storage.dataset_version(self.dataset), value, time.monotonic())
+
+
+# ======================= DataManager Class =======================
+
+class DataManager:
+    manual_etf_prices = StorageDataset("etf_prices", "load_manual_etf_prices")
+    percentuali_target = StorageDataset("percentuali_target", "load_percentuali_target")
+    crypto_mapping = StorageDataset("crypto_mapping", "load_crypto_valute_mapping")
+    conto_deposito = StorageDataset("conto_deposito", "load_conto_deposito")
+    immobili_data = StorageDataset("immobili", "load_immobili_data")
+    selling_prices = StorageDataset("selling_prices", "load_selling_prices")
+
+    def __init__(self, storage=None, price_ttl=PRICE_CACHE_TTL, price_stale_ttl=PRICE_CACHE_STALE_TTL, price_provider=None):
+        self.storage = storage or create_storage()
+        # Prezzi e mappatura CSV sono condivisi; checkpoint e storico dipendono dai dati del backend
+        self.price_history_path = os.path.join(self.storage.data_dir, "price_history.db")
+        self.csv_import_mapping_path = os.path.join(self.storage.data_dir, "csv_import_mapping.json")
+        self.ledger_checkpoints_path = self.storage.state_path("ledger_checkpoints.json")
+        self.portfolio_history_path = self.storage.state_path("portfolio_history.json")
+        self.crypto_index = None
+        self.fiat_index = None
+        # File di configurazione caricati su richiesta: nome -> (versione, valore, ultimo controllo)
+        self.datasets = {}
+        self.immobili_index_source = None
+        self.immobili_index_cache = {}
+
+        self.price_history = PriceHistoryStore(self.price_history_path)
+        self.price_provider = price_provider or create_price_provider(price_history=self.price_history)
+        self.price_cache = PriceCache(self.fetch_crypto_prices, ttl=price_ttl, stale_ttl=price_stale_ttl)
+        # All'avvio la cache parte dagli ultimi prezzi salvati, così la GUI non attende la rete
+        self.price_cache.prime(self.price_history.latest_prices("crypto"))
+
+    def mark_saved(self, dataset):
+        # Dopo un salvataggio la copia in memoria è già aggiornata: si registra solo la nuova versione
+        entry = self.datasets.get(dataset)
+        if entry is not None:
+            self.datasets[dataset] = (self.storage.dataset_version(dataset), entry[1], time.monotonic())
+
+    @property
+    def etf_mapping(self):
+        # Stesso file dei prezzi manuali degli ETF, letto una sola volta
+        return self.manual_etf_prices
+
+    @property
+    def immobili_index(self):
+        immobili_data = self.immobili_data
+        if self.immobili_index_source is not immobili_data:
+            self.immobili_index_cache = {immobile["ID"]: immobile for immobile in immobili_data["Immobili"]}
+            self.immobili_index_source = immobili_data
+        return self.immobili_index_cache
+
+    def load_immobili_data(self):
+        return self.storage.load_immobili_data()
+
+    def save_immobili_data(self):
+        self.storage.save_immobili_data(self.immobili_data)
+        self.mark_saved("immobili")
+
+    def find_immobile(self, immobile_id):
+        return self.immobili_index.get(immobile_id)
+
+    def add_immobile(self, immobile):
+        self.immobili_data["Immobili"].append(immobile)
+        self.immobili_index[immobile["ID"]] = immobile
+        self.storage.insert_immobile(immobile, self.immobili_data)
+        self.mark_saved("immobili")
+
+    def update_immobile(self, immobile):
+        self.storage.update_immobile(immobile, self.immobili_data)
+        self.mark_saved("immobili")
+
+    def load_conto_deposito(self):
+        return self.storage.load_conto_deposito()
+
+    def save_conto_deposito(self):
+        self.storage.save_conto_deposito(self.conto_deposito)
+        self.mark_saved("conto_deposito")
+
+    def load_manual_etf_prices(self):
+        return self.storage.load_etf_prices()
+
+    def load_percentuali_target(self):
+        return self.storage.load_percentuali_target()
+
+    def load_crypto_valute_mapping(self):
+        return self.storage.load_crypto_mapping()
+
+    def load_selling_prices(self):
+        return self.storage.load_selling_prices()
+
+    def save_selling_prices(self, selling_prices):
+        self.storage.save_selling_prices(selling_prices)
+        self.selling_prices = selling_prices
+
+    def load_csv_import_mapping(self, path=None):
+        try:
+            with open(path or self.csv_import_mapping_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def get_crypto_ids(self):
+        return sorted(set(v for v in self.crypto_mapping.values() if isinstance(v, str)))
+
+    def get_current_crypto_prices(self):
+        return self.price_cache.get(self.get_crypto_ids())
+
+    def get_cached_crypto_prices(self):
+        return self.price_cache.peek(self.get_crypto_ids())
+
+    def refresh_crypto_prices(self):
+        coin_ids = self.get_crypto_ids()
+        try:
+            self.price_cache.refresh(coin_ids)
+        except PriceFetchError as e:
+            # Con l'errore viaggiano tutti i prezzi disponibili, anche quelli non aggiornati
+            raise PriceFetchError(str(e), self.price_cache.peek(coin_ids))
+        return self.price_cache.peek(coin_ids)
+
+    def fetch_crypto_prices(self, coin_ids):
+        return self.price_provider.prices(coin_ids)
+    
+    def load_crypto_transactions(self):
+        transactions = self.storage.load_crypto_transactions()
+        # Indice ID -> transazione: modifica ed eliminazione senza scansioni della lista
+        self.crypto_index = {tx["ID"]: tx for tx in transactions}
+        return transactions
+
+    def save_crypto_transactions(self, transactions):
+        self.storage.save_crypto_transactions(transactions)
+        self.crypto_index = {tx["ID"]: tx for tx in transactions}
+
+    def get_crypto_index(self):
+        if self.crypto_index is None:
+            self.load_crypto_transactions()
+        return self.crypto_index
+
+    def find_crypto_transaction(self, tx_id):
+        return self.get_crypto_index().get(tx_id)
+
+    def append_crypto_transaction(self, tx):
+        tx.setdefault("ID", new_transaction_id())
+        self.storage.append_crypto_transaction(tx)
+        if self.crypto_index is not None:
+            self.crypto_index[tx["ID"]] = tx
+
+    def append_crypto_transactions(self, transactions):
+        for tx in transactions:
+            tx.setdefault("ID", new_transaction_id())
+        self.storage.append_crypto_transactions(transactions)
+        if self.crypto_index is not None:
+            self.crypto_index.update((tx["ID"], tx) for tx in transactions)
+
+    def update_crypto_transaction(self, tx):
+        index = self.get_crypto_index()
+        if tx.get("ID") not in index:
+            return False
+        self.storage.update_crypto_transaction(tx)
+        index[tx["ID"]] = tx
+        return True
+
+    def delete_crypto_transaction(self, tx_id):
+        index = self.get_crypto_index()
+        if tx_id not in index:
+            return False
+        self.storage.delete_crypto_transaction(tx_id)
+        del index[tx_id]
+        return True
+
+    def load_fiat_transactions(self):
+        fiat_data = self.storage.load_fiat_transactions()
+        self.fiat_index = {tx["ID"]: tx for tx in fiat_data["Transactions"]}
+        return fiat_data
 
     def save_fiat_transactions(self, fiat_data):
-        with open(self.fiat_transactions_path, 'w') as f:
-            json.dump(fiat_data, f, indent=4)
+        self.storage.save_fiat_transactions(fiat_data)
+        self.fiat_index = {tx["ID"]: tx for tx in fiat_data.get("Transactions", [])}
+
+    def get_fiat_index(self):
+        if self.fiat_index is None:
+            self.load_fiat_transactions()
+        return self.fiat_index
+
+    def find_fiat_transaction(self, tx_id):
+        return self.get_fiat_index().get(tx_id)
+
+    def append_fiat_transaction(self, tx):
+        tx.setdefault("ID", new_transaction_id())
+        self.storage.append_fiat_transaction(tx)
+        if self.fiat_index is not None:
+            self.fiat_index[tx["ID"]] = tx
+
+    def update_fiat_transaction(self, tx):
+        index = self.get_fiat_index()
+        if tx.get("ID") not in index:
+            return False
+        self.storage.update_fiat_transaction(tx)
+        index[tx["ID"]] = tx
+        return True
+
+    def delete_fiat_transaction(self, tx_id):
+        index = self.get_fiat_index()
+        if tx_id not in index:
+            return False
+        self.storage.delete_fiat_transaction(tx_id)
+        del index[tx_id]
+        return True
+
+    def crypto_transactions_fingerprint(self):
+        return self.storage.crypto_transactions_fingerprint()
+
+    def crypto_asset_totals(self):
+        return self.storage.crypto_asset_totals()
+
+    def migrate_transaction_files(self):
+        self.load_crypto_transactions()
+        self.load_fiat_transactions()
+
+    def import_json(self, data_dir=None):
+        copy_storage(JsonStorage(data_dir or self.storage.data_dir), self.storage)
+        self.datasets.clear()
+
+    def export_json(self, data_dir=None):
+        copy_storage(self.storage, JsonStorage(data_dir or self.storage.data_dir))
 
     def update_etf_price(self, etf_name, price):
         self.manual_etf_prices[etf_name] = price
-        with open(self.etf_valute_path, 'w') as f:
-            json.dump(self.manual_etf_prices, f, indent=4)
+        self.storage.update_etf_price(etf_name, price, self.manual_etf_prices)
+        self.mark_saved("etf_prices")
+        self.price_history.append_etf_price(etf_name, price)
+
+# ======================= LedgerState Class =======================
+
+class LedgerState:
+    def __init__(self):
+        self.balances = {}
+        self.avg_prices = {}
+        self.avg_prices_usd = {}
+        self.total_units_for_avg = {}
+        # Variazione del saldo EUR dovuta alle transazioni crypto/ETF: il saldo iniziale
+        # dipende dalle transazioni FIAT e viene sommato solo in results()
+        self.eur_delta = 0.0
+        self.usdt_balance = 0.0
+
+    def apply(self, tx):
+        balances = self.balances
+        avg_prices = self.avg_prices
+        avg_prices_usd = self.avg_prices_usd
+        total_units_for_avg = self.total_units_for_avg
+
+        pair = tx["Pair"]
+        side = tx["Side"]
+        price = tx["Price"]
+        order_amount = tx["Order Amount"]
+        filled_amount = tx["Filled Amount"]
+        executed_amount = tx["Executed Amount"]
+        fee_amount = tx["Trade Fee"]
+        fee_currency = tx["Fee Currency"]
+        base_currency = tx["Base"]
+        info = tx.get("Info", "Transazione")  
+
+        # Verifica se la transazione è di tipo "Earn" per escluderla solo dal saldo investito
+        is_earn = info == "Earn"
+
+        if fee_currency == base_currency:
+            filled_amount -= fee_amount
+
+        if info == "Etf":
+            etf_currency = f"ETF_{base_currency}"  
+            if etf_currency not in balances:
+                balances[etf_currency] = 0
+                avg_prices[etf_currency] = 0
+                total_units_for_avg[etf_currency] = 0
+
+            if side == "Buy" and not is_earn:  # Esclude "Earn" dal totale investito
+                balances[etf_currency] += filled_amount
+                avg_prices[etf_currency] += executed_amount
+                total_units_for_avg[etf_currency] += filled_amount
+                self.eur_delta -= executed_amount  
+            elif side == "Sell":
+                balances[etf_currency] -= filled_amount
+                avg_prices[etf_currency] -= executed_amount
+                total_units_for_avg[etf_currency] -= filled_amount
+                self.eur_delta += executed_amount - fee_amount  
+
+        else:
+            if base_currency not in balances:
+                balances[base_currency] = 0
+                avg_prices[base_currency] = 0
+                avg_prices_usd[base_currency] = 0
+                total_units_for_avg[base_currency] = 0
+
+            if side == "Buy" and not is_earn:
+                if pair == "USDT/EUR":
+                    balances[base_currency] += filled_amount
+                    avg_prices[base_currency] += executed_amount
+                    total_units_for_avg[base_currency] += filled_amount
+                    self.eur_delta -= executed_amount
+                    self.usdt_balance += filled_amount
+                else:
+                    balances[base_currency] += filled_amount
+                    if price > 0:
+                        avg_prices_usd[base_currency] += executed_amount
+                        total_units_for_avg[base_currency] += filled_amount
+                        self.usdt_balance -= executed_amount
+
+            elif side == "Sell":
+                if pair == "USDT/EUR":
+                    balances[base_currency] -= order_amount
+                    avg_prices[base_currency] -= executed_amount
+                    total_units_for_avg[base_currency] -= order_amount
+                    self.eur_delta += executed_amount - fee_amount
+                    self.usdt_balance -= filled_amount
+                else:
+                    balances[base_currency] -= filled_amount
+                    avg_prices_usd[base_currency] -= executed_amount
+                    total_units_for_avg[base_currency] -= filled_amount
+                    self.usdt_balance += executed_amount - fee_amount
+
+    def results(self, eur_balance):
+        # I prezzi medi vengono calcolati su copie, lo stato resta quello delle somme correnti
+        balances = dict(self.balances)
+        avg_prices = dict(self.avg_prices)
+        avg_prices_usd = dict(self.avg_prices_usd)
+        total_units_for_avg = self.total_units_for_avg
+
+        # Calcolo dei prezzi medi
+        for currency in balances:
+            if total_units_for_avg[currency] > 0:
+                if currency == 'USDT':
+                    avg_prices[currency] = avg_prices[currency] / abs(total_units_for_avg[currency])
+                elif currency.startswith('ETF_'):
+                    avg_prices[currency] = avg_prices[currency] / abs(total_units_for_avg[currency])
+                else:
+                    avg_prices_usd[currency] = avg_prices_usd[currency] / abs(total_units_for_avg[currency])
+
+        usdt_avg_price_eur = avg_prices.get('USDT', 1)
+        for currency in avg_prices_usd:
+            if currency != 'USDT' and usdt_avg_price_eur > 0:
+                avg_prices[currency] = avg_prices_usd[currency] * usdt_avg_price_eur
+
+        return balances, avg_prices, avg_prices_usd, eur_balance + self.eur_delta, self.usdt_balance
+
+    def copy(self):
+        return LedgerState.from_dict(self.to_dict())
+
+    def to_dict(self):
+        return {
+            "balances": dict(self.balances),
+            "avg_prices": dict(self.avg_prices),
+            "avg_prices_usd": dict(self.avg_prices_usd),
+            "total_units_for_avg": dict(self.total_units_for_avg),
+            "eur_delta": self.eur_delta,
+            "usdt_balance": self.usdt_balance
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls()
+        state.balances = dict(data["balances"])
+        state.avg_prices = dict(data["avg_prices"])
+        state.avg_prices_usd = dict(data["avg_prices_usd"])
+        state.total_units_for_avg = dict(data["total_units_for_avg"])
+        state.eur_delta = data["eur_delta"]
+        state.usdt_balance = data["usdt_balance"]
+        return state
+
+
+# ======================= ColumnarLedger Class =======================
+
+@functools.lru_cache(maxsize=None)
+def load_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def columnar_numpy(count):
+    # Il motore colonnare è opzionale (WALLET_LEDGER_ENGINE=columnar) e richiede NumPy:
+    # altrimenti il ledger viene elaborato riga per riga
+    if count < COLUMNAR_LEDGER_MIN_ROWS or os.environ.get("WALLET_LEDGER_ENGINE", LEDGER_ENGINE) != "columnar":
+        return None
+    return load_numpy()
+
+
+class ColumnarLedger:
+    # Elabora un blocco di transazioni su colonne NumPy invece che riga per riga.
+    # Le somme per asset sono cumulative e sequenziali (cumsum), nello stesso ordine di
+    # LedgerState.apply, quindi i risultati coincidono esattamente con il percorso Python
+    def __init__(self, np, state, transactions):
+        self.np = np
+        self.state = state
+        self.count = len(transactions)
+
+        self.assets = list(state.balances)
+        self.initial_count = len(self.assets)
+
+        # Estrazione delle colonne con una sola passata per gruppo di campi
+        text = np.array(list(map(operator.itemgetter("Pair", "Base", "Side", "Fee Currency"), transactions)), dtype=str).reshape(-1, 4)
+        numbers = np.array(list(map(operator.itemgetter("Price", "Order Amount", "Filled Amount", "Executed Amount", "Trade Fee"), transactions)), dtype=float).reshape(-1, 5)
+        info = np.array([tx.get("Info", "Transazione") for tx in transactions], dtype=str)
+        pair, base, side, fee_currency = text.T
+        price, order_amount, filled_amount, executed_amount, fee_amount = numbers.T
+
+        etf = info == "Etf"
+        earn = info == "Earn"
+        usdt_eur = (pair == "USDT/EUR") & ~etf
+        other = ~etf & ~usdt_eur
+        buy = (side == "Buy") & ~earn
+        sell = side == "Sell"
+        fee_in_base = fee_currency == base
+
+        # Codici degli asset: prima quelli già presenti nello stato, poi gli altri in ordine di apparizione
+        names = np.where(etf, np.char.add("ETF_", base), base)
+        unique_names, first_rows, inverse = np.unique(names, return_index=True, return_inverse=True)
+        asset_index = {name: position for position, name in enumerate(self.assets)}
+        for position in np.argsort(first_rows, kind="stable"):
+            asset_index.setdefault(str(unique_names[position]), len(asset_index))
+        self.assets = list(asset_index)
+        remap = np.array([asset_index[str(name)] for name in unique_names], dtype=np.int64)
+        self.codes = remap[inverse.reshape(-1)]
+
+        filled_amount = np.where(fee_in_base, filled_amount - fee_amount, filled_amount)
+        sold_amount = np.where(usdt_eur, order_amount, filled_amount)
+        eur_side = etf | usdt_eur
+        proceeds = executed_amount - fee_amount
+
+        # Variazione di ogni accumulatore per riga (0 dove la riga non lo modifica)
+        self.weights = {
+            "balances": np.where(buy, filled_amount, np.where(sell, -sold_amount, 0.0)),
+            "avg_prices": np.where(eur_side & buy, executed_amount, np.where(eur_side & sell, -executed_amount, 0.0)),
+            "avg_prices_usd": np.where(other & buy & (price > 0), executed_amount, np.where(other & sell, -executed_amount, 0.0)),
+            "total_units_for_avg": np.where(buy & (eur_side | (price > 0)), filled_amount, np.where(sell, -sold_amount, 0.0))
+        }
+        self.eur_weights = np.where(eur_side & buy, -executed_amount, np.where(eur_side & sell, proceeds, 0.0))
+        self.usdt_weights = np.where(
+            usdt_eur,
+            np.where(buy, filled_amount, np.where(sell, -filled_amount, 0.0)),
+            np.where(other & buy & (price > 0), -executed_amount, np.where(other & sell, proceeds, 0.0))
+        )
+
+        # Righe di ogni asset in ordine cronologico
+        order = np.argsort(self.codes, kind="stable")
+        boundaries = np.searchsorted(self.codes[order], np.arange(len(self.assets) + 1))
+        self.rows = [order[boundaries[code]:boundaries[code + 1]] for code in range(len(self.assets))]
+
+    def prefix_sums(self, weights, initial):
+        np = self.np
+        return np.cumsum(np.concatenate(([initial], weights)))
+
+    def states(self, positions):
+        # Stato dopo le prime `posizione` righe del blocco per ciascuna posizione richiesta
+        np = self.np
+        positions = np.array(positions, dtype=np.int64)
+        first_rows = [rows[0] if len(rows) else self.count for rows in self.rows]
+
+        values = {}
+        for key, weights in self.weights.items():
+            initial_values = getattr(self.state, key)
+            per_asset = []
+            for code, name in enumerate(self.assets):
+                prefix = self.prefix_sums(weights[self.rows[code]], float(initial_values.get(name, 0.0)))
+                per_asset.append(prefix[np.searchsorted(self.rows[code], positions)])
+            values[key] = per_asset
+
+        eur_delta = self.prefix_sums(self.eur_weights, float(self.state.eur_delta))[positions]
+        usdt_balance = self.prefix_sums(self.usdt_weights, float(self.state.usdt_balance))[positions]
+
+        states = []
+        for index, position in enumerate(positions):
+            state = LedgerState()
+            for code, name in enumerate(self.assets):
+                if code >= self.initial_count and first_rows[code] >= position:
+                    continue
+                state.balances[name] = float(values["balances"][code][index])
+                state.avg_prices[name] = float(values["avg_prices"][code][index])
+                state.total_units_for_avg[name] = float(values["total_units_for_avg"][code][index])
+                if name in self.state.avg_prices_usd or not name.startswith("ETF_"):
+                    state.avg_prices_usd[name] = float(values["avg_prices_usd"][code][index])
+            state.eur_delta = float(eur_delta[index])
+            state.usdt_balance = float(usdt_balance[index])
+            states.append(state)
+        return states
+
+
+# ======================= IncrementalLedger Class =======================
+
+class IncrementalLedger:
+    def __init__(self, checkpoint_path=None, checkpoint_interval=LEDGER_CHECKPOINT_INTERVAL):
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.transactions = []
+        self.state = LedgerState()
+        # indice -> stato dopo le prime `indice` transazioni; il checkpoint 0 è lo stato vuoto
+        self.checkpoints = {0: LedgerState()}
+        self.fingerprint = None
+        # Impronta dell'ultimo file salvato e checkpoint modificati da allora
+        self.saved_fingerprint = None
+        self.checkpoints_changed = False
+        self.loaded = False
+
+    def sync(self, transactions, fingerprint=None):
+        if not self.loaded:
+            self.loaded = True
+            if self.restore(transactions, fingerprint):
+                return
+
+        # Le transazioni vengono rilette dal disco a ogni refresh: se l'impronta del salvataggio
+        # non è cambiata non c'è nulla da confrontare
+        if fingerprint is not None and fingerprint == self.fingerprint and len(transactions) == len(self.transactions):
+            return
+
+        old_transactions = self.transactions
+        index = next(
+            (i for i, (old_tx, new_tx) in enumerate(zip(old_transactions, transactions)) if old_tx is not new_tx and old_tx != new_tx),
+            min(len(old_transactions), len(transactions))
+        )
+        if index == len(old_transactions) == len(transactions):
+            if fingerprint != self.fingerprint:
+                self.fingerprint = fingerprint
+                self.save()
+            return
+
+        self.transactions = list(transactions)
+        if index == len(old_transactions):
+            # Solo nuove transazioni in coda: si applicano allo stato corrente
+            self.apply_from(index)
+        else:
+            self.replay_from(index)
+        self.fingerprint = fingerprint
+        self.save()
+
+    def append(self, tx):
+        self.sync(self.transactions + [tx], self.fingerprint)
+
+    def apply_from(self, index):
+        np = columnar_numpy(len(self.transactions) - index)
+        if np is not None:
+            self.apply_columnar(np, index)
+            return
+        for position in range(index, len(self.transactions)):
+            self.state.apply(self.transactions[position])
+            if (position + 1) % self.checkpoint_interval == 0:
+                self.checkpoints[position + 1] = self.state.copy()
+                self.checkpoints_changed = True
+
+    def apply_columnar(self, np, index):
+        count = len(self.transactions)
+        checkpoint_positions = [position for position in range(index + 1, count + 1) if position % self.checkpoint_interval == 0]
+        ledger = ColumnarLedger(np, self.state, self.transactions[index:])
+        states = ledger.states([position - index for position in checkpoint_positions] + [count - index])
+        for position, state in zip(checkpoint_positions, states):
+            self.checkpoints[position] = state
+        self.checkpoints_changed = self.checkpoints_changed or bool(checkpoint_positions)
+        self.state = states[-1]
+
+    def replay_from(self, index):
+        # Riparte dal checkpoint più vicino che precede la prima transazione modificata
+        start = max(position for position in self.checkpoints if position <= index)
+        checkpoints = {position: state for position, state in self.checkpoints.items() if position <= start}
+        self.checkpoints_changed = self.checkpoints_changed or len(checkpoints) != len(self.checkpoints)
+        self.checkpoints = checkpoints
+        self.state = self.checkpoints[start].copy()
+        self.apply_from(start)
+
+    def results(self, eur_balance):
+        return self.state.results(eur_balance)
+
+    def restore(self, transactions, fingerprint):
+        if self.checkpoint_path is None or fingerprint is None:
+            return False
+        try:
+            with open(self.checkpoint_path, 'r') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+
+        # I checkpoint valgono solo se il file delle transazioni non è cambiato da quando sono stati salvati
+        if data.get("fingerprint") != list(fingerprint) or data.get("count") != len(transactions) or data.get("interval") != self.checkpoint_interval:
+            return False
+
+        self.transactions = list(transactions)
+        self.state = LedgerState.from_dict(data["state"])
+        self.checkpoints = {int(position): LedgerState.from_dict(state) for position, state in data["checkpoints"].items()}
+        self.checkpoints.setdefault(0, LedgerState())
+        self.fingerprint = fingerprint
+        self.saved_fingerprint = fingerprint
+        return True
+
+    def save(self):
+        if self.checkpoint_path is None or self.fingerprint is None:
+            return
+        if not self.checkpoints_changed and self.fingerprint == self.saved_fingerprint:
+            return
+        data = {
+            "fingerprint": list(self.fingerprint),
+            "count": len(self.transactions),
+            "interval": self.checkpoint_interval,
+            "state": self.state.to_dict(),
+            "checkpoints": {str(position): state.to_dict() for position, state in self.checkpoints.items()}
+        }
+        write_json_atomic(self.checkpoint_path, data)
+        self.saved_fingerprint = self.fingerprint
+        self.checkpoints_changed = False
+
+
+# ======================= LotTracker Class =======================
+
+# Metodi di abbinamento dei lotti alle vendite; AVG = costo medio ponderato
+LOT_METHODS = ("FIFO", "LIFO", "HIFO", "AVG")
+LOT_EPSILON = 1e-12
+
+class LotTracker:
+    # Costo fiscale a livello di lotto, in EUR: ogni acquisto apre un lotto e ogni vendita
+    # consuma i lotti secondo il metodo scelto (deque per FIFO/LIFO, heap per HIFO)
+    def __init__(self, method="FIFO"):
+        if method not in LOT_METHODS:
+            raise ValueError(f"Metodo di calcolo del costo sconosciuto: {method}")
+        self.method = method
+        self.lots = {}
+        # asset -> [unità, costo] dei lotti aperti, aggiornato a ogni operazione
+        self.positions = {}
+        # asset -> anno -> [ricavo, costo]
+        self.realised = {}
+        self.unmatched = {}
+        # Cambio in EUR delle valute di quotazione, aggiornato con le transazioni X/EUR (es. USDT/EUR)
+        self.eur_rates = {"EUR": 1.0}
+        self.sequence = 0
+
+    def apply(self, tx):
+        side = tx["Side"]
+        base_currency = tx["Base"]
+        quote_currency = tx["Quote"]
+        filled_amount = tx["Filled Amount"]
+        executed_amount = tx["Executed Amount"]
+        fee_amount = tx["Trade Fee"]
+        fee_currency = tx["Fee Currency"]
+        timestamp = tx["Timestamp"]
+        asset = f"ETF_{base_currency}" if tx.get("Info") == "Etf" else base_currency
+
+        if quote_currency == "EUR" and tx["Price"] > 0:
+            self.eur_rates[base_currency] = tx["Price"]
+        # Prima della prima conversione la valuta di quotazione viene considerata alla pari con l'EUR
+        rate = self.eur_rates.get(quote_currency, 1.0)
+        quote_fee = fee_amount if fee_currency == quote_currency else 0.0
+
+        if side == "Buy":
+            units = filled_amount - fee_amount if fee_currency == base_currency else filled_amount
+            spent = executed_amount + quote_fee
+            # Le ricompense "Earn" entrano come lotti valutati al momento della ricezione
+            self.acquire(asset, units, spent * rate)
+            if quote_currency != "EUR" and tx.get("Info") != "Earn":
+                self.dispose(quote_currency, spent, spent * rate, timestamp)
+        elif side == "Sell":
+            received = executed_amount - quote_fee
+            self.dispose(asset, filled_amount, received * rate, timestamp)
+            if quote_currency != "EUR":
+                self.acquire(quote_currency, received, received * rate)
+
+    def acquire(self, asset, units, cost):
+        if units <= LOT_EPSILON:
+            return
+        position = self.positions.setdefault(asset, [0.0, 0.0])
+        position[0] += units
+        position[1] += cost
+        if self.method == "AVG":
+            return
+        lot = [units, cost / units]
+        if self.method == "HIFO":
+            self.sequence += 1
+            heapq.heappush(self.lots.setdefault(asset, []), (-lot[1], self.sequence, lot))
+        else:
+            self.lots.setdefault(asset, deque()).append(lot)
+
+    def dispose(self, asset, units, proceeds, timestamp):
+        if units <= LOT_EPSILON:
+            return
+        position = self.positions.setdefault(asset, [0.0, 0.0])
+        if self.method == "AVG":
+            matched = min(units, position[0])
+            cost = position[1] * matched / position[0] if matched > 0 else 0.0
+        else:
+            matched, cost = self.consume(self.lots.get(asset), units)
+        position[0] -= matched
+        position[1] -= cost
+        if position[0] <= LOT_EPSILON:
+            position[0] = position[1] = 0.0
+
+        # Vendite oltre i lotti registrati (storico incompleto): la parte scoperta ha costo zero
+        if units - matched > LOT_EPSILON:
+            self.unmatched[asset] = self.unmatched.get(asset, 0.0) + units - matched
+        year = self.realised.setdefault(asset, {}).setdefault(timestamp[:4], [0.0, 0.0])
+        year[0] += proceeds
+        year[1] += cost
+
+    def consume(self, lots, units):
+        matched = 0.0
+        cost = 0.0
+        while lots and units - matched > LOT_EPSILON:
+            if self.method == "HIFO":
+                lot = lots[0][2]
+            elif self.method == "LIFO":
+                lot = lots[-1]
+            else:
+                lot = lots[0]
+            taken = min(lot[0], units - matched)
+            matched += taken
+            cost += taken * lot[1]
+            lot[0] -= taken
+            if lot[0] <= LOT_EPSILON:
+                if self.method == "HIFO":
+                    heapq.heappop(lots)
+                elif self.method == "LIFO":
+                    lots.pop()
+                else:
+                    lots.popleft()
+        return matched, cost
+
+    def report(self, prices_eur=None):
+        prices_eur = prices_eur or {}
+        assets = []
+        realised = []
+        years = {}
+        for asset in sorted(set(self.positions) | set(self.realised)):
+            units, cost_basis = self.positions.get(asset, (0.0, 0.0))
+            price = prices_eur.get(asset)
+            value = units * price if price is not None else None
+            asset_realised = 0.0
+            for year, (proceeds, cost) in sorted(self.realised.get(asset, {}).items()):
+                realised.append({"Asset": asset, "Year": year, "Proceeds EUR": proceeds, "Cost Basis EUR": cost, "Realised EUR": proceeds - cost})
+                totals = years.setdefault(year, [0.0, 0.0])
+                totals[0] += proceeds
+                totals[1] += cost
+                asset_realised += proceeds - cost
+            assets.append({
+                "Asset": asset,
+                "Units": units,
+                "Cost Basis EUR": cost_basis,
+                "Price EUR": price,
+                "Value EUR": value,
+                "Unrealised EUR": value - cost_basis if value is not None else None,
+                "Realised EUR": asset_realised,
+                "Unmatched Units": self.unmatched.get(asset, 0.0)
+            })
+
+        return {
+            "Method": self.method,
+            "Assets": assets,
+            "Realised": realised,
+            "Years": [{"Year": year, "Proceeds EUR": proceeds, "Cost Basis EUR": cost, "Realised EUR": proceeds - cost} for year, (proceeds, cost) in sorted(years.items())],
+            "Totals": {
+                "Cost Basis EUR": sum(position["Cost Basis EUR"] for position in assets),
+                "Value EUR": sum(position["Value EUR"] for position in assets if position["Value EUR"] is not None),
+                "Realised EUR": sum(position["Realised EUR"] for position in assets),
+                "Unrealised EUR": sum(position["Unrealised EUR"] for position in assets if position["Unrealised EUR"] is not None)
+            }
+        }
+
 
 # ======================= TransactionProcessor Class =======================
 
 class TransactionProcessor:
     def __init__(self, data_manager):
         self.data_manager = data_manager
+        self.ledger = IncrementalLedger(self.data_manager.ledger_checkpoints_path)
 
     def load_fiat_balance(self):
         fiat_data = self.data_manager.load_fiat_transactions()
@@ -149,7 +2171,7 @@ class TransactionProcessor:
         eur_balance = initial_eur_balance
         total_invested = 0  
         for tx in fiat_transactions:
-            amount = float(tx["Filled Amount"].replace(',', '.').split()[0])
+            amount = tx["Filled Amount"]
             if tx["Type"] == "Top Up FIAT":
                 eur_balance += amount  
                 total_invested += amount  
@@ -159,102 +2181,19 @@ class TransactionProcessor:
         return eur_balance, total_invested
 
     def process_crypto_transactions(self, transactions, eur_balance):
-        balances = {}
-        avg_prices = {}
-        avg_prices_usd = {}
-        total_units_for_avg = {}
-        usdt_balance = 0.0
-
+        np = columnar_numpy(len(transactions))
+        if np is not None:
+            return ColumnarLedger(np, LedgerState(), transactions).states([len(transactions)])[0].results(eur_balance)
+        state = LedgerState()
         for tx in transactions:
-            pair = tx["Pair"]
-            side = tx["Side"]
-            price = float(tx["Price"].split()[0]) if tx["Price"].split()[0].replace(".", "", 1).isdigit() else 0.0
-            order_amount = float(tx["Order Amount"].split()[0])
-            filled_amount = float(tx["Filled Amount"].split()[0])
-            executed_amount = float(tx["Executed Amount"].split()[0])
-            trade_fee = tx["Trade Fee"]
-            info = tx.get("Info", "Transazione")  
-
-            # Verifica se la transazione è di tipo "Earn" per escluderla solo dal saldo investito
-            is_earn = tx.get("Info") == "Earn"
-
-            fee_amount = float(trade_fee.split()[0]) if trade_fee.split()[0].replace(".", "", 1).isdigit() else 0.0
-            fee_currency = trade_fee.split()[1]
-            
-            if fee_currency == pair.split("/")[0]:
-                filled_amount -= fee_amount
-            
-            base_currency = pair.split("/")[0]
-            quote_currency = pair.split("/")[1]
-
-            if info == "Etf":
-                etf_currency = f"ETF_{base_currency}"  
-                if etf_currency not in balances:
-                    balances[etf_currency] = 0
-                    avg_prices[etf_currency] = 0
-                    total_units_for_avg[etf_currency] = 0
-
-                if side == "Buy" and not is_earn:  # Esclude "Earn" dal totale investito
-                    balances[etf_currency] += filled_amount
-                    avg_prices[etf_currency] += executed_amount
-                    total_units_for_avg[etf_currency] += filled_amount
-                    eur_balance -= executed_amount  
-                elif side == "Sell":
-                    balances[etf_currency] -= filled_amount
-                    avg_prices[etf_currency] -= executed_amount
-                    total_units_for_avg[etf_currency] -= filled_amount
-                    eur_balance += executed_amount - fee_amount  
-
-            else:
-                if base_currency not in balances:
-                    balances[base_currency] = 0
-                    avg_prices[base_currency] = 0
-                    avg_prices_usd[base_currency] = 0
-                    total_units_for_avg[base_currency] = 0
-
-                if side == "Buy" and not is_earn:
-                    if pair == "USDT/EUR":
-                        balances[base_currency] += filled_amount
-                        avg_prices[base_currency] += executed_amount
-                        total_units_for_avg[base_currency] += filled_amount
-                        eur_balance -= executed_amount
-                        usdt_balance += filled_amount
-                    else:
-                        balances[base_currency] += filled_amount
-                        if price > 0:
-                            avg_prices_usd[base_currency] += executed_amount
-                            total_units_for_avg[base_currency] += filled_amount
-                            usdt_balance -= executed_amount
-
-                elif side == "Sell":
-                    if pair == "USDT/EUR":
-                        balances[base_currency] -= order_amount
-                        avg_prices[base_currency] -= executed_amount
-                        total_units_for_avg[base_currency] -= order_amount
-                        eur_balance += executed_amount - fee_amount
-                        usdt_balance -= filled_amount
-                    else:
-                        balances[base_currency] -= filled_amount
-                        avg_prices_usd[base_currency] -= executed_amount
-                        total_units_for_avg[base_currency] -= filled_amount
-                        usdt_balance += executed_amount - fee_amount
-
-        # Calcolo dei prezzi medi
-        for currency in balances:
-            if total_units_for_avg[currency] > 0:
-                if currency == 'USDT':
-                    avg_prices[currency] = avg_prices[currency] / abs(total_units_for_avg[currency])
-                elif currency.startswith('ETF_'):
-                    avg_prices[currency] = avg_prices[currency] / abs(total_units_for_avg[currency])
-                else:
-                    avg_prices_usd[currency] = avg_prices_usd[currency] / abs(total_units_for_avg[currency])
+            state.apply(tx)
+        return state.results(eur_balance)
 
-        usdt_avg_price_eur = avg_prices.get('USDT', 1)
-        for currency in avg_prices_usd:
-            if currency != 'USDT' and usdt_avg_price_eur > 0:
-                avg_prices[currency] = avg_prices_usd[currency] * usdt_avg_price_eur
-
-        return balances, avg_prices, avg_prices_usd, eur_balance, usdt_balance
+    def process_crypto_ledger(self, transactions, eur_balance):
+        # Come process_crypto_transactions, ma riusa lo stato già calcolato e rielabora
+        # solo le transazioni cambiate a partire dal checkpoint più vicino
+        self.ledger.sync(transactions, self.data_manager.crypto_transactions_fingerprint())
+        return self.ledger.results(eur_balance)
 
 
 # ======================= Portfolio Class =======================
@@ -268,35 +2207,1591 @@ class Portfolio:
             return 'N/A'  
         return ((price_current - price_avg) / price_avg) * 100
 
+# ======================= CsvTransactionImporter Class =======================
+
+# Colonne del CSV per ogni campo del record (sovrascrivibili con data/csv_import_mapping.json)
+CSV_IMPORT_MAPPING = {
+    "Timestamp": "Timestamp",
+    "Pair": "Pair",
+    "Side": "Side",
+    "Price": "Price",
+    "Order Amount": "Order Amount",
+    "Filled Amount": "Filled Amount",
+    "Executed Amount": "Executed Amount",
+    "Trade Fee": "Trade Fee",
+    "Fee Currency": "Fee Currency",
+    "Info": "Info"
+}
+CSV_REQUIRED_FIELDS = ("Timestamp", "Pair", "Side", "Price", "Filled Amount")
+KNOWN_QUOTE_CURRENCIES = ("USDT", "USDC", "FDUSD", "BUSD", "EUR", "USD", "BTC", "ETH", "BNB")
+CSV_AMOUNT_PATTERN = re.compile(r"^\s*([-+]?[0-9.,]*[0-9](?:[eE][-+]?[0-9]+)?)\s*([A-Za-z]*)\s*$")
+
+
+def parse_csv_amount(text, decimal_separator=None):
+    # Gli export riportano spesso l'unità attaccata all'importo ("0.25BTC", "7125.1 USDT").
+    # Senza un separatore decimale esplicito vale l'ultimo presente ("1.234,56", "1,234.56"),
+    # a meno che non si ripeta: in quel caso separa le migliaia ("1.234.567")
+    match = CSV_AMOUNT_PATTERN.match(text or "")
+    if not match:
+        raise ValueError(f"Importo non valido: {text!r}")
+    number, unit = match.groups()
+    if decimal_separator is None:
+        last = max(number.rfind(","), number.rfind("."))
+        decimal_separator = number[last] if last >= 0 else "."
+        if number.count(decimal_separator) > 1:
+            decimal_separator = "," if decimal_separator == "." else "."
+    thousands_separator = "," if decimal_separator == "." else "."
+    number = number.replace(thousands_separator, "").replace(decimal_separator, ".")
+    try:
+        return float(number), unit or None
+    except ValueError:
+        raise ValueError(f"Importo non valido: {text!r}")
+
+
+def split_pair(pair, known_pairs=()):
+    if "/" in pair:
+        base_currency, quote_currency = pair.split("/", 1)
+        return base_currency, quote_currency
+    # Coppie senza separatore ("BTCUSDT"): prima le coppie configurate, poi le quote note
+    for known_pair in known_pairs:
+        if known_pair.replace("/", "") == pair:
+            return tuple(known_pair.split("/", 1))
+    for quote_currency in KNOWN_QUOTE_CURRENCIES:
+        if pair.endswith(quote_currency) and len(pair) > len(quote_currency):
+            return pair[:-len(quote_currency)], quote_currency
+    raise ValueError(f"Coppia non riconosciuta: {pair!r}")
+
+
+def transaction_key(tx):
+    return (tx["Timestamp"], tx["Pair"], tx["Side"], tx["Price"], tx["Filled Amount"], tx["Executed Amount"], tx["Trade Fee"])
+
+
+class CsvTransactionImporter:
+    def __init__(self, data_manager, mapping=None, delimiter=","):
+        self.data_manager = data_manager
+        self.mapping = dict(CSV_IMPORT_MAPPING, **(mapping or {}))
+        # Separatore decimale fisso per gli export in cui "1,234" è ambiguo
+        self.decimal_separator = self.mapping.get("Decimal Separator")
+        if self.decimal_separator not in (None, ".", ","):
+            raise ValueError(f"Separatore decimale non valido: {self.decimal_separator!r}")
+        self.delimiter = delimiter
+        self.known_pairs = [pair for pair in data_manager.crypto_mapping if "/" in pair]
+
+    def import_file(self, path):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            return self.import_rows(csv.DictReader(f, delimiter=self.delimiter))
+
+    def import_rows(self, rows):
+        # Le righe vengono lette una alla volta; l'indice contiene le chiavi delle transazioni
+        # già salvate e di quelle già importate, così i duplicati costano un solo lookup
+        index = set(transaction_key(tx) for tx in self.data_manager.load_crypto_transactions())
+        batch = []
+        duplicates = 0
+        errors = []
+
+        for line, row in enumerate(rows, start=2):
+            try:
+                tx = self.parse_row(row)
+            except (KeyError, ValueError) as e:
+                errors.append((line, str(e)))
+                continue
+
+            key = transaction_key(tx)
+            if key in index:
+                duplicates += 1
+                continue
+            index.add(key)
+            batch.append(tx)
+
+        # Tutte le nuove transazioni vengono salvate con un'unica scrittura
+        if batch:
+            self.data_manager.append_crypto_transactions(batch)
+        return {"Imported": len(batch), "Duplicates": duplicates, "Errors": errors}
+
+    def field(self, row, name):
+        column = self.mapping.get(name)
+        value = row.get(column) if column else None
+        if value is None or not value.strip():
+            if name in CSV_REQUIRED_FIELDS:
+                raise ValueError(f"Campo mancante: {column or name}")
+            return None
+        return value.strip()
+
+    def amount(self, row, name, default=None):
+        value = self.field(row, name)
+        return parse_csv_amount(value, self.decimal_separator) if value else (default, None)
+
+    def parse_row(self, row):
+        timestamp = self.field(row, "Timestamp")
+        parsed_timestamp = parse_timestamp(timestamp)
+        if parsed_timestamp is None:
+            raise ValueError(f"Timestamp non valido: {timestamp!r}")
+
+        base_currency, quote_currency = split_pair(self.field(row, "Pair"), self.known_pairs)
+        side = self.field(row, "Side").capitalize()
+        if side not in ("Buy", "Sell"):
+            raise ValueError(f"Tipo di transazione non valido: {side!r}")
+
+        price, _ = self.amount(row, "Price")
+        filled_amount, _ = self.amount(row, "Filled Amount")
+        order_amount, _ = self.amount(row, "Order Amount", filled_amount)
+        executed_amount, _ = self.amount(row, "Executed Amount", price * filled_amount)
+        trade_fee, fee_unit = self.amount(row, "Trade Fee", 0.0)
+        fee_currency = self.field(row, "Fee Currency") or fee_unit or base_currency
+
+        return {
+            "ID": new_transaction_id(),
+            "Timestamp": parsed_timestamp.strftime(TRANSACTION_TIMESTAMP_FORMAT),
+            "Pair": f"{base_currency}/{quote_currency}",
+            "Base": base_currency,
+            "Quote": quote_currency,
+            "Side": side,
+            "Price": price,
+            "Order Amount": order_amount,
+            "Filled Amount": filled_amount,
+            "Executed Amount": executed_amount,
+            "Trade Fee": trade_fee,
+            "Fee Currency": fee_currency,
+            "Info": self.field(row, "Info") or "Transazione"
+        }
+
+
+# ======================= AllocationEngine Class =======================
+
+# Chiavi di percentuali_target.json con un significato speciale: totali del portafoglio,
+# categorie "resto" che raccolgono gli asset di una classe senza target proprio, etichette
+ALLOCATION_TOTALS = {"liquidita": "Liquidity", "Conto deposito": "Deposits", "Immobili": "Real Estate"}
+ALLOCATION_CATCH_ALL = {"altcoin": "crypto"}
+ALLOCATION_LABELS = {"liquidita": "Liquidità", "Conto deposito": "Conto Deposito", "altcoin": "Altcoin (resto)", "etf": "ETF"}
+
+class AllocationEngine:
+    # Compila i target una sola volta in un elenco di categorie (in ordine di file, ogni gruppo
+    # prima dei suoi elementi) e in un indice asset -> categoria; i gruppi possono essere
+    # annidati e hanno come target la somma dei target interni
+    def __init__(self, targets):
+        self.buckets = []
+        self.asset_index = {}
+        self.totals_index = {}
+        self.catch_all = {}
+        self.compile(targets, None, 0, "")
+
+    def compile(self, targets, parent, depth, prefix):
+        for key, target in targets.items():
+            index = len(self.buckets)
+            bucket = {
+                "Key": key,
+                "Path": f"{prefix}{key}",
+                "Category": ALLOCATION_LABELS.get(key, key),
+                "Parent": parent,
+                "Depth": depth,
+                "Target": 0.0,
+                "Leaf": not isinstance(target, dict)
+            }
+            self.buckets.append(bucket)
+            if isinstance(target, dict):
+                self.compile(target, index, depth + 1, f"{bucket['Path']}/")
+                bucket["Target"] = sum(child["Target"] for child in self.buckets[index + 1:] if child["Parent"] == index)
+                continue
+
+            bucket["Target"] = float(target)
+            if key in ALLOCATION_TOTALS:
+                self.totals_index[ALLOCATION_TOTALS[key]] = index
+            elif key in ALLOCATION_CATCH_ALL:
+                self.catch_all[ALLOCATION_CATCH_ALL[key]] = index
+            elif key in self.asset_index:
+                raise ValueError(f"Asset presente in più categorie di percentuali_target.json: {key}")
+            else:
+                self.asset_index[key] = index
+
+    def evaluate(self, holdings, totals):
+        # holdings: (classe, asset, valore EUR) per ogni asset posseduto, in un'unica passata
+        total_value = totals["Portfolio Value"]
+        if total_value <= 0:
+            return []
+
+        values = [0.0] * len(self.buckets)
+        for totals_key, index in self.totals_index.items():
+            values[index] += totals[totals_key]
+        # Gli asset senza target né categoria "resto" compaiono comunque, con target 0
+        untargeted = {}
+        for asset_class, asset, value in holdings:
+            index = self.asset_index.get(asset, self.catch_all.get(asset_class))
+            if index is None:
+                untargeted[asset] = untargeted.get(asset, 0.0) + value
+            else:
+                values[index] += value
+
+        # Ogni elemento segue il proprio gruppo: scorrendo dal fondo i valori arrivano già completi
+        for index in range(len(self.buckets) - 1, -1, -1):
+            parent = self.buckets[index]["Parent"]
+            if parent is not None:
+                values[parent] += values[index]
+
+        rows = [self.row(bucket, values[index], total_value) for index, bucket in enumerate(self.buckets)]
+        for asset, value in untargeted.items():
+            rows.append(self.row({"Path": asset, "Category": asset, "Parent": None, "Depth": 0, "Target": 0.0}, value, total_value))
+        return rows
+
+    def row(self, bucket, value, total_value):
+        percent = (value / total_value) * 100
+        return {
+            "Category": bucket["Category"],
+            "Path": bucket["Path"],
+            "Group": self.buckets[bucket["Parent"]]["Path"] if bucket["Parent"] is not None else None,
+            "Depth": bucket["Depth"],
+            "Value EUR": value,
+            "Percent": percent,
+            "Target": bucket["Target"],
+            "Drift %": percent - bucket["Target"],
+            "Drift EUR": value - total_value * bucket["Target"] / 100
+        }
+
+
+# ======================= RebalancePlanner Class =======================
+
+# Banda di tolleranza (punti percentuali del patrimonio), ordine minimo e commissione
+# stimata quando lo storico delle transazioni non ha commissioni utilizzabili
+REBALANCE_TOLERANCE = 2.0
+REBALANCE_MIN_TRADE_EUR = 50.0
+REBALANCE_DEFAULT_FEE_RATE = 0.001
+# Parti del patrimonio che non si possono vendere: restano fuori dal ribilanciamento
+REBALANCE_LOCKED_TOTALS = ("Deposits", "Real Estate")
+
+def trade_fee_rates(transactions):
+    # Commissione media per asset come frazione del controvalore, dalle Trade Fee storiche
+    fees = {}
+    volumes = {}
+    for tx in transactions:
+        executed = tx["Executed Amount"]
+        if executed <= 0:
+            continue
+        if tx["Fee Currency"] == tx["Base"]:
+            fee = tx["Trade Fee"] * tx["Price"]
+        elif tx["Fee Currency"] == tx["Quote"]:
+            fee = tx["Trade Fee"]
+        else:
+            continue
+        # Base è il simbolo senza prefisso anche per gli ETF, come l'Asset delle posizioni
+        asset = tx["Base"]
+        fees[asset] = fees.get(asset, 0.0) + fee
+        volumes[asset] = volumes.get(asset, 0.0) + executed
+
+    rates = {asset: fees[asset] / volumes[asset] for asset in fees}
+    total_volume = sum(volumes.values())
+    default_rate = sum(fees.values()) / total_volume if total_volume > 0 else REBALANCE_DEFAULT_FEE_RATE
+    return rates, default_rate
+
+
+class RebalancePlanner:
+    # Ordini minimi per riportare ogni categoria dentro la banda di tolleranza del suo target:
+    # chi è fuori banda viene portato al bordo della banda, non al target, per ridurre gli scambi.
+    # Depositi e immobili non si vendono, quindi target e banda si misurano sul patrimonio
+    # liquidabile; la liquidità finanzia gli acquisti
+    def __init__(self, allocation_engine, fee_rates=None, default_fee_rate=REBALANCE_DEFAULT_FEE_RATE,
+                 tolerance=REBALANCE_TOLERANCE, min_trade=REBALANCE_MIN_TRADE_EUR):
+        self.allocation_engine = allocation_engine
+        self.fee_rates = fee_rates or {}
+        self.default_fee_rate = default_fee_rate
+        self.tolerance = tolerance
+        self.min_trade = min_trade
+
+    def plan(self, holdings, totals):
+        # holdings: (classe, asset, valore EUR, prezzo EUR) per ogni asset posseduto
+        engine = self.allocation_engine
+        total_value = totals["Portfolio Value"]
+        cash = totals["Liquidity"]
+        locked_value = sum(totals[key] for key in REBALANCE_LOCKED_TOTALS)
+        locked_indexes = {engine.totals_index[key] for key in REBALANCE_LOCKED_TOTALS if key in engine.totals_index}
+        cash_index = engine.totals_index.get("Liquidity")
+
+        # Una passata sugli asset: valore e componenti di ogni categoria foglia. Senza prezzo il
+        # valore di un asset (e della sua categoria) non è noto: la categoria resta fuori dal piano
+        members = {}
+        untargeted = []
+        skipped = []
+        unpriced_indexes = set()
+        for asset_class, asset, value, price in holdings:
+            index = engine.asset_index.get(asset, engine.catch_all.get(asset_class))
+            if not price:
+                skipped.append({"Category": engine.buckets[index]["Path"] if index is not None else asset, "Asset": asset, "Reason": "Prezzo non disponibile", "Amount EUR": None})
+                if index is not None:
+                    unpriced_indexes.add(index)
+            elif index is None:
+                untargeted.append((asset, asset_class, value, price))
+            else:
+                members.setdefault(index, []).append((asset, asset_class, value, price))
+
+        entries = []
+        excluded_value = 0.0
+        for index, bucket in enumerate(engine.buckets):
+            if not bucket["Leaf"] or index in locked_indexes:
+                continue
+            if index in unpriced_indexes:
+                excluded_value += sum(member[2] for member in members.get(index, []))
+                continue
+            entries.append((bucket["Path"], bucket["Key"], bucket["Target"], members.get(index, []), index == cash_index))
+        for asset, asset_class, value, price in untargeted:
+            entries.append((asset, asset, 0.0, [(asset, asset_class, value, price)], False))
+
+        free_value = total_value - locked_value - excluded_value
+        target_sum = sum(entry[2] for entry in entries)
+        band = self.tolerance / 100 * free_value
+        orders = []
+        if free_value > 0 and target_sum > 0:
+            for path, key, target, entry_members, is_cash in entries:
+                if is_cash:
+                    continue
+                value = sum(member[2] for member in entry_members)
+                gap = target / target_sum * free_value - value
+                if abs(gap) <= band:
+                    continue
+                amount = gap - band if gap > 0 else gap + band
+                if not entry_members:
+                    # Categoria senza asset posseduti: manca un asset (e un prezzo) a cui intestare l'ordine
+                    skipped.append({"Category": path, "Asset": key, "Reason": "Nessun asset posseduto", "Amount EUR": amount})
+                    continue
+                orders.extend(self.split(path, amount, entry_members))
+
+        orders = [order for order in orders if abs(order["Amount EUR"]) >= self.min_trade]
+        sells = sum(-order["Amount EUR"] - order["Fee EUR"] for order in orders if order["Amount EUR"] < 0)
+        buys = sum(order["Amount EUR"] + order["Fee EUR"] for order in orders if order["Amount EUR"] > 0)
+        # Se la liquidità (più il ricavato delle vendite) non basta, gli acquisti vengono ridotti in proporzione
+        scale = 1.0
+        if buys > cash + sells:
+            scale = max(cash + sells, 0.0) / buys
+            for order in orders:
+                if order["Amount EUR"] > 0:
+                    self.set_amount(order, (order["Amount EUR"] + order["Fee EUR"]) * scale)
+            orders = [order for order in orders if abs(order["Amount EUR"]) >= self.min_trade]
+            buys = sum(order["Amount EUR"] + order["Fee EUR"] for order in orders if order["Amount EUR"] > 0)
+
+        orders.sort(key=lambda order: (order["Side"] == "Buy", -abs(order["Amount EUR"])))
+        fees = sum(order["Fee EUR"] for order in orders)
+        return {
+            "Tolerance": self.tolerance,
+            "Min Trade EUR": self.min_trade,
+            "Orders": orders,
+            "Skipped": skipped,
+            "Locked": [{
+                "Category": engine.buckets[index]["Path"],
+                "Value EUR": totals[key]
+            } for key in REBALANCE_LOCKED_TOTALS for index in [engine.totals_index.get(key)] if index is not None],
+            "Totals": {
+                "Portfolio Value": total_value,
+                "Locked EUR": locked_value,
+                "Excluded EUR": excluded_value,
+                "Buy EUR": sum(order["Amount EUR"] for order in orders if order["Amount EUR"] > 0),
+                "Sell EUR": sum(-order["Amount EUR"] for order in orders if order["Amount EUR"] < 0),
+                "Fees EUR": fees,
+                "Cash Before EUR": cash,
+                "Cash After EUR": cash + sells - buys,
+                "Buy Scale": scale
+            }
+        }
+
+    def split(self, path, amount, entry_members):
+        # La variazione di una categoria con più asset (es. altcoin) viene ripartita in
+        # proporzione al valore di ciascuno, o in parti uguali se nessuno ha valore
+        held = sum(member[2] for member in entry_members)
+        if held <= 0:
+            return [self.order(path, asset, asset_class, amount / len(entry_members), price) for asset, asset_class, _, price in entry_members]
+        return [self.order(path, asset, asset_class, amount * value / held, price) for asset, asset_class, value, price in entry_members if value > 0]
+
+    def order(self, path, asset, asset_class, amount, price):
+        order = {
+            "Category": path,
+            "Asset": asset,
+            "Class": asset_class,
+            "Price EUR": price,
+            "Fee Rate": self.fee_rates.get(asset, self.default_fee_rate)
+        }
+        self.set_amount(order, amount)
+        return order
+
+    def set_amount(self, order, amount):
+        # amount > 0: liquidità impegnata in un acquisto, commissione compresa;
+        # amount < 0: controvalore venduto, da cui la commissione viene detratta al momento dell'incasso
+        if amount > 0:
+            traded = amount / (1 + order["Fee Rate"])
+            order["Side"] = "Buy"
+            order["Amount EUR"] = traded
+        else:
+            traded = -amount
+            order["Side"] = "Sell"
+            order["Amount EUR"] = amount
+        order["Units"] = traded / order["Price EUR"]
+        order["Fee EUR"] = traded * order["Fee Rate"]
+
+
+# ======================= MonteCarloProjection Class =======================
+
+# Orizzonte (anni) e numero di percorsi simulati; i percorsi sono divisi in blocchi con
+# seed propri, così il risultato non dipende dal numero di processi usati
+MONTE_CARLO_YEARS = 10
+MONTE_CARLO_PATHS = 10000
+MONTE_CARLO_CHUNK_PATHS = 25000
+MONTE_CARLO_PERCENTILES = (5, 25, 50, 75, 95)
+# Storico usato per stimare rendimenti e correlazioni, e giorni minimi perché un asset venga simulato
+MONTE_CARLO_LOOKBACK_DAYS = 3 * 365
+MONTE_CARLO_MIN_HISTORY_DAYS = 30
+MONTE_CARLO_POLL_INTERVAL_MS = 100
+DAYS_PER_MONTH = 365.25 / 12
+
+def simulate_net_worth(mu, chol, values, steps, paths, seed):
+    # Valore complessivo degli asset simulati a ogni passo mensile, per un blocco di percorsi.
+    # Funzione di modulo perché viene eseguita anche nei processi del pool
+    np = load_numpy()
+    rng = np.random.default_rng(seed)
+    mu = mu.astype(np.float32)
+    chol = chol.astype(np.float32)
+    values = values.astype(np.float32)
+    log_levels = np.zeros((paths, len(values)), dtype=np.float32)
+    net_worth = np.empty((steps + 1, paths), dtype=np.float32)
+    net_worth[0] = values.sum()
+    for step in range(1, steps + 1):
+        log_levels += mu + rng.standard_normal((paths, len(values)), dtype=np.float32) @ chol.T
+        net_worth[step] = np.exp(log_levels) @ values
+    return net_worth
+
+
+class MonteCarloProjection:
+    # Proiezione del patrimonio: crypto ed ETF seguono rendimenti log-normali correlati stimati
+    # dallo storico dei prezzi (Cholesky della covarianza), liquidità, depositi e immobili
+    # seguono le scadenze dei conti deposito e le rate dei mutui ancora da pagare
+    def __init__(self, price_history, years=MONTE_CARLO_YEARS, paths=MONTE_CARLO_PATHS, workers=None, seed=None,
+                 percentiles=MONTE_CARLO_PERCENTILES, today=None):
+        self.price_history = price_history
+        self.years = years
+        self.paths = paths
+        self.workers = workers
+        self.seed = seed
+        self.percentiles = percentiles
+        self.today = today or datetime.now()
+
+    def daily_closes(self, np, kind, asset, start):
+        # Ultimo prezzo EUR di ogni giorno (i prezzi vengono salvati a ogni aggiornamento)
+        closes = {}
+        for timestamp, _, eur in self.price_history.price_range(asset, start, kind=kind):
+            if eur is not None and eur > 0:
+                closes[int(timestamp // 86400)] = eur
+        days = np.fromiter(closes.keys(), dtype=np.int64, count=len(closes))
+        return days, np.fromiter(closes.values(), dtype=float, count=len(closes))
+
+    def return_model(self, np, assets):
+        # Rendimenti logaritmici giornalieri su una griglia comune (prezzi mancanti riportati
+        # dal giorno prima), riportati a un passo mensile; gli asset con poco storico restano fermi
+        start = self.today.timestamp() - MONTE_CARLO_LOOKBACK_DAYS * 86400
+        series = []
+        for index, (kind, key, _, _) in enumerate(assets):
+            if key is None:
+                continue
+            days, closes = self.daily_closes(np, kind, key, start)
+            if len(days) and days[-1] - days[0] >= MONTE_CARLO_MIN_HISTORY_DAYS:
+                series.append((index, days, closes))
+        if not series:
+            return [], np.zeros(0), np.zeros((0, 0))
+
+        grid = np.arange(max(days[0] for _, days, _ in series), max(days[-1] for _, days, _ in series) + 1)
+        log_prices = np.column_stack([np.log(closes[np.searchsorted(days, grid, side="right") - 1]) for _, days, closes in series])
+        returns = np.diff(log_prices, axis=0)
+        mu = returns.mean(axis=0) * DAYS_PER_MONTH
+        cov = np.atleast_2d(np.cov(returns, rowvar=False)) * DAYS_PER_MONTH
+        return [index for index, _, _ in series], mu, cov
+
+    def cholesky(self, np, cov):
+        try:
+            return np.linalg.cholesky(cov)
+        except np.linalg.LinAlgError:
+            # Serie brevi o quasi identiche danno una covarianza solo semidefinita:
+            # la scomposizione spettrale con autovalori non negativi produce la stessa covarianza
+            eigenvalues, eigenvectors = np.linalg.eigh(cov)
+            return eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))
+
+    def step_date(self, step):
+        return (self.today + timedelta(days=round(step * DAYS_PER_MONTH))).date().isoformat()
+
+    def cash_flows(self, np, steps, totals, deposits, real_estate):
+        liquidity = np.full(steps + 1, totals["Liquidity"], dtype=float)
+        deposits_value = np.full(steps + 1, totals["Deposits"], dtype=float)
+        real_estate_value = np.full(steps + 1, totals["Real Estate"], dtype=float)
+        flows = []
+
+        # Alla scadenza il capitale del conto deposito torna liquido
+        for deposit in deposits:
+            expiry = deposit["Expiry"]
+            if not isinstance(expiry, datetime):
+                continue
+            step = max(0, int(-(-(expiry - self.today).days // DAYS_PER_MONTH)))
+            if step <= steps:
+                deposits_value[step:] -= deposit["Amount EUR"]
+                liquidity[step:] += deposit["Amount EUR"]
+                flows.append({"Date": self.step_date(step), "Type": f"Scadenza {deposit['Type']}", "Amount EUR": deposit["Amount EUR"]})
+
+        # Ogni rata del mutuo sposta la stessa cifra dalla liquidità al valore investito nell'immobile
+        for position in real_estate:
+            if not position["Mortgage"]:
+                continue
+            remaining = min(position["Instalments"] - position["Instalments Paid"], steps)
+            if remaining <= 0:
+                continue
+            paid = np.minimum(np.arange(steps + 1), remaining) * position["Instalment EUR"]
+            liquidity -= paid
+            real_estate_value += paid
+            flows.append({"Date": self.step_date(remaining), "Type": f"Rate mutuo {position['ID']} ({remaining})", "Amount EUR": -float(paid[-1])})
+
+        flows.sort(key=lambda flow: flow["Date"])
+        return liquidity, deposits_value, real_estate_value, flows
+
+    def run(self, assets, totals, deposits, real_estate):
+        # assets: (tipo nello storico prezzi, chiave nello storico, nome, valore EUR) per crypto ed ETF
+        np = load_numpy()
+        if np is None:
+            raise RuntimeError("La proiezione Monte Carlo richiede NumPy")
+
+        steps = int(self.years * 12)
+        modelled, mu, cov = self.return_model(np, assets)
+        modelled_positions = {index: position for position, index in enumerate(modelled)}
+        values = np.array([assets[index][3] for index in modelled], dtype=float)
+        static_value = sum(asset[3] for index, asset in enumerate(assets) if index not in modelled_positions)
+        liquidity, deposits_value, real_estate_value, flows = self.cash_flows(np, steps, totals, deposits, real_estate)
+        deterministic = liquidity + deposits_value + real_estate_value + static_value
+
+        if len(modelled):
+            chol = self.cholesky(np, cov)
+            chunks = [min(MONTE_CARLO_CHUNK_PATHS, self.paths - start) for start in range(0, self.paths, MONTE_CARLO_CHUNK_PATHS)]
+            seeds = np.random.SeedSequence(self.seed).spawn(len(chunks))
+            jobs = [(mu, chol, values, steps, paths, seed) for paths, seed in zip(chunks, seeds)]
+            if self.workers and self.workers > 1 and len(jobs) > 1:
+                with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                    blocks = list(executor.map(simulate_net_worth, *zip(*jobs)))
+            else:
+                blocks = [simulate_net_worth(*job) for job in jobs]
+            bands = np.percentile(np.concatenate(blocks, axis=1), self.percentiles, axis=1) + deterministic
+        else:
+            bands = np.tile(deterministic, (len(self.percentiles), 1))
+
+        return {
+            "Years": self.years,
+            "Paths": self.paths,
+            "Percentiles": list(self.percentiles),
+            "Assets": [{
+                "Asset": name,
+                "Value EUR": value,
+                "Modelled": index in modelled_positions,
+                "Annual Return": float(np.expm1(mu[modelled_positions[index]] * 12)) if index in modelled_positions else None,
+                "Annual Volatility": float(np.sqrt(cov[modelled_positions[index], modelled_positions[index]] * 12)) if index in modelled_positions else None
+            } for index, (_, _, name, value) in enumerate(assets)],
+            "Cash Flows": flows,
+            "Series": [dict(
+                {"Date": self.step_date(step)},
+                **{f"P{percentile}": float(bands[position, step]) for position, percentile in enumerate(self.percentiles)},
+                **{"Liquidity": float(liquidity[step]), "Deposits": float(deposits_value[step]), "Real Estate": float(real_estate_value[step])}
+            ) for step in range(steps + 1)]
+        }
+
+
+def write_projection_csv(projection, output):
+    writer = csv.writer(output)
+    columns = [f"P{percentile}" for percentile in projection["Percentiles"]] + ["Liquidity", "Deposits", "Real Estate"]
+    writer.writerow(["Date"] + columns)
+    for point in projection["Series"]:
+        writer.writerow([point["Date"]] + [point[column] for column in columns])
+
+
+# ======================= PortfolioEngine Class =======================
+
+class PortfolioEngine:
+    # Calcola la valutazione del portafoglio senza dipendere dalla GUI: il risultato è un
+    # dizionario serializzabile che la GUI visualizza e la riga di comando esporta
+    def __init__(self, data_manager, transaction_processor=None):
+        self.data_manager = data_manager
+        self.transaction_processor = transaction_processor or TransactionProcessor(data_manager)
+        self.portfolio = Portfolio(data_manager)
+
+        self.crypto_transactions = []
+        self.fiat_transactions = []
+        self.balances = {}
+        self.avg_prices = {}
+        self.avg_prices_usd = {}
+        self.eur_balance = 0.0
+        self.initial_eur_balance = 0.0
+        self.usdt_balance = 0.0
+        self.total_invested = 0.0
+        self.deposits_reserved = 0.0
+        self.allocation_targets = None
+        self.compiled_allocation = None
+        self.fee_rates_source = None
+        self.fee_rates = ({}, REBALANCE_DEFAULT_FEE_RATE)
+
+    def load(self):
+        self.crypto_transactions = self.data_manager.load_crypto_transactions()
+        self.crypto_transactions.sort(key=lambda tx: tx["Timestamp"])
+        self.eur_balance, self.total_invested, self.fiat_transactions = self.transaction_processor.load_fiat_balance()
+        # process_fiat_transactions somma gli stessi importi a saldo e investito: la differenza è il saldo iniziale
+        self.initial_eur_balance = self.eur_balance - self.total_invested
+        self.fiat_transactions.sort(key=lambda tx: tx["Timestamp"])
+        self.deposits_reserved = self.deposits_total()
+        self.eur_balance -= self.deposits_reserved
+
+        self.balances, self.avg_prices, self.avg_prices_usd, self.eur_balance, self.usdt_balance = self.transaction_processor.process_crypto_ledger(self.crypto_transactions, self.eur_balance)
+
+    def reload_deposits(self):
+        # Il ledger somma i movimenti al saldo EUR in modo lineare: quando cambiano solo
+        # i conti deposito basta correggere il saldo della differenza, senza rielaborarlo
+        deposits_reserved = self.deposits_total()
+        self.eur_balance += self.deposits_reserved - deposits_reserved
+        self.deposits_reserved = deposits_reserved
+
+    def deposits_total(self):
+        return sum(float(deposito["Filled Amount"].replace(" EUR", "")) for deposito in self.data_manager.conto_deposito["Conto deposito"])
+
+    def percentage_gain(self, price_current, price_avg):
+        gain = self.portfolio.calculate_percentage_gain(price_current, price_avg)
+        return gain if isinstance(gain, (int, float)) else None
+
+    def crypto_position(self, currency, prices):
+        balance = self.balances.get(currency, 0.0)
+        avg_price_eur = self.avg_prices.get(currency)
+        avg_price_usd = self.avg_prices_usd.get(currency)
+        coin_id = self.data_manager.crypto_mapping.get(f"{currency}/USDT", None)
+        price_usd = prices.get(coin_id, {}).get('usd')
+        price_eur = prices.get(coin_id, {}).get('eur')
+        price_eur = float(price_eur) if price_eur is not None else None
+
+        selling_price_usd = self.data_manager.selling_prices.get(currency)
+        selling_value_usd = None
+        selling_value_eur = None
+        if selling_price_usd and isinstance(selling_price_usd, (int, float)):
+            selling_value_usd = balance * selling_price_usd
+            # Il valore di vendita viene convertito in EUR con il cambio corrente USD/EUR
+            usd_to_eur_rate = prices.get('tether', {}).get('eur', 0.0)
+            if usd_to_eur_rate > 0:
+                selling_value_eur = selling_value_usd * usd_to_eur_rate
+
+        return {
+            "Asset": currency,
+            "Units": balance,
+            "Avg Price USD": avg_price_usd,
+            "Avg Price EUR": avg_price_eur,
+            "Price USD": price_usd,
+            "Price EUR": price_eur,
+            "Value EUR": balance * price_eur if price_eur is not None else None,
+            "Invested EUR": balance * avg_price_eur if avg_price_eur is not None else None,
+            "Gain %": self.percentage_gain(price_usd if price_usd is not None else 'N/A', avg_price_usd if avg_price_usd is not None else 'N/A'),
+            "Selling Price USD": selling_price_usd,
+            "Selling Value USD": selling_value_usd,
+            "Selling Value EUR": selling_value_eur
+        }
+
+    def usdt_position(self, prices):
+        avg_price_eur = self.avg_prices.get('USDT')
+        price_eur = prices.get('tether', {}).get('eur')
+        price_eur = float(price_eur) if price_eur is not None else None
+        usdt_balance = float(self.usdt_balance)
+
+        return {
+            "Asset": "USDT",
+            "Units": usdt_balance,
+            "Avg Price USD": 1.0,
+            "Avg Price EUR": avg_price_eur,
+            "Price USD": 1.0,
+            "Price EUR": price_eur,
+            "Value EUR": usdt_balance * price_eur if price_eur is not None else None,
+            "Gain %": self.percentage_gain(price_eur if price_eur is not None else 'N/A', avg_price_eur if avg_price_eur is not None else 'N/A')
+        }
+
+    def etf_position(self, currency):
+        balance = self.balances[currency]
+        avg_price = self.avg_prices.get(currency)
+        etf_name = currency[4:]
+        price = self.data_manager.manual_etf_prices.get(etf_name, self.data_manager.etf_mapping.get(etf_name))
+        priced = isinstance(price, (int, float))
+
+        return {
+            "Asset": etf_name,
+            "Units": balance,
+            "Avg Price EUR": avg_price,
+            "Price EUR": price if priced else None,
+            "Value EUR": balance * price if priced else None,
+            "Invested EUR": balance * avg_price if priced and avg_price is not None else None,
+            "Gain %": self.percentage_gain(price, avg_price if avg_price is not None else 'N/A') if priced else None
+        }
+
+    def asset_price_eur(self, asset, prices):
+        if asset == 'USDT':
+            price = prices.get('tether', {}).get('eur')
+        elif asset.startswith('ETF_'):
+            price = self.data_manager.manual_etf_prices.get(asset[4:], self.data_manager.etf_mapping.get(asset[4:]))
+        else:
+            price = prices.get(self.data_manager.crypto_mapping.get(f"{asset}/USDT", None), {}).get('eur')
+        return float(price) if isinstance(price, (int, float)) else None
+
+    def cost_basis(self, method="FIFO", prices=None):
+        # P&L realizzato (per asset e per anno) e non realizzato, abbinando i lotti con il metodo scelto
+        if prices is None:
+            prices = self.data_manager.get_cached_crypto_prices()
+        tracker = LotTracker(method)
+        for tx in self.crypto_transactions:
+            tracker.apply(tx)
+        return tracker.report({asset: self.asset_price_eur(asset, prices) for asset in tracker.positions})
+
+    def projection(self, prices=None, years=MONTE_CARLO_YEARS, paths=MONTE_CARLO_PATHS, workers=None, seed=None, snapshot=None):
+        # La GUI passa una valutazione già pronta: la simulazione gira in un thread e non deve leggere il ledger
+        snapshot = snapshot or self.valuation(prices)
+        assets = [("crypto", self.data_manager.crypto_mapping.get(f"{position['Asset']}/USDT"), position["Asset"], position["Value EUR"] or 0.0) for position in snapshot["Crypto"]]
+        assets += [("etf", position["Asset"], position["Asset"], position["Value EUR"] or 0.0) for position in snapshot["ETF"]]
+        projection = MonteCarloProjection(self.data_manager.price_history, years, paths, workers, seed)
+        return projection.run(assets, snapshot["Totals"], snapshot["Deposits"], snapshot["Real Estate"])
+
+    def history(self, today=None):
+        return PortfolioHistory(self.data_manager, self.transaction_processor).build(self.crypto_transactions, self.fiat_transactions, self.initial_eur_balance, today)
+
+    def deposit_positions(self):
+        return [{
+            "Timestamp": deposito["Timestamp"],
+            "Type": deposito["Type"],
+            "Amount EUR": float(deposito["Filled Amount"].replace(" EUR", "")),
+            "Expiry": deposito["Scadenza"]
+        } for deposito in self.data_manager.conto_deposito["Conto deposito"]]
+
+    def real_estate_positions(self):
+        positions = []
+        for immobile in self.data_manager.immobili_data["Immobili"]:
+            position = {
+                "ID": immobile["ID"],
+                "Type": immobile["Tipo"],
+                "Value EUR": immobile["Valore"],
+                "Mortgage": bool(immobile["Mutuo"]),
+                "Down Payment EUR": immobile["Anticipo"],
+                "Mortgage Value EUR": immobile["Valore Mutuo"],
+                "Instalments": None,
+                "Instalment EUR": None,
+                "Instalments Paid": None,
+                "Invested EUR": immobile["Anticipo"]
+            }
+            if immobile["Mutuo"]:
+                position["Instalments"] = immobile["Numero Rate"]
+                position["Instalment EUR"] = immobile["Importo Rata"]
+                position["Instalments Paid"] = immobile["Pagamenti Effettuati"]
+                position["Invested EUR"] = immobile["Anticipo"] + immobile["Importo Rata"] * immobile["Pagamenti Effettuati"]
+            positions.append(position)
+        return positions
+
+    def allocation_engine(self):
+        # Il file dei target viene ricompilato solo quando DataManager lo rilegge
+        targets = self.data_manager.percentuali_target
+        if self.allocation_targets is not targets:
+            self.compiled_allocation = AllocationEngine(targets)
+            self.allocation_targets = targets
+        return self.compiled_allocation
+
+    def allocation(self, crypto, etf, totals):
+        holdings = [("crypto", position["Asset"], position["Value EUR"] or 0.0) for position in crypto]
+        holdings += [("etf", position["Asset"], position["Value EUR"] or 0.0) for position in etf]
+        return self.allocation_engine().evaluate(holdings, totals)
+
+    def rebalance(self, prices=None, tolerance=REBALANCE_TOLERANCE, min_trade=REBALANCE_MIN_TRADE_EUR):
+        snapshot = self.valuation(prices)
+        if self.fee_rates_source is not self.crypto_transactions:
+            self.fee_rates = trade_fee_rates(self.crypto_transactions)
+            self.fee_rates_source = self.crypto_transactions
+        fee_rates, default_fee_rate = self.fee_rates
+
+        holdings = [("crypto", position["Asset"], position["Value EUR"] or 0.0, position["Price EUR"]) for position in snapshot["Crypto"]]
+        holdings += [("etf", position["Asset"], position["Value EUR"] or 0.0, position["Price EUR"]) for position in snapshot["ETF"]]
+        planner = RebalancePlanner(self.allocation_engine(), fee_rates, default_fee_rate, tolerance, min_trade)
+        return planner.plan(holdings, snapshot["Totals"])
+
+    def valuation(self, prices=None):
+        if prices is None:
+            prices = self.data_manager.get_cached_crypto_prices()
+
+        crypto = []
+        usdt = None
+        etf = []
+        for currency in self.balances:
+            if currency == 'USDT':
+                usdt = self.usdt_position(prices)
+            elif currency.startswith('ETF_'):
+                etf.append(self.etf_position(currency))
+            else:
+                crypto.append(self.crypto_position(currency, prices))
+
+        deposits = self.deposit_positions()
+        real_estate = self.real_estate_positions()
+
+        crypto_value = sum(position["Value EUR"] for position in crypto if position["Value EUR"] is not None)
+        etf_value = sum(position["Value EUR"] for position in etf if position["Value EUR"] is not None)
+        invested = sum(position["Invested EUR"] for position in crypto + etf if position["Invested EUR"] is not None)
+        deposits_value = sum(position["Amount EUR"] for position in deposits)
+        real_estate_value = sum(position["Invested EUR"] for position in real_estate)
+        liquidity = self.eur_balance + self.usdt_balance * prices.get('tether', {}).get('eur', 0)
+
+        potential_selling_value = 0.0
+        usd_to_eur_rate = prices.get('tether', {}).get('eur', 0.0)
+        for currency, selling_price_usd in self.data_manager.selling_prices.items():
+            balance = self.balances.get(currency, 0.0)
+            if balance > 0 and selling_price_usd and usd_to_eur_rate > 0:
+                potential_selling_value += balance * selling_price_usd * usd_to_eur_rate
+
+        totals = {
+            "EUR Balance": self.eur_balance,
+            "USDT Balance": self.usdt_balance,
+            "Liquidity": liquidity,
+            "Deposits": deposits_value,
+            "Real Estate": real_estate_value,
+            "Invested": invested,
+            "Crypto Value": crypto_value,
+            "ETF Value": etf_value,
+            "Current Value": etf_value + crypto_value,
+            "Potential Selling Value": potential_selling_value,
+            "Portfolio Value": etf_value + crypto_value + liquidity + deposits_value + real_estate_value
+        }
+
+        return {
+            "Timestamp": now_timestamp(),
+            "Crypto": crypto,
+            "USDT": usdt,
+            "ETF": etf,
+            "Deposits": deposits,
+            "Real Estate": real_estate,
+            "Totals": totals,
+            "Allocation": self.allocation(crypto, etf, totals)
+        }
+
+
+SNAPSHOT_CSV_COLUMNS = ("Section", "Name", "Units", "Price EUR", "Value EUR", "Invested EUR", "Gain %", "Percent", "Target", "Drift %")
+
+
+def write_snapshot_csv(snapshot, output):
+    writer = csv.writer(output)
+    writer.writerow(SNAPSHOT_CSV_COLUMNS)
+    positions = snapshot["Crypto"] + ([snapshot["USDT"]] if snapshot["USDT"] else [])
+    for position in positions:
+        writer.writerow(("Crypto", position["Asset"], position["Units"], position["Price EUR"], position["Value EUR"], position.get("Invested EUR"), position["Gain %"], "", "", ""))
+    for position in snapshot["ETF"]:
+        writer.writerow(("ETF", position["Asset"], position["Units"], position["Price EUR"], position["Value EUR"], position["Invested EUR"], position["Gain %"], "", "", ""))
+    for position in snapshot["Deposits"]:
+        writer.writerow(("Deposits", f"{position['Type']} {position['Expiry']}", "", "", position["Amount EUR"], position["Amount EUR"], "", "", "", ""))
+    for position in snapshot["Real Estate"]:
+        writer.writerow(("Real Estate", f"{position['ID']} {position['Type']}", "", "", position["Value EUR"], position["Invested EUR"], "", "", "", ""))
+    for bucket in snapshot["Allocation"]:
+        writer.writerow(("Allocation", bucket["Path"], "", "", bucket["Value EUR"], "", "", bucket["Percent"], bucket["Target"], bucket["Drift %"]))
+    for name, value in snapshot["Totals"].items():
+        writer.writerow(("Totals", name, "", "", value, "", "", "", "", ""))
+
+
+REBALANCE_CSV_COLUMNS = ("Section", "Category", "Asset", "Side", "Amount EUR", "Units", "Price EUR", "Fee EUR", "Reason")
+
+
+def write_rebalance_csv(plan, output):
+    writer = csv.writer(output)
+    writer.writerow(REBALANCE_CSV_COLUMNS)
+    for order in plan["Orders"]:
+        writer.writerow(("Order", order["Category"], order["Asset"], order["Side"], order["Amount EUR"], order["Units"], order["Price EUR"], order["Fee EUR"], ""))
+    for skipped in plan["Skipped"]:
+        writer.writerow(("Skipped", skipped["Category"], skipped["Asset"], "", skipped["Amount EUR"], "", "", "", skipped["Reason"]))
+    for locked in plan["Locked"]:
+        writer.writerow(("Locked", locked["Category"], "", "", locked["Value EUR"], "", "", "", ""))
+    for name, value in plan["Totals"].items():
+        writer.writerow(("Totals", name, "", "", value, "", "", "", ""))
+
+
+COST_BASIS_CSV_COLUMNS = ("Section", "Asset", "Year", "Units", "Cost Basis EUR", "Value EUR", "Proceeds EUR", "Realised EUR", "Unrealised EUR")
+
+
+def write_cost_basis_csv(report, output):
+    writer = csv.writer(output)
+    writer.writerow(COST_BASIS_CSV_COLUMNS)
+    for position in report["Assets"]:
+        writer.writerow(("Assets", position["Asset"], "", position["Units"], position["Cost Basis EUR"], position["Value EUR"], "", position["Realised EUR"], position["Unrealised EUR"]))
+    for row in report["Realised"]:
+        writer.writerow(("Realised", row["Asset"], row["Year"], "", row["Cost Basis EUR"], "", row["Proceeds EUR"], row["Realised EUR"], ""))
+    for row in report["Years"]:
+        writer.writerow(("Years", "", row["Year"], "", row["Cost Basis EUR"], "", row["Proceeds EUR"], row["Realised EUR"], ""))
+    totals = report["Totals"]
+    writer.writerow(("Totals", report["Method"], "", "", totals["Cost Basis EUR"], totals["Value EUR"], "", totals["Realised EUR"], totals["Unrealised EUR"]))
+
+
+# ======================= PortfolioHistory Class =======================
+
+PORTFOLIO_HISTORY_VERSION = 1
+# Prelievi FIAT che finanziano gli immobili (anticipo e rate del mutuo)
+REAL_ESTATE_PAYMENT_INFOS = ("Pagamento immobile", "Pagamento rata mutuo")
+HISTORY_SERIES_KEYS = ("Net Worth", "Liquidity", "Deposits", "Real Estate", "Crypto", "ETF")
+
+class PortfolioHistory:
+    # Serie giornaliera del patrimonio: il ledger ordinato viene percorso una sola volta e a fine
+    # giornata i saldi vengono valorizzati con lo storico prezzi. I giorni conclusi vengono salvati
+    # insieme allo stato del ledger, così le esecuzioni successive calcolano solo i giorni nuovi
+    def __init__(self, data_manager, transaction_processor=None, path=None):
+        self.data_manager = data_manager
+        self.transaction_processor = transaction_processor or TransactionProcessor(data_manager)
+        self.path = path or data_manager.portfolio_history_path
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return data if data.get("version") == PORTFOLIO_HISTORY_VERSION else None
+
+    def save(self, data):
+        write_json_atomic(self.path, data)
+
+    def deposits(self):
+        deposits = [
+            (parse_timestamp(deposito["Timestamp"]).strftime("%Y-%m-%d"), float(deposito["Filled Amount"].replace(" EUR", "")))
+            for deposito in self.data_manager.conto_deposito["Conto deposito"]
+        ]
+        deposits.sort()
+        return deposits
+
+    def digest(self, fiat_transactions, deposits, initial_eur_balance):
+        # Impronta dei dati già elaborati: se un dato passato cambia la serie viene ricalcolata
+        return hashlib.sha1(repr([fiat_transactions, deposits, initial_eur_balance]).encode("utf-8")).hexdigest()
+
+    def crypto_digest(self, crypto_transactions, segments, digest="", start=0):
+        # Il ledger crypto può essere molto lungo: l'impronta è concatenata per segmenti (uno per
+        # salvataggio), così a ogni salvataggio si elaborano solo le transazioni nuove
+        for end in segments:
+            digest = hashlib.sha1((digest + repr(crypto_transactions[start:end])).encode("utf-8")).hexdigest()
+            start = end
+        return digest
+
+    def resumable(self, stored, fingerprint, crypto_transactions, fiat_transactions, deposits, initial_eur_balance):
+        crypto_count = stored["crypto_count"]
+        fiat_count = stored["fiat_count"]
+        deposit_count = stored["deposit_count"]
+        next_day = (datetime.strptime(stored["last_day"], "%Y-%m-%d").date() + timedelta(days=1)).isoformat()
+        # Nessuna transazione deve essere stata inserita prima dell'ultimo giorno salvato
+        if crypto_count > len(crypto_transactions) or (crypto_count < len(crypto_transactions) and crypto_transactions[crypto_count]["Timestamp"] < next_day):
+            return False
+        if fiat_count > len(fiat_transactions) or (fiat_count < len(fiat_transactions) and fiat_transactions[fiat_count]["Timestamp"] < next_day):
+            return False
+        if deposit_count > len(deposits) or (deposit_count < len(deposits) and deposits[deposit_count][0] < next_day):
+            return False
+        if self.digest(fiat_transactions[:fiat_count], deposits[:deposit_count], initial_eur_balance) != stored["digest"]:
+            return False
+        # Se il ledger crypto non è stato toccato dall'ultimo salvataggio non serve ricalcolarne l'impronta
+        if stored["crypto_fingerprint"] == fingerprint:
+            return True
+        return self.crypto_digest(crypto_transactions, stored["crypto_segments"]) == stored["crypto_digest"]
+
+    def build(self, crypto_transactions, fiat_transactions, initial_eur_balance=0.0, today=None):
+        # Le transazioni devono essere ordinate per timestamp (come in PortfolioEngine.load)
+        today = today or datetime.now().date()
+        deposits = self.deposits()
+        first_dates = [transactions[0]["Timestamp"][:10] for transactions in (crypto_transactions, fiat_transactions) if transactions]
+        first_dates += [date for date, _ in deposits[:1]]
+        if not first_dates:
+            return []
+
+        fingerprint = list(self.data_manager.crypto_transactions_fingerprint())
+        stored = self.load()
+        if stored is not None and not self.resumable(stored, fingerprint, crypto_transactions, fiat_transactions, deposits, initial_eur_balance):
+            stored = None
+
+        if stored is None:
+            stored = {
+                "crypto_fingerprint": None,
+                "crypto_segments": [],
+                "crypto_digest": "",
+                "series": []
+            }
+            walk = {
+                "day": datetime.strptime(min(first_dates), "%Y-%m-%d").date(),
+                "crypto_count": 0,
+                "fiat_count": 0,
+                "deposit_count": 0,
+                "state": LedgerState(),
+                "fiat_balance": initial_eur_balance,
+                "real_estate": 0.0,
+                "deposits": 0.0,
+                "trade_prices": {}
+            }
+        else:
+            walk = {
+                "day": datetime.strptime(stored["last_day"], "%Y-%m-%d").date() + timedelta(days=1),
+                "crypto_count": stored["crypto_count"],
+                "fiat_count": stored["fiat_count"],
+                "deposit_count": stored["deposit_count"],
+                "state": LedgerState.from_dict(stored["state"]),
+                "fiat_balance": stored["fiat_balance"],
+                "real_estate": stored["real_estate"],
+                "deposits": stored["deposits"],
+                "trade_prices": stored["trade_prices"]
+            }
+        series = stored["series"]
+
+        prices = HistoricalPrices(self.data_manager.price_history, datetime.combine(walk["day"], datetime.min.time()).timestamp())
+        crypto_start = walk["crypto_count"]
+        completed = len(series)
+        while walk["day"] < today:
+            series.append(self.advance(walk, crypto_transactions, fiat_transactions, deposits, prices))
+
+        # Si salva anche quando cambia solo l'impronta del ledger, per non doverla riverificare ogni volta
+        if series and (len(series) > completed or stored["crypto_fingerprint"] != fingerprint):
+            segments = stored["crypto_segments"]
+            if walk["crypto_count"] > crypto_start:
+                segments = segments + [walk["crypto_count"]]
+            self.save({
+                "version": PORTFOLIO_HISTORY_VERSION,
+                "last_day": series[-1]["Date"],
+                "digest": self.digest(fiat_transactions[:walk["fiat_count"]], deposits[:walk["deposit_count"]], initial_eur_balance),
+                "crypto_fingerprint": fingerprint,
+                "crypto_segments": segments,
+                "crypto_digest": self.crypto_digest(crypto_transactions, segments[len(stored["crypto_segments"]):], stored["crypto_digest"], crypto_start),
+                "crypto_count": walk["crypto_count"],
+                "fiat_count": walk["fiat_count"],
+                "deposit_count": walk["deposit_count"],
+                "state": walk["state"].to_dict(),
+                "fiat_balance": walk["fiat_balance"],
+                "real_estate": walk["real_estate"],
+                "deposits": walk["deposits"],
+                "trade_prices": walk["trade_prices"],
+                "series": series
+            })
+
+        # Il giorno corrente non è concluso: viene calcolato a ogni esecuzione ma non salvato
+        if walk["day"] == today:
+            state = walk["state"].copy()
+            walk = dict(walk, state=state, trade_prices=dict(walk["trade_prices"]))
+            return series + [self.advance(walk, crypto_transactions, fiat_transactions, deposits, prices)]
+        return series
+
+    def advance(self, walk, crypto_transactions, fiat_transactions, deposits, prices):
+        day = walk["day"]
+        next_day = day + timedelta(days=1)
+        boundary = next_day.isoformat()
+        state = walk["state"]
+        trade_prices = walk["trade_prices"]
+
+        index = walk["crypto_count"]
+        while index < len(crypto_transactions) and crypto_transactions[index]["Timestamp"] < boundary:
+            tx = crypto_transactions[index]
+            state.apply(tx)
+            # Ultimo prezzo di scambio: valuta gli asset per i giorni senza prezzi nello storico
+            asset = f"ETF_{tx['Base']}" if tx.get("Info") == "Etf" else tx["Base"]
+            if tx["Price"] > 0:
+                trade_prices[asset] = [tx["Price"], tx["Quote"]]
+            index += 1
+        walk["crypto_count"] = index
+
+        index = walk["fiat_count"]
+        while index < len(fiat_transactions) and fiat_transactions[index]["Timestamp"] < boundary:
+            index += 1
+        day_transactions = fiat_transactions[walk["fiat_count"]:index]
+        walk["fiat_balance"], _ = self.transaction_processor.process_fiat_transactions(day_transactions, walk["fiat_balance"])
+        walk["real_estate"] += sum(tx["Filled Amount"] for tx in day_transactions if tx["Type"] == "Withdraw FIAT" and tx.get("Info") in REAL_ESTATE_PAYMENT_INFOS)
+        walk["fiat_count"] = index
+
+        index = walk["deposit_count"]
+        while index < len(deposits) and deposits[index][0] < boundary:
+            walk["deposits"] += deposits[index][1]
+            index += 1
+        walk["deposit_count"] = index
+
+        end_of_day = datetime.combine(next_day, datetime.min.time()).timestamp()
+        usdt_eur = prices.price("crypto", "tether", end_of_day)
+        if usdt_eur is None:
+            usdt_eur = trade_prices.get("USDT", [0.0, "EUR"])[0]
+
+        crypto_value = 0.0
+        etf_value = 0.0
+        for asset, units in state.balances.items():
+            if asset == 'USDT' or not units:
+                continue
+            if asset.startswith('ETF_'):
+                price = prices.price("etf", asset[4:], end_of_day)
+            else:
+                price = prices.price("crypto", self.data_manager.crypto_mapping.get(f"{asset}/USDT"), end_of_day)
+            if price is None and asset in trade_prices:
+                trade_price, quote_currency = trade_prices[asset]
+                price = trade_price if quote_currency == "EUR" else trade_price * usdt_eur
+            if price is None:
+                continue
+            if asset.startswith('ETF_'):
+                etf_value += units * price
+            else:
+                crypto_value += units * price
+
+        liquidity = walk["fiat_balance"] + state.eur_delta - walk["deposits"] + state.usdt_balance * usdt_eur
+        walk["day"] = next_day
+        return {
+            "Date": day.isoformat(),
+            "Net Worth": liquidity + walk["deposits"] + walk["real_estate"] + crypto_value + etf_value,
+            "Liquidity": liquidity,
+            "Deposits": walk["deposits"],
+            "Real Estate": walk["real_estate"],
+            "Crypto": crypto_value,
+            "ETF": etf_value
+        }
+
+
+class HistoricalPrices:
+    # Prezzi di fine giornata dallo storico SQLite: ogni serie viene letta una sola volta
+    # dall'inizio del calcolo e scorsa in avanti insieme ai giorni
+    def __init__(self, price_history, start):
+        self.price_history = price_history
+        self.start = start
+        self.cursors = {}
+
+    def price(self, kind, asset, timestamp):
+        if asset is None:
+            return None
+        cursor = self.cursors.get((kind, asset))
+        if cursor is None:
+            previous = self.price_history.price_at(asset, self.start, kind)
+            rows = self.price_history.price_range(asset, self.start, kind=kind)
+            cursor = self.cursors[(kind, asset)] = [rows, 0, previous[2] if previous else None]
+        rows, index, price = cursor
+        while index < len(rows) and rows[index][0] <= timestamp:
+            if rows[index][2] is not None:
+                price = rows[index][2]
+            index += 1
+        cursor[1] = index
+        cursor[2] = price
+        return price
+
+
+def write_history_csv(series, output):
+    writer = csv.writer(output)
+    writer.writerow(("Date",) + HISTORY_SERIES_KEYS)
+    for point in series:
+        writer.writerow([point["Date"]] + [point[key] for key in HISTORY_SERIES_KEYS])
+
+
+# ======================= VirtualTreeview Class =======================
+
+class VirtualTreeview:
+    # Treeview che materializza solo la finestra di righe visibili: le righe restano in una
+    # lista Python e lo scorrimento riusa sempre gli stessi item, aggiornandoli solo se cambiano
+    def __init__(self, parent, columns, height=15, column_width=150, on_select=None):
+        self.tree = ttk.Treeview(parent, columns=columns, show="headings", height=height, selectmode="browse")
+        for col in columns:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, minwidth=0, width=column_width)
+        self.scrollbar = ttk.Scrollbar(parent, orient="vertical", command=self.on_scroll)
+
+        self.rows = []  # lista di (chiave, valori)
+        self.offset = 0
+        self.visible_rows = height
+        self.slots = []  # item materializzati, riusati durante lo scorrimento
+        self.slot_values = []
+        self.selected_key = None
+        self.select_callback = on_select
+
+        self.tree.bind("<<TreeviewSelect>>", self.on_select)
+        self.tree.bind("<Configure>", self.on_configure)
+        self.tree.bind("<MouseWheel>", self.on_mousewheel)
+        self.tree.bind("<Button-4>", lambda event: self.scroll_by(-3))
+        self.tree.bind("<Button-5>", lambda event: self.scroll_by(3))
+
+    def pack(self, **kwargs):
+        self.scrollbar.pack(side="right", fill="y")
+        self.tree.pack(**kwargs)
+
+    def set_rows(self, rows):
+        self.rows = rows
+        if self.selected_key is not None and not any(key == self.selected_key for key, _ in rows):
+            self.selected_key = None
+        self.offset = min(self.offset, max(0, len(self.rows) - self.visible_rows))
+        self.render()
+
+    def scroll_by(self, rows):
+        self.offset = max(0, min(self.offset + rows, len(self.rows) - self.visible_rows))
+        self.render()
+
+    def on_scroll(self, action, amount, unit=None):
+        if action == "moveto":
+            self.offset = int(float(amount) * len(self.rows))
+            self.scroll_by(0)
+        elif action == "scroll":
+            step = self.visible_rows if unit == "pages" else 1
+            self.scroll_by(int(amount) * step)
+
+    def on_mousewheel(self, event):
+        self.scroll_by(-3 if event.delta > 0 else 3)
+
+    def on_configure(self, event):
+        # Le righe si contano sotto l'intestazione: la prima riga materializzata ne dà la posizione
+        # e l'altezza, altrimenti si stima un'intestazione alta quanto una riga
+        bbox = self.tree.bbox(self.slots[0]) if self.slots else ""
+        if bbox and bbox[3] > 0:
+            top, row_height = bbox[1], bbox[3]
+        else:
+            row_height = int(ttk.Style().lookup("Treeview", "rowheight") or 20)
+            top = row_height
+        visible_rows = max(1, (event.height - top) // row_height)
+        if visible_rows != self.visible_rows:
+            self.visible_rows = visible_rows
+            self.scroll_by(0)
+
+    def on_select(self, event):
+        # Una selezione vuota arriva anche quando la riga scelta esce dalla finestra visibile,
+        # quindi la chiave selezionata cambia solo su una nuova selezione
+        selection = self.tree.selection()
+        if selection and selection[0] in self.slots:
+            position = self.offset + self.slots.index(selection[0])
+            if position < len(self.rows):
+                self.selected_key = self.rows[position][0]
+                if self.select_callback is not None:
+                    self.select_callback(self.selected_key)
+
+    def clear_selection(self):
+        if self.selected_key is not None:
+            self.selected_key = None
+            self.render()
+
+    def render(self):
+        window = self.rows[self.offset:self.offset + self.visible_rows]
+
+        # Adegua il numero di item alla finestra visibile
+        while len(self.slots) < len(window):
+            self.slots.append(self.tree.insert("", "end", values=()))
+            self.slot_values.append(None)
+        while len(self.slots) > len(window):
+            self.tree.delete(self.slots.pop())
+            self.slot_values.pop()
+
+        selected_slot = None
+        for slot_index, (key, values) in enumerate(window):
+            if self.slot_values[slot_index] != values:
+                self.tree.item(self.slots[slot_index], values=values)
+                self.slot_values[slot_index] = values
+            if key == self.selected_key:
+                selected_slot = self.slots[slot_index]
+
+        if selected_slot is not None:
+            self.tree.selection_set(selected_slot)
+        elif self.tree.selection():
+            self.tree.selection_remove(*self.tree.selection())
+
+        if self.rows:
+            self.scrollbar.set(self.offset / len(self.rows), min(1.0, (self.offset + len(window)) / len(self.rows)))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+
+# ======================= TreeviewSync Class =======================
+
+class TreeviewSync:
+    # Aggiorna una Treeview confrontando le nuove righe con quelle già mostrate:
+    # inserisce, rimuove o modifica solo gli item cambiati
+    def __init__(self, tree):
+        self.tree = tree
+        self.values = {}  # iid -> valori mostrati
+        self.order = []
+
+    def sync(self, rows):
+        new_iids = set(iid for iid, _ in rows)
+        stale = [iid for iid in self.order if iid not in new_iids]
+        if stale:
+            self.tree.delete(*stale)
+            for iid in stale:
+                del self.values[iid]
+            self.order = [iid for iid in self.order if iid in new_iids]
+
+        for index, (iid, values) in enumerate(rows):
+            if iid not in self.values:
+                self.tree.insert("", index, iid=iid, values=values)
+                self.values[iid] = values
+                self.order.insert(index, iid)
+                continue
+            self.update(iid, values)
+            if self.order[index] != iid:
+                self.tree.move(iid, "", index)
+                self.order.remove(iid)
+                self.order.insert(index, iid)
+
+    def update(self, iid, values):
+        if self.values.get(iid) != values:
+            self.tree.item(iid, values=values)
+            self.values[iid] = values
+
+
+# ======================= AllocationView Class =======================
+
+class AllocationView:
+    # Una barra di avanzamento per categoria di allocazione: i widget restano gli stessi fra
+    # un aggiornamento e l'altro, cambiano solo valori ed etichette; le righe vengono create
+    # o distrutte solo quando cambiano le categorie
+    def __init__(self, parent):
+        self.parent = parent
+        self.rows = {}
+        self.order = None
+        self.empty_label = ttk.Label(parent, text="Nessun dato disponibile per creare le barre di progresso.", font=("Arial", 10, "bold"))
+
+    def create_row(self):
+        frame = ttk.Frame(self.parent)
+        label = ttk.Label(frame, font=("Arial", 10, "bold"))
+        label.pack(side=tk.LEFT, padx=5)
+        progress = ttk.Progressbar(frame, style="custom.Horizontal.TProgressbar", orient='horizontal', length=300, mode='determinate', maximum=100)
+        progress.pack(side=tk.LEFT, padx=5)
+        percent_label = ttk.Label(frame, font=("Arial", 10))
+        percent_label.pack(side=tk.LEFT, padx=5)
+        return {"Frame": frame, "Label": label, "Progress": progress, "Percent Label": percent_label, "Values": None}
+
+    def sync(self, buckets):
+        categories = [bucket["Path"] for bucket in buckets]
+        for category in set(self.rows) - set(categories):
+            self.rows.pop(category)["Frame"].destroy()
+        for category in categories:
+            if category not in self.rows:
+                self.rows[category] = self.create_row()
+
+        if categories != self.order:
+            # Nuove categorie o ordine diverso: si reimpacchettano le righe, senza ricrearle
+            for row in self.rows.values():
+                row["Frame"].pack_forget()
+            for category in categories:
+                self.rows[category]["Frame"].pack(fill=tk.X, pady=5)
+            if categories:
+                self.empty_label.pack_forget()
+            else:
+                self.empty_label.pack(pady=5)
+            self.order = categories
+
+        for bucket in buckets:
+            row = self.rows[bucket["Path"]]
+            # Gli elementi di un gruppo sono rientrati sotto il gruppo
+            values = (
+                f"{'    ' * bucket['Depth']}{bucket['Category']}: {bucket['Value EUR']:,.2f} EUR",
+                bucket["Percent"],
+                f"{bucket['Percent']:.2f}% / {bucket['Target']:.2f}% ({bucket['Drift %']:+.2f})"
+            )
+            if row["Values"] != values:
+                row["Label"].config(text=values[0])
+                row["Progress"]["value"] = values[1]
+                row["Percent Label"].config(text=values[2])
+                row["Values"] = values
+
+
+# ======================= RefreshScheduler Class =======================
+
+class RefreshScheduler:
+    # Raccoglie le parti dei dati modificate (vedi REFRESH_PARTS) e aggiorna le viste una sola
+    # volta, al primo giro libero del ciclo di eventi: più modifiche ravvicinate diventano un refresh
+    def __init__(self, root, refresh, delay_ms=REFRESH_DELAY_MS):
+        self.root = root
+        self.refresh = refresh
+        self.delay_ms = delay_ms
+        self.dirty = set()
+        self.pending = None
+
+    def mark(self, *parts):
+        self.dirty.update(parts)
+        if self.pending is None:
+            self.pending = self.root.after(self.delay_ms, self.flush)
+
+    def flush(self):
+        if self.pending is not None:
+            self.root.after_cancel(self.pending)
+            self.pending = None
+        dirty, self.dirty = self.dirty, set()
+        if dirty:
+            self.refresh(dirty)
+
+
+# ======================= HistoryChart Class =======================
+
+def downsample_min_max(values, buckets):
+    # Per ogni colonna di pixel tiene minimo e massimo nell'ordine in cui compaiono: la linea
+    # conserva picchi e crolli con al più due punti per pixel, qualunque sia la lunghezza della serie
+    count = len(values)
+    if count <= buckets * 2:
+        return list(enumerate(values))
+    points = []
+    for bucket in range(buckets):
+        start = bucket * count // buckets
+        end = (bucket + 1) * count // buckets
+        chunk = values[start:end]
+        low = start + chunk.index(min(chunk))
+        high = start + chunk.index(max(chunk))
+        points.extend(((low, values[low]), (high, values[high])) if low < high else ((high, values[high]), (low, values[low])))
+    return points
+
+
+class HistoryChart:
+    # Grafico a linea su Canvas: la linea è un solo item le cui coordinate vengono aggiornate,
+    # e i ridimensionamenti vengono accorpati in un unico ridisegno
+    def __init__(self, parent, padding=40):
+        self.canvas = tk.Canvas(parent, background="white", highlightthickness=0)
+        self.padding = padding
+        self.dates = []
+        self.values = []
+        self.pending = None
+        self.line = self.canvas.create_line(0, 0, 0, 0, fill="#1f77b4", width=2)
+        self.axis = self.canvas.create_line(0, 0, 0, 0, fill="#888888")
+        self.labels = {
+            key: self.canvas.create_text(0, 0, text="", anchor=anchor, font=("Arial", 9))
+            for key, anchor in (("max", tk.W), ("min", tk.W), ("start", tk.NW), ("end", tk.NE), ("empty", tk.CENTER))
+        }
+        self.canvas.bind("<Configure>", lambda event: self.schedule_redraw())
+
+    def pack(self, **kwargs):
+        self.canvas.pack(**kwargs)
+
+    def set_series(self, dates, values):
+        self.dates = dates
+        self.values = values
+        self.schedule_redraw()
+
+    def schedule_redraw(self):
+        if self.pending is None:
+            self.pending = self.canvas.after_idle(self.redraw)
+
+    def redraw(self):
+        self.pending = None
+        canvas = self.canvas
+        width = canvas.winfo_width()
+        height = canvas.winfo_height()
+        left = self.padding * 2
+        right = width - self.padding
+        top = self.padding / 2
+        bottom = height - self.padding
+        plot_width = int(right - left)
+        if not self.values or plot_width <= 1 or bottom <= top:
+            canvas.coords(self.line, 0, 0, 0, 0)
+            canvas.coords(self.axis, 0, 0, 0, 0)
+            for key in ("max", "min", "start", "end"):
+                canvas.itemconfigure(self.labels[key], text="")
+            canvas.coords(self.labels["empty"], width / 2, height / 2)
+            canvas.itemconfigure(self.labels["empty"], text="Nessun dato disponibile")
+            return
+
+        low = min(self.values)
+        high = max(self.values)
+        span = (high - low) or 1.0
+        last = max(len(self.values) - 1, 1)
+        coords = []
+        for index, value in downsample_min_max(self.values, plot_width):
+            coords.append(left + (right - left) * index / last)
+            coords.append(bottom - (bottom - top) * (value - low) / span)
+        if len(coords) == 2:
+            coords *= 2
+        canvas.coords(self.line, *coords)
+        canvas.coords(self.axis, left, bottom, right, bottom)
+
+        canvas.itemconfigure(self.labels["empty"], text="")
+        canvas.coords(self.labels["max"], 4, top)
+        canvas.itemconfigure(self.labels["max"], text=f"{high:.2f} EUR")
+        canvas.coords(self.labels["min"], 4, bottom)
+        canvas.itemconfigure(self.labels["min"], text=f"{low:.2f} EUR")
+        canvas.coords(self.labels["start"], left, bottom + 4)
+        canvas.itemconfigure(self.labels["start"], text=self.dates[0])
+        canvas.coords(self.labels["end"], right, bottom + 4)
+        canvas.itemconfigure(self.labels["end"], text=self.dates[-1])
+
+
 # ======================= ApplicationGUI Class =======================
 
 class ApplicationGUI:
-    def __init__(self, root):
+    def __init__(self, root, data_manager=None, startup_timer=None):
         self.root = root
         self.root.title("Gestione Portafoglio Investimenti")
         self.root.geometry("1200x700")
+        self.startup_timer = startup_timer or StartupTimer()
 
-        self.data_manager = DataManager()
+        self.data_manager = data_manager or DataManager()
         self.transaction_processor = TransactionProcessor(self.data_manager)
-        self.portfolio = Portfolio(self.data_manager)
+        self.engine = PortfolioEngine(self.data_manager, self.transaction_processor)
+        self.startup_timer.mark("data_manager")
 
-        self.balances = {}
-        self.avg_prices = {}
-        self.avg_prices_usd = {}  
         self.eur_balance = 0.0
-        self.usdt_balance = 0.0
-        self.total_invested = 0.0
-        self.total_immobili_value = 0.0
-        self.total_invested_excluding_eur = 0.0  
-        self.total_current_value_eur = 0.0  
-        self.selling_prices = self.data_manager.selling_prices
+        self.selling_prices = {}
+        self.current_crypto_prices = {}
+        self.snapshot = None
 
         self.style = ttk.Style()
         self.style.theme_use("clam")  
         self.style.configure("custom.Horizontal.TProgressbar", thickness=20)
 
+        self.refresh_scheduler = RefreshScheduler(self.root, self.refresh_views)
+
+        self.loading = True
+        self.price_error = None
+        self.status_label = ttk.Label(self.root, text="Caricamento dei dati in corso...", anchor=tk.W)
+        self.status_label.pack(side=tk.BOTTOM, fill=tk.X, padx=10)
         self.create_widgets()
-        self.load_and_display_data()
+        self.startup_timer.mark("widgets")
+
+        # La finestra compare subito vuota e le schede vengono riempite una fase alla volta
+        self.root.after(STARTUP_STEP_DELAY_MS, self.run_startup_steps, [("first_frame", self.root.update_idletasks)] + self.load_steps())
+
+        # I prezzi vengono scaricati da un thread separato e pubblicati tramite coda
+        self.price_worker = PriceRefreshWorker(self.data_manager)
+        self.price_worker.start()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(PRICE_POLL_INTERVAL_MS, self.poll_price_snapshots)
+
+    def run_startup_steps(self, steps):
+        name, step = steps[0]
+        step()
+        self.startup_timer.mark(name)
+        if steps[1:]:
+            # Un giro del ciclo di eventi fra le fasi: la finestra si ridisegna e resta reattiva
+            self.root.update_idletasks()
+            self.root.after(STARTUP_STEP_DELAY_MS, self.run_startup_steps, steps[1:])
+        else:
+            self.loading = False
+            self.update_status_line()
+            self.startup_timer.report()
+
+    def on_close(self):
+        self.price_worker.stop()
+        self.root.destroy()
+
+    def refresh_prices(self):
+        # Il worker scarica subito i prezzi senza attendere il prossimo intervallo; il risultato arriva dalla coda
+        self.price_worker.request_refresh()
+
+    def poll_price_snapshots(self):
+        snapshot, error = self.price_worker.poll()
+        if snapshot is not None:
+            self.current_crypto_prices = snapshot
+            self.refresh_scheduler.mark("prices")
+        if snapshot is not None or error is not None:
+            self.price_error = error
+            self.update_status_line()
+        self.root.after(PRICE_POLL_INTERVAL_MS, self.poll_price_snapshots)
+
+    def update_status_line(self):
+        # La riga di stato mostra il caricamento iniziale o l'ultimo errore dei prezzi
+        if self.price_error:
+            self.status_label.config(text=self.price_error)
+        elif self.loading:
+            self.status_label.config(text="Caricamento dei dati in corso...")
+        else:
+            self.status_label.pack_forget()
+            return
+        if not self.status_label.winfo_manager():
+            self.status_label.pack(side=tk.BOTTOM, fill=tk.X, padx=10)
+
+    def refresh_views(self, dirty):
+        # Durante il caricamento iniziale le viste vengono comunque riempite tutte
+        if self.snapshot is None:
+            return
+        if "ledger" in dirty:
+            self.load_data()
+            self.display_transactions()
+        if dirty & {"ledger", "deposits"}:
+            self.refresh_deposits()
+
+        # La valutazione non rielabora le transazioni: si ricalcola sempre, le viste solo se toccate
+        self.snapshot = self.engine.valuation(self.current_crypto_prices)
+        if dirty & {"ledger", "deposits"}:
+            self.display_deposits()
+        if dirty & {"ledger", "prices"}:
+            self.display_crypto_balances()
+            self.display_etf_balances()
+        if dirty & {"ledger", "properties"}:
+            self.display_real_estate()
+        self.display_summary()
+        if dirty & {"ledger", "deposits", "properties"}:
+            self.reset_history()
     
     def pay_mortgage(self):
         selected_item = self.immobili_tree.selection()
@@ -307,7 +3802,7 @@ class ApplicationGUI:
         immobile_id = self.immobili_tree.item(selected_item)["values"][0]
 
         # Trova l'immobile con l'ID selezionato
-        immobile = next((imm for imm in self.data_manager.immobili_data["Immobili"] if imm["ID"] == immobile_id), None)
+        immobile = self.data_manager.find_immobile(immobile_id)
         if not immobile:
             messagebox.showerror("Errore", "Immobile non trovato.")
             return
@@ -331,24 +3826,23 @@ class ApplicationGUI:
         self.eur_balance -= importo_rata
 
         # Aggiungi una transazione FIAT di tipo "Withdraw FIAT" per l'importo della rata
-        timestamp = datetime.now().strftime("%b %d, %Y %H:%M:%S")
-        fiat_data = self.data_manager.load_fiat_transactions()
-        fiat_data['Transactions'].append({
-            "Timestamp": timestamp,
+        self.data_manager.append_fiat_transaction({
+            "ID": new_transaction_id(),
+            "Timestamp": now_timestamp(),
             "Type": "Withdraw FIAT",
-            "Filled Amount": f"{importo_rata:.2f} EUR",
+            "Filled Amount": round(importo_rata, 2),
+            "Currency": "EUR",
             "Info": "Pagamento rata mutuo"
         })
-        self.data_manager.save_fiat_transactions(fiat_data)
 
         # Incrementa il contatore dei pagamenti effettuati
         immobile["Pagamenti Effettuati"] += 1
 
-        # Salva i dati degli immobili
-        self.data_manager.save_immobili_data()
+        # Salva i dati dell'immobile
+        self.data_manager.update_immobile(immobile)
 
         messagebox.showinfo("Successo", f"Pagamento di {importo_rata:.2f} EUR effettuato con successo.")
-        self.load_and_display_data()
+        self.refresh_scheduler.mark("ledger", "properties")
 
     def add_immobile(self):
         def save_immobile():
@@ -396,15 +3890,14 @@ class ApplicationGUI:
             self.eur_balance -= anticipo_importo
 
             # Aggiungi una transazione FIAT di tipo "Withdraw FIAT" per l'importo dell'anticipo
-            timestamp = datetime.now().strftime("%b %d, %Y %H:%M:%S")
-            fiat_data = self.data_manager.load_fiat_transactions()
-            fiat_data['Transactions'].append({
-                "Timestamp": timestamp,
+            self.data_manager.append_fiat_transaction({
+                "ID": new_transaction_id(),
+                "Timestamp": now_timestamp(),
                 "Type": "Withdraw FIAT",
-                "Filled Amount": f"{anticipo_importo:.2f} EUR",
+                "Filled Amount": round(anticipo_importo, 2),
+                "Currency": "EUR",
                 "Info": "Pagamento immobile"
             })
-            self.data_manager.save_fiat_transactions(fiat_data)
 
             if mutuo:
                 numero_rate = numero_rate_entry.get()
@@ -446,12 +3939,12 @@ class ApplicationGUI:
                 "Pagamenti Effettuati": 0  # Contatore per i pagamenti effettuati
             }
 
-            self.data_manager.immobili_data["Immobili"].append(nuovo_immobile)
-            self.data_manager.save_immobili_data()
+            self.data_manager.add_immobile(nuovo_immobile)
 
             messagebox.showinfo("Successo", "Immobile aggiunto con successo.")
             immobile_window.destroy()
-            self.load_and_display_data()
+            # L'acconto è un prelievo FIAT: cambiano anche saldo EUR e lista delle transazioni
+            self.refresh_scheduler.mark("ledger", "properties")
 
 
         def toggle_anticipo():
@@ -532,8 +4025,8 @@ class ApplicationGUI:
         for deposito in deposits_to_remove:
             self.data_manager.conto_deposito["Conto deposito"].remove(deposito)
 
-        with open(self.data_manager.conto_deposito_path, 'w') as f:
-            json.dump(self.data_manager.conto_deposito, f, indent=4, default=datetime_to_string)
+        if deposits_to_remove:
+            self.data_manager.save_conto_deposito()
 
         for deposito in expired_deposits:
             self.handle_expired_deposit(deposito)
@@ -552,17 +4045,16 @@ class ApplicationGUI:
                 messagebox.showerror("Errore", "Per favore, inserisci un importo valido.")
                 return
 
-            timestamp = datetime.now().strftime("%b %d, %Y %H:%M:%S")
-            fiat_data = self.data_manager.load_fiat_transactions()
-            fiat_data['Transactions'].append({
-                "Timestamp": timestamp,
+            self.data_manager.append_fiat_transaction({
+                "ID": new_transaction_id(),
+                "Timestamp": now_timestamp(),
                 "Type": "Top Up FIAT",
-                "Filled Amount": f"{interest_amount} EUR",
+                "Filled Amount": interest_amount,
+                "Currency": "EUR",
                 "Info": "Interessi conto deposito"
             })
-            self.data_manager.save_fiat_transactions(fiat_data)
 
-            self.load_and_display_data()
+            self.refresh_scheduler.mark("ledger")
             messagebox.showinfo("Successo", "Gli interessi sono stati aggiunti al saldo disponibile.")
             interest_window.destroy()
 
@@ -584,14 +4076,19 @@ class ApplicationGUI:
         self.transactions_tab = ttk.Frame(self.notebook)
         self.balances_tab = ttk.Frame(self.notebook)
         self.summary_tab = ttk.Frame(self.notebook)
+        self.history_tab = ttk.Frame(self.notebook)
 
         self.notebook.add(self.transactions_tab, text='Transazioni')
         self.notebook.add(self.balances_tab, text='Bilanci')
         self.notebook.add(self.summary_tab, text='Sommario Portafoglio')
+        self.notebook.add(self.history_tab, text='Andamento')
 
         self.create_transactions_tab()
         self.create_balances_tab()
         self.create_summary_tab()
+        self.create_history_tab()
+        # La serie storica viene calcolata solo quando la scheda è visibile
+        self.notebook.bind("<<NotebookTabChanged>>", lambda event: self.display_history())
 
     def create_transactions_tab(self):
         self.transactions_button_frame = ttk.Frame(self.transactions_tab)
@@ -609,81 +4106,72 @@ class ApplicationGUI:
         self.paned_transactions.add(self.crypto_frame, weight=1)
 
         fiat_columns = ("Timestamp", "Type", "Filled Amount", "Info")
-        self.fiat_list = ttk.Treeview(self.fiat_frame, columns=fiat_columns, show="headings", height=15)
-        for col in fiat_columns:
-            self.fiat_list.heading(col, text=col)
-            self.fiat_list.column(col, minwidth=0, width=150)
-        fiat_vscrollbar = ttk.Scrollbar(self.fiat_frame, orient="vertical", command=self.fiat_list.yview)
-        self.fiat_list.configure(yscroll=fiat_vscrollbar.set)
-        fiat_vscrollbar.pack(side="right", fill="y")
+        # Una sola transazione selezionata alla volta fra le due liste
+        self.fiat_list = VirtualTreeview(self.fiat_frame, fiat_columns, height=15, on_select=lambda key: self.crypto_list.clear_selection())
         self.fiat_list.pack(fill=tk.BOTH, expand=True)
 
         crypto_columns = ("Timestamp", "Pair", "Side", "Price", "Order Amount", "Filled Amount", "Executed Amount", "Info")
-        self.crypto_list = ttk.Treeview(self.crypto_frame, columns=crypto_columns, show="headings", height=15)
-        for col in crypto_columns:
-            self.crypto_list.heading(col, text=col)
-            self.crypto_list.column(col, minwidth=0, width=150)
-        crypto_vscrollbar = ttk.Scrollbar(self.crypto_frame, orient="vertical", command=self.crypto_list.yview)
-        self.crypto_list.configure(yscroll=crypto_vscrollbar.set)
-        crypto_vscrollbar.pack(side="right", fill="y")
+        self.crypto_list = VirtualTreeview(self.crypto_frame, crypto_columns, height=15, on_select=lambda key: self.fiat_list.clear_selection())
         self.crypto_list.pack(fill=tk.BOTH, expand=True)
 
-    def update_crypto_tree_item(self, item_id, currency):
-        # Ottieni i dati necessari per aggiornare la riga
-        balance = self.balances.get(currency, 0.0)
-        avg_price_eur = self.avg_prices.get(currency, 'N/A')
-        avg_price_usd = self.avg_prices_usd.get(currency, 'N/A')
-        current_crypto_prices = self.data_manager.get_current_crypto_prices()
-        coin_id = self.data_manager.crypto_mapping.get(f"{currency}/USDT", None)
-        current_price_usd = current_crypto_prices.get(coin_id, {}).get('usd', 'N/A')
-        current_price_eur = current_crypto_prices.get(coin_id, {}).get('eur', 'N/A')
+    def format_value(self, value, spec):
+        return format(value, spec) if value is not None else 'N/A'
 
-        # Prezzo di Vendita (USD)
-        selling_price_usd = self.selling_prices.get(currency, '')
+    def format_gain_loss(self, percentage_gain):
+        if percentage_gain is None:
+            return 'N/A'
+        if percentage_gain >= 0:
+            return f"▲ {percentage_gain:.2f}%"
+        return f"▼ {abs(percentage_gain):.2f}%"
 
-        # Calcolo del Valore Vendita
-        if selling_price_usd and isinstance(selling_price_usd, (int, float)):
-            total_selling_value_usd = balance * selling_price_usd
-            usd_to_eur_rate = current_crypto_prices.get('tether', {}).get('eur', 0.0)
-            if usd_to_eur_rate > 0:
-                total_selling_value_eur = total_selling_value_usd * usd_to_eur_rate
-                total_selling_value = f"{total_selling_value_usd:.2f} USD / {total_selling_value_eur:.2f} EUR"
-            else:
-                total_selling_value = f"{total_selling_value_usd:.2f} USD / N/A EUR"
+    def crypto_row_values(self, position):
+        # Valore Vendita in USD e, se il cambio è disponibile, in EUR
+        if position["Selling Value USD"] is not None:
+            total_selling_value = f"{position['Selling Value USD']:.2f} USD / {self.format_value(position['Selling Value EUR'], '.2f')} EUR"
         else:
             total_selling_value = ''
 
-        # Calcolo del guadagno/perdita
-        percentage_gain = self.portfolio.calculate_percentage_gain(current_price_usd, avg_price_usd)
-        gain_loss_text = (
-            f"▲ {percentage_gain:.2f}%" if isinstance(percentage_gain, (int, float)) and percentage_gain >= 0
-            else f"▼ {abs(percentage_gain):.2f}%" if isinstance(percentage_gain, (int, float)) and percentage_gain < 0
-            else 'N/A'
+        return (
+            position["Asset"],
+            f"{position['Units']:.6f}",
+            self.format_value(position["Avg Price USD"], ".4f"),
+            self.format_value(position["Avg Price EUR"], ".4f"),
+            self.format_value(position["Price USD"], ".4f"),
+            self.format_value(position["Price EUR"], ".4f"),
+            self.format_value(position["Value EUR"], ".2f"),
+            f"{position['Selling Price USD']}" if position["Selling Price USD"] else '',
+            total_selling_value,
+            self.format_gain_loss(position["Gain %"])
         )
 
-        # Aggiorna l'item nella Treeview
-        self.crypto_tree.item(item_id, values=(
-            currency,
-            f"{balance:.6f}",
-            f"{avg_price_usd:.4f}" if avg_price_usd != 'N/A' else 'N/A',
-            f"{avg_price_eur:.4f}" if avg_price_eur != 'N/A' else 'N/A',
-            f"{current_price_usd:.4f}" if current_price_usd != 'N/A' else 'N/A',
-            f"{current_price_eur:.4f}" if current_price_eur != 'N/A' else 'N/A',
-            f"{(balance * current_price_eur):.2f}" if current_price_eur != 'N/A' else 'N/A',
-            f"{selling_price_usd}" if selling_price_usd else '',
-            total_selling_value,
-            gain_loss_text
-        ))
+    def usdt_row_values(self, position):
+        return (
+            "USDT",
+            f"{position['Units']:.6f}",
+            f"{position['Avg Price USD']:.2f}",
+            self.format_value(position["Avg Price EUR"], ".4f"),
+            f"{position['Price USD']:.2f}",
+            self.format_value(position["Price EUR"], ".4f"),
+            self.format_value(position["Value EUR"], ".2f"),
+            f"{''}",
+            f"{''}",
+            self.format_gain_loss(position["Gain %"])
+        )
+
+    def display_crypto_balances(self):
+        crypto_rows = [(position["Asset"], self.crypto_row_values(position)) for position in self.snapshot["Crypto"]]
+        if self.snapshot["USDT"] is not None:
+            crypto_rows.append(("USDT", self.usdt_row_values(self.snapshot["USDT"])))
+        self.crypto_tree_sync.sync(crypto_rows)
 
-    def edit_selling_price(self, currency, item_id):
+    def edit_selling_price(self, currency):
         def save_price():
             try:
                 new_price = float(price_entry.get())
                 self.selling_prices[currency] = new_price
-                self.update_crypto_tree_item(item_id, currency)
                 self.data_manager.save_selling_prices(self.selling_prices)
                 edit_window.destroy()
-                self.display_summary()
+                self.refresh_scheduler.mark("prices")
             except ValueError:
                 messagebox.showerror("Errore", "Inserisci un valore numerico valido.")
 
@@ -705,13 +4193,9 @@ class ApplicationGUI:
         column_index = int(column.replace('#', '')) - 1  # Indice della colonna
 
         # Verifica se la colonna è 'Prezzo di Vendita (USD)'
-        if self.crypto_tree['columns'][column_index] == "Prezzo di Vendita (USD)":
-            # Ottieni i dati dell'item selezionato
-            item = self.crypto_tree.item(item_id)
-            currency = item['values'][0]  # La valuta è nella prima colonna
-
-            # Apri una finestra di dialogo per inserire il nuovo prezzo di vendita
-            self.edit_selling_price(currency, item_id)
+        if self.crypto_tree['columns'][column_index] == "Prezzo di Vendita (USD)" and item_id:
+            # L'iid delle righe crypto è la valuta stessa
+            self.edit_selling_price(item_id)
 
     def create_balances_tab(self):
         self.paned_balances = ttk.Panedwindow(self.balances_tab, orient=tk.VERTICAL)
@@ -759,6 +4243,12 @@ class ApplicationGUI:
             self.crypto_tree.column(col, minwidth=0, width=120)
         self.crypto_tree.pack(fill=tk.BOTH, expand=True)
 
+        buttons_frame_crypto = ttk.Frame(self.crypto_tab)
+        buttons_frame_crypto.pack(fill=tk.X, pady=5)
+
+        refresh_prices_button = ttk.Button(buttons_frame_crypto, text="Aggiorna Prezzi", command=self.refresh_prices)
+        refresh_prices_button.pack(side=tk.LEFT, padx=10, pady=5)
+
 
         etf_columns = ("ETF", "Unità", "Prezzo Medio EUR", "Prezzo Attuale EUR", "Valore Totale EUR", "Guadagno/Perdita %")
         self.etf_tree = ttk.Treeview(self.etf_tab, columns=etf_columns, show="headings")
@@ -780,6 +4270,11 @@ class ApplicationGUI:
             self.immobili_tree.column(col, minwidth=0, width=120)
         self.immobili_tree.pack(fill=tk.BOTH, expand=True)
 
+        self.deposito_tree_sync = TreeviewSync(self.deposito_tree)
+        self.crypto_tree_sync = TreeviewSync(self.crypto_tree)
+        self.etf_tree_sync = TreeviewSync(self.etf_tree)
+        self.immobili_tree_sync = TreeviewSync(self.immobili_tree)
+
         # Frame per i pulsanti
         buttons_frame_immobili = ttk.Frame(self.immobili_tab)
         buttons_frame_immobili.pack(fill=tk.X, pady=5)
@@ -791,6 +4286,41 @@ class ApplicationGUI:
         self.pay_mortgage_button.pack(side=tk.LEFT, padx=10, pady=5)
 
         
+    def create_history_tab(self):
+        self.history_series = None
+        self.history_keys = {
+            "Patrimonio netto": "Net Worth",
+            "Liquidità": "Liquidity",
+            "Conti deposito": "Deposits",
+            "Immobili": "Real Estate",
+            "Criptovalute": "Crypto",
+            "ETF": "ETF"
+        }
+
+        history_controls = ttk.Frame(self.history_tab, padding=(10, 10))
+        history_controls.pack(fill=tk.X)
+        ttk.Label(history_controls, text="Serie:", font=("Arial", 10, "bold")).pack(side=tk.LEFT, padx=5)
+        self.history_key_dropdown = ttk.Combobox(history_controls, values=list(self.history_keys), state="readonly")
+        self.history_key_dropdown.current(0)
+        self.history_key_dropdown.pack(side=tk.LEFT, padx=5)
+        self.history_key_dropdown.bind("<<ComboboxSelected>>", lambda event: self.display_history_chart())
+
+        self.history_chart = HistoryChart(self.history_tab)
+        self.history_chart.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+    def display_history(self):
+        if self.notebook.select() != str(self.history_tab) or self.snapshot is None:
+            return
+        if self.history_series is None:
+            self.history_series = self.engine.history()
+        self.display_history_chart()
+
+    def display_history_chart(self):
+        if self.history_series is None:
+            return
+        key = self.history_keys[self.history_key_dropdown.get()]
+        self.history_chart.set_series([point["Date"] for point in self.history_series], [point[key] for point in self.history_series])
+
     def create_summary_tab(self):
         self.summary_frame = ttk.Frame(self.summary_tab, padding=(10, 10))
         self.summary_frame.pack(fill=tk.BOTH, expand=True)
@@ -798,6 +4328,13 @@ class ApplicationGUI:
         self.recap_frame = ttk.Labelframe(self.summary_frame, text="Riepilogo Portafoglio", padding=(10, 10))
         self.recap_frame.pack(fill=tk.X, padx=10, pady=10)
 
+        summary_buttons = ttk.Frame(self.summary_frame)
+        summary_buttons.pack(fill=tk.X, padx=10)
+        rebalance_button = ttk.Button(summary_buttons, text="Piano di Ribilanciamento", command=self.show_rebalance_plan)
+        rebalance_button.pack(side=tk.LEFT)
+        projection_button = ttk.Button(summary_buttons, text="Proiezione Monte Carlo", command=self.show_projection)
+        projection_button.pack(side=tk.LEFT, padx=10)
+
         self.percentuali_frame = ttk.Labelframe(self.summary_frame, text="Percentuali Portafoglio", padding=(10, 10))
         self.percentuali_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
 
@@ -829,6 +4366,7 @@ class ApplicationGUI:
         )
 
         self.percentuali_canvas.create_window((0, 0), window=self.percentuali_content, anchor="nw")
+        self.allocation_view = AllocationView(self.percentuali_content)
         self.percentuali_canvas.configure(yscrollcommand=self.percentuali_scrollbar.set)
 
         self.percentuali_canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
@@ -847,59 +4385,81 @@ class ApplicationGUI:
         delete_transaction_button = ttk.Button(frame, text="Elimina Transazione", command=self.delete_transaction, style="Accent.TButton")
         delete_transaction_button.pack(side=tk.LEFT, padx=5, pady=5)
 
+        import_csv_button = ttk.Button(frame, text="Importa CSV", command=self.import_crypto_csv, style="Accent.TButton")
+        import_csv_button.pack(side=tk.LEFT, padx=5, pady=5)
+
     # ======================= Data Loading and Display =======================
 
-    def load_and_display_data(self):
-        crypto_transactions = self.data_manager.load_crypto_transactions()
-        crypto_transactions.sort(key=lambda tx: dateparser.parse(tx["Timestamp"], languages=['it', 'en']))
-        self.eur_balance, self.total_invested, fiat_transactions = self.transaction_processor.load_fiat_balance()
-        fiat_transactions.sort(key=lambda tx: dateparser.parse(tx["Timestamp"], languages=['it', 'en']))
-        self.selling_prices = self.data_manager.selling_prices
-        deposito_totale = sum([float(deposito["Filled Amount"].replace(" EUR", "")) for deposito in self.data_manager.conto_deposito["Conto deposito"]])
-        self.eur_balance -= deposito_totale  
+    def load_steps(self):
+        return [
+            ("ledger", self.load_data),
+            ("transactions", self.display_transactions),
+            ("deposits", self.refresh_deposits),
+            ("balances", self.display_balances),
+            ("summary", self.display_summary),
+            ("history", self.reset_history)
+        ]
 
-        self.display_crypto_transactions(crypto_transactions)
-        self.display_fiat_transactions(fiat_transactions)
+    def load_data(self):
+        # Solo stato locale (checkpoint del ledger, ultimi prezzi salvati): nessuna richiesta di rete
+        self.engine.load()
+        self.eur_balance = self.engine.eur_balance
+        self.selling_prices = self.data_manager.selling_prices
+        self.current_crypto_prices = self.data_manager.get_cached_crypto_prices()
 
-        self.balances, self.avg_prices, self.avg_prices_usd, self.eur_balance, self.usdt_balance = self.transaction_processor.process_crypto_transactions(crypto_transactions, self.eur_balance)
+    def refresh_deposits(self):
         self.check_deposit_expirations()
-        self.display_balances()
-        self.display_summary()  
+        self.engine.reload_deposits()
+        self.eur_balance = self.engine.eur_balance
+
+    def display_transactions(self):
+        self.display_crypto_transactions(self.engine.crypto_transactions)
+        self.display_fiat_transactions(self.engine.fiat_transactions)
+
+    def reset_history(self):
+        self.history_series = None
+        self.display_history()
 
     def display_crypto_transactions(self, transactions):
-        self.crypto_list.delete(*self.crypto_list.get_children())
-        for tx in transactions:
-            self.crypto_list.insert("", "end", values=(tx["Timestamp"], tx["Pair"], tx["Side"], tx["Price"], tx["Order Amount"], tx["Filled Amount"], tx["Executed Amount"], tx.get("Info", "Transazione")))
+        self.crypto_list.set_rows([(tx["ID"], (
+            format_timestamp(tx["Timestamp"]),
+            tx["Pair"],
+            tx["Side"],
+            f"{format_number(tx['Price'])} {tx['Quote']}",
+            f"{format_number(tx['Order Amount'])} {tx['Base']}",
+            f"{format_number(tx['Filled Amount'])} {tx['Base']}",
+            f"{format_number(tx['Executed Amount'])} {tx['Quote']}",
+            tx.get("Info", "Transazione")
+        )) for tx in transactions])
 
     def display_fiat_transactions(self, transactions):
-        self.fiat_list.delete(*self.fiat_list.get_children())
-        for tx in transactions:
-            self.fiat_list.insert("", "end", values=(tx["Timestamp"], tx["Type"], tx["Filled Amount"], tx.get("Info", "N/D")))
+        self.fiat_list.set_rows([(tx["ID"], (format_timestamp(tx["Timestamp"]), tx["Type"], f"{format_number(tx['Filled Amount'])} {tx.get('Currency', 'EUR')}", tx.get("Info", "N/D"))) for tx in transactions])
 
     # ======================= Transaction Management =======================
 
     def add_fiat_transaction(self):
         def save_fiat_transaction():
-            timestamp = datetime.now().strftime("%b %d, %Y %H:%M:%S")
             tx_type = type_dropdown.get()
             filled_amount = filled_amount_entry.get()
             info = info_dropdown.get()  # Raccoglie l'informazione dall'input dell'utente
 
-            if not filled_amount:
+            try:
+                filled_amount = float(filled_amount.replace(",", "."))
+            except ValueError:
                 messagebox.showerror("Errore", "Inserisci un importo valido.")
                 return
 
-            fiat_data = self.data_manager.load_fiat_transactions()
-            fiat_data['Transactions'].append({
-                "Timestamp": timestamp,
+            self.data_manager.append_fiat_transaction({
+                "ID": new_transaction_id(),
+                "Timestamp": now_timestamp(),
                 "Type": tx_type,
-                "Filled Amount": f"{filled_amount} EUR",
+                "Filled Amount": filled_amount,
+                "Currency": "EUR",
                 "Info": info 
             })
-            self.data_manager.save_fiat_transactions(fiat_data)
 
             fiat_window.destroy()
-            self.load_and_display_data()
+            self.refresh_scheduler.mark("ledger")
             messagebox.showinfo("Successo", "Transazione FIAT aggiunta con successo.")
 
         fiat_window = tk.Toplevel(self.root)
@@ -928,7 +4488,6 @@ class ApplicationGUI:
                 messagebox.showerror("Errore", "La coppia deve essere nel formato BASE/QUOTE, ad es. BTC/USDT.")
                 return
 
-            timestamp = datetime.now().strftime("%b %d, %Y %H:%M:%S")
             side = side_dropdown.get()
             price = price_entry.get()
             order_amount = order_amount_entry.get()
@@ -942,22 +4501,33 @@ class ApplicationGUI:
                 messagebox.showerror("Errore", "Per favore, compila tutti i campi richiesti.")
                 return
 
-            transactions = self.data_manager.load_crypto_transactions()
-            transactions.append({
-                "Timestamp": timestamp,
+            try:
+                price, order_amount, filled_amount, executed_amount, trade_fee = [
+                    float(value.replace(",", ".")) for value in (price, order_amount, filled_amount, executed_amount, trade_fee)
+                ]
+            except ValueError:
+                messagebox.showerror("Errore", "Per favore, inserisci valori numerici validi.")
+                return
+
+            base_currency, quote_currency = pair.split('/')
+            self.data_manager.append_crypto_transaction({
+                "ID": new_transaction_id(),
+                "Timestamp": now_timestamp(),
                 "Pair": pair,
+                "Base": base_currency,
+                "Quote": quote_currency,
                 "Side": side,
-                "Price": f"{price} {pair.split('/')[1]}",
-                "Order Amount": f"{order_amount} {pair.split('/')[0]}",
-                "Filled Amount": f"{filled_amount} {pair.split('/')[0]}",
-                "Executed Amount": f"{executed_amount} {pair.split('/')[1]}",
-                "Trade Fee": f"{trade_fee} {pair.split('/')[0]}",
+                "Price": price,
+                "Order Amount": order_amount,
+                "Filled Amount": filled_amount,
+                "Executed Amount": executed_amount,
+                "Trade Fee": trade_fee,
+                "Fee Currency": base_currency,
                 "Info": info
             })
-            self.data_manager.save_crypto_transactions(transactions)
 
             crypto_window.destroy()
-            self.load_and_display_data()
+            self.refresh_scheduler.mark("ledger")
             messagebox.showinfo("Successo", "Transazione Crypto/ETF aggiunta con successo.")
 
         crypto_window = tk.Toplevel(self.root)
@@ -989,38 +4559,45 @@ class ApplicationGUI:
         save_button.pack(pady=20)
 
     def delete_transaction(self):
-        selected_fiat = self.fiat_list.selection()
-        selected_crypto = self.crypto_list.selection()
+        # La chiave delle righe virtualizzate è l'ID stabile della transazione
+        selected_fiat = self.fiat_list.selected_key
+        selected_crypto = self.crypto_list.selected_key
 
         if selected_fiat:
-            selected_item = self.fiat_list.item(selected_fiat)
-            timestamp = selected_item['values'][0]
-
-            fiat_data = self.data_manager.load_fiat_transactions()
-            transactions = fiat_data['Transactions']
-            index_to_delete = next((i for i, tx in enumerate(transactions) if tx['Timestamp'] == timestamp), None)
-                
-            if index_to_delete is not None:
-                del transactions[index_to_delete]
-                self.data_manager.save_fiat_transactions(fiat_data)
-                messagebox.showinfo("Successo", "Transazione FIAT eliminata con successo.")
-
+            deleted = self.data_manager.delete_fiat_transaction(selected_fiat)
+            message = "Transazione FIAT eliminata con successo."
         elif selected_crypto:
-            selected_item = self.crypto_list.item(selected_crypto)
-            timestamp = selected_item['values'][0]
-
-            transactions = self.data_manager.load_crypto_transactions()
-            index_to_delete = next((i for i, tx in enumerate(transactions) if tx['Timestamp'] == timestamp), None)
-                
-            if index_to_delete is not None:
-                del transactions[index_to_delete]
-                self.data_manager.save_crypto_transactions(transactions)
-                messagebox.showinfo("Successo", "Transazione Crypto/ETF eliminata con successo.")
-
+            deleted = self.data_manager.delete_crypto_transaction(selected_crypto)
+            message = "Transazione Crypto/ETF eliminata con successo."
         else:
             messagebox.showwarning("Errore", "Seleziona una transazione da eliminare.")
+            return
+
+        if not deleted:
+            messagebox.showwarning("Errore", "La transazione selezionata non esiste più.")
+            return
+        self.refresh_scheduler.mark("ledger")
+        messagebox.showinfo("Successo", message)
+
+    def import_crypto_csv(self):
+        path = filedialog.askopenfilename(title="Importa transazioni da CSV", filetypes=[("File CSV", "*.csv"), ("Tutti i file", "*.*")])
+        if not path:
+            return
+
+        importer = CsvTransactionImporter(self.data_manager, self.data_manager.load_csv_import_mapping())
+        try:
+            result = importer.import_file(path)
+        except (OSError, UnicodeDecodeError, csv.Error) as e:
+            messagebox.showerror("Errore", f"Impossibile leggere il file CSV: {e}")
+            return
 
-        self.load_and_display_data()
+        self.refresh_scheduler.mark("ledger")
+        message = f"Transazioni importate: {result['Imported']}\nDuplicati ignorati: {result['Duplicates']}"
+        if result["Errors"]:
+            details = "\n".join(f"Riga {line}: {error}" for line, error in result["Errors"][:10])
+            messagebox.showwarning("Importazione completata con errori", f"{message}\nRighe non valide: {len(result['Errors'])}\n\n{details}")
+        else:
+            messagebox.showinfo("Successo", message)
 
     def add_conto_deposito(self):
         deposito_window = tk.Toplevel(self.root)
@@ -1043,7 +4620,7 @@ class ApplicationGUI:
         save_button.pack(pady=10)
 
     def save_conto_deposito(self, deposito_type, filled_amount, scadenza):
-        timestamp = datetime.now().strftime("%b %d, %Y %H:%M:%S")
+        timestamp = datetime.now().strftime(TIMESTAMP_FORMAT)
         
         try:
             filled_amount_value = float(filled_amount.replace(",", "."))
@@ -1053,7 +4630,7 @@ class ApplicationGUI:
             messagebox.showerror("Errore", "Per favore, inserisci un importo valido e positivo.")
             return
         
-        scadenza_parsed = dateparser.parse(scadenza, languages=['it', 'en'])
+        scadenza_parsed = parse_date_text(scadenza)
         if scadenza_parsed is None:
             messagebox.showerror("Errore", "Formato data di scadenza non valido. Per favore, inserisci una data valida.")
             return
@@ -1069,11 +4646,9 @@ class ApplicationGUI:
         }
 
         self.data_manager.conto_deposito["Conto deposito"].append(new_deposito)
+        self.data_manager.save_conto_deposito()
 
-        with open(self.data_manager.conto_deposito_path, 'w') as f:
-            json.dump(self.data_manager.conto_deposito, f, indent=4, default=datetime_to_string)
-
-        self.load_and_display_data()
+        self.refresh_scheduler.mark("deposits")
         messagebox.showinfo("Successo", "Conto Deposito aggiunto con successo.")
 
     def update_etf_price(self):
@@ -1088,7 +4663,7 @@ class ApplicationGUI:
             if etf_name in self.data_manager.manual_etf_prices:
                 self.data_manager.update_etf_price(etf_name, current_price)
                 etf_window.destroy()
-                self.load_and_display_data()
+                self.refresh_scheduler.mark("prices")
                 messagebox.showinfo("Successo", f"Prezzo ETF '{etf_name}' aggiornato a {current_price:.2f} EUR")
             else:
                 messagebox.showerror("Errore", f"L'ETF '{etf_name}' non è stato trovato.")
@@ -1109,329 +4684,315 @@ class ApplicationGUI:
         save_button = ttk.Button(etf_window, text="Salva", command=save_etf_price)
         save_button.pack(pady=10)
 
-    # ======================= Display Balances and Summary =======================
-
-    def display_balances(self):
-        self.total_invested_excluding_eur = 0.0
-        self.total_current_value_eur = 0.0
-        self.total_immobili_value = 0.0
-
-        for tree in [self.deposito_tree, self.crypto_tree, self.etf_tree, self.immobili_tree]:
-            tree.delete(*tree.get_children())
-
-        current_crypto_prices = self.data_manager.get_current_crypto_prices()
-
-        deposito_totale = 0
-        for deposito in self.data_manager.conto_deposito["Conto deposito"]:
-            timestamp = deposito["Timestamp"]
-            deposito_type = deposito["Type"]
-            amount_str = deposito["Filled Amount"].replace(" EUR", "")
-            amount = float(amount_str)
-            scadenza = deposito["Scadenza"]
-            deposito_totale += amount
-
-            self.deposito_tree.insert("", "end", values=(timestamp, deposito_type, f"{amount:.2f} EUR", scadenza))
-
-        for currency, balance in self.balances.items():
-            avg_price_eur = self.avg_prices.get(currency, 'N/A')
-            avg_price_usd = self.avg_prices_usd.get(currency, 'N/A')
-
-            # Prezzo di Vendita (USD)
-            selling_price_usd = self.selling_prices.get(currency, '')
-
-            # Calcolo del Valore Vendita
-            if selling_price_usd and isinstance(selling_price_usd, (int, float)):
-                total_selling_value_usd = balance * selling_price_usd
-                # Converti il valore di vendita in EUR usando il tasso di cambio corrente USD/EUR
-                usd_to_eur_rate = current_crypto_prices.get('tether', {}).get('eur', 0.0)
-                if usd_to_eur_rate > 0:
-                    total_selling_value_eur = total_selling_value_usd * usd_to_eur_rate
-                    total_selling_value = f"{total_selling_value_usd:.2f} USD / {total_selling_value_eur:.2f} EUR"
-                else:
-                    total_selling_value = f"{total_selling_value_usd:.2f} USD / N/A EUR"
-            else:
-                total_selling_value = ''
-
-            if currency != 'USDT' and not currency.startswith('ETF_'):
-                coin_id = self.data_manager.crypto_mapping.get(f"{currency}/USDT", None)
-                current_price_usd = current_crypto_prices.get(coin_id, {}).get('usd', 'N/A')
-                current_price_eur = current_crypto_prices.get(coin_id, {}).get('eur', 'N/A')
-
-                # Convert current_price_eur to float if it's a valid number
-                current_price_eur = float(current_price_eur) if isinstance(current_price_eur, (int, float, str)) and current_price_eur != 'N/A' else 'N/A'
-
-                if current_price_eur != 'N/A':
-                    total_value_eur = balance * current_price_eur
-                    self.total_current_value_eur += total_value_eur
-                else:
-                    total_value_eur = 'N/A'
+    def show_rebalance_plan(self):
+        def compute_plan():
+            try:
+                tolerance = float(tolerance_entry.get().replace(",", "."))
+                min_trade = float(min_trade_entry.get().replace(",", "."))
+            except ValueError:
+                messagebox.showerror("Errore", "Inserisci valori numerici validi per tolleranza e ordine minimo.")
+                return
 
-                if avg_price_eur != 'N/A':
-                    invested_eur = balance * avg_price_eur
-                    self.total_invested_excluding_eur += invested_eur
-                else:
-                    invested_eur = 'N/A'
-
-                percentage_gain = self.portfolio.calculate_percentage_gain(current_price_usd, avg_price_usd)
-                gain_loss_text = (
-                    f"▲ {percentage_gain:.2f}%" if isinstance(percentage_gain, (int, float)) and percentage_gain >= 0
-                    else f"▼ {abs(percentage_gain):.2f}%" if isinstance(percentage_gain, (int, float)) and percentage_gain < 0
-                    else 'N/A'
-                )
-
-                self.crypto_tree.insert("", "end", values=(
-                    currency,
-                    f"{balance:.6f}",
-                    f"{avg_price_usd:.4f}" if avg_price_usd != 'N/A' else 'N/A',
-                    f"{avg_price_eur:.4f}" if avg_price_eur != 'N/A' else 'N/A',
-                    f"{current_price_usd:.4f}" if current_price_usd != 'N/A' else 'N/A',
-                    f"{current_price_eur:.4f}" if current_price_eur != 'N/A' else 'N/A',
-                    f"{total_value_eur:.2f}" if total_value_eur != 'N/A' else 'N/A',
-                    f"{selling_price_usd}" if selling_price_usd else '',
-                    total_selling_value,
-                    gain_loss_text
-                    
+            plan = self.engine.rebalance(self.current_crypto_prices, tolerance, min_trade)
+            orders_tree.delete(*orders_tree.get_children())
+            for order in plan["Orders"]:
+                orders_tree.insert("", tk.END, values=(
+                    order["Category"],
+                    order["Asset"],
+                    "Acquista" if order["Side"] == "Buy" else "Vendi",
+                    f"{abs(order['Amount EUR']):,.2f} EUR",
+                    self.format_value(order["Units"], ".6f"),
+                    f"{order['Fee EUR']:,.2f} EUR"
                 ))
 
-            elif currency == 'USDT':
-                avg_price_usd = 1.0  
-                avg_price_eur = self.avg_prices.get('USDT', 'N/A')
-                current_price_usd = 1.0  
-                current_price_eur = current_crypto_prices.get('tether', {}).get('eur', 'N/A')
+            totals = plan["Totals"]
+            summary = f"Acquisti: {totals['Buy EUR']:,.2f} EUR - Vendite: {totals['Sell EUR']:,.2f} EUR - Commissioni stimate: {totals['Fees EUR']:,.2f} EUR - Liquidità dopo: {totals['Cash After EUR']:,.2f} EUR"
+            if totals["Buy Scale"] < 1:
+                summary += " (acquisti ridotti per liquidità insufficiente)"
+            if not plan["Orders"]:
+                summary = "Tutte le categorie sono dentro la banda di tolleranza."
+            if plan["Skipped"]:
+                summary += "\nEsclusi dal piano: " + ", ".join(f"{skipped['Asset']} ({skipped['Reason'].lower()})" for skipped in plan["Skipped"])
+            summary_label.config(text=summary)
+
+        rebalance_window = tk.Toplevel(self.root)
+        rebalance_window.title("Piano di Ribilanciamento")
+        rebalance_window.geometry("900x450")
+
+        controls = ttk.Frame(rebalance_window, padding=(10, 10))
+        controls.pack(fill=tk.X)
+        ttk.Label(controls, text="Tolleranza (punti %):", font=("Arial", 10, "bold")).pack(side=tk.LEFT, padx=5)
+        tolerance_entry = ttk.Entry(controls, width=8)
+        tolerance_entry.insert(0, str(REBALANCE_TOLERANCE))
+        tolerance_entry.pack(side=tk.LEFT, padx=5)
+        ttk.Label(controls, text="Ordine minimo (EUR):", font=("Arial", 10, "bold")).pack(side=tk.LEFT, padx=5)
+        min_trade_entry = ttk.Entry(controls, width=8)
+        min_trade_entry.insert(0, str(REBALANCE_MIN_TRADE_EUR))
+        min_trade_entry.pack(side=tk.LEFT, padx=5)
+        ttk.Button(controls, text="Calcola", command=compute_plan).pack(side=tk.LEFT, padx=10)
+
+        order_columns = ("Categoria", "Asset", "Operazione", "Importo", "Unità", "Commissione")
+        orders_tree = ttk.Treeview(rebalance_window, columns=order_columns, show="headings")
+        for col in order_columns:
+            orders_tree.heading(col, text=col)
+            orders_tree.column(col, minwidth=0, width=140)
+        orders_tree.pack(fill=tk.BOTH, expand=True, padx=10)
+
+        summary_label = ttk.Label(rebalance_window, text="", font=("Arial", 10))
+        summary_label.pack(fill=tk.X, padx=10, pady=10)
+        compute_plan()
+
+    def show_projection(self):
+        def compute_projection():
+            try:
+                years = int(years_entry.get())
+                paths = int(paths_entry.get())
+                if years <= 0 or paths <= 0:
+                    raise ValueError
+            except ValueError:
+                messagebox.showerror("Errore", "Inserisci un numero di anni e di percorsi validi.")
+                return
 
-                # Convert to float if current_price_eur is a valid number
-                current_price_eur = float(current_price_eur) if isinstance(current_price_eur, (int, float, str)) and current_price_eur != 'N/A' else 'N/A'
-                self.usdt_balance = float(self.usdt_balance) if isinstance(self.usdt_balance, str) else self.usdt_balance
+            # La simulazione gira in un thread separato; il risultato torna sulla coda e lo legge il ciclo di Tk
+            snapshot = self.engine.valuation(self.current_crypto_prices)
+            results = queue.Queue()
 
-                if current_price_eur != 'N/A':
-                    total_value_eur = self.usdt_balance * current_price_eur
-                else:
-                    total_value_eur = 'N/A'
-
-                usdt_gain_percent = self.portfolio.calculate_percentage_gain(current_price_eur, avg_price_eur)
-                gain_loss_text = (
-                    f"▲ {usdt_gain_percent:.2f}%" if isinstance(usdt_gain_percent, (int, float)) and usdt_gain_percent >= 0
-                    else f"▼ {abs(usdt_gain_percent):.2f}%" if isinstance(usdt_gain_percent, (int, float)) and usdt_gain_percent < 0
-                    else 'N/A'
-                )
-
-                self.crypto_tree.insert("", "end", values=(
-                    "USDT",
-                    f"{self.usdt_balance:.6f}",
-                    f"{avg_price_usd:.2f}",
-                    f"{avg_price_eur:.4f}" if avg_price_eur != 'N/A' else 'N/A',
-                    f"{current_price_usd:.2f}",
-                    f"{current_price_eur:.4f}" if current_price_eur != 'N/A' else 'N/A',
-                    f"{total_value_eur:.2f}" if current_price_eur != 'N/A' else 'N/A',
-                    f"{''}",
-                    f"{''}",
-                    gain_loss_text
-                ))
-
-            elif currency == 'USDT':
-                avg_price_usd = 1.0  
-                avg_price_eur = self.avg_prices.get('USDT', 'N/A')
-                current_price_usd = 1.0  
-                current_price_eur = current_crypto_prices.get('tether', {}).get('eur', 'N/A')
-                total_value_eur = self.usdt_balance * current_price_eur
+            def run():
+                try:
+                    results.put(("projection", self.engine.projection(years=years, paths=paths, snapshot=snapshot)))
+                except Exception as e:
+                    results.put(("error", str(e)))
+
+            calculate_button.config(state=tk.DISABLED)
+            summary_label.config(text="Simulazione in corso...")
+            threading.Thread(target=run, name="projection", daemon=True).start()
+            self.root.after(MONTE_CARLO_POLL_INTERVAL_MS, poll_projection, results)
+
+        def poll_projection(results):
+            # La finestra può essere stata chiusa durante il calcolo
+            if not projection_window.winfo_exists():
+                return
+            try:
+                kind, projection = results.get_nowait()
+            except queue.Empty:
+                self.root.after(MONTE_CARLO_POLL_INTERVAL_MS, poll_projection, results)
+                return
 
-                usdt_gain_percent = self.portfolio.calculate_percentage_gain(current_price_eur, avg_price_eur)
+            calculate_button.config(state=tk.NORMAL)
+            if kind == "error":
+                summary_label.config(text="")
+                messagebox.showerror("Errore", projection, parent=projection_window)
+                return
 
-                if isinstance(usdt_gain_percent, (int, float)):
-                    if usdt_gain_percent >= 0:
-                        gain_loss_text = f"▲ {usdt_gain_percent:.2f}%"
-                    else:
-                        gain_loss_text = f"▼ {abs(usdt_gain_percent):.2f}%"
-                else:
-                    gain_loss_text = 'N/A'
-
-                self.crypto_tree.insert("", "end", values=(
-                    "USDT",
-                    f"{self.usdt_balance:.6f}",
-                    f"{avg_price_usd:.2f}",
-                    f"{avg_price_eur:.4f}" if avg_price_eur != 'N/A' else 'N/A',
-                    f"{current_price_usd:.2f}",
-                    f"{current_price_eur:.4f}" if current_price_eur != 'N/A' else 'N/A',
-                    f"{total_value_eur:.2f}" if current_price_eur != 'N/A' else 'N/A',
-                    gain_loss_text
-                ))
+            # Una riga per anno: la serie completa ha un punto al mese
+            projection_tree.delete(*projection_tree.get_children())
+            for point in projection["Series"][::12]:
+                projection_tree.insert("", tk.END, values=[point["Date"]] + [f"{point[f'P{percentile}']:,.2f} EUR" for percentile in MONTE_CARLO_PERCENTILES])
+            modelled = sum(1 for asset in projection["Assets"] if asset["Modelled"])
+            summary_label.config(text=f"Asset simulati dallo storico dei prezzi: {modelled} su {len(projection['Assets'])}; gli altri restano al valore attuale.")
+
+        projection_window = tk.Toplevel(self.root)
+        projection_window.title("Proiezione Monte Carlo")
+        projection_window.geometry("900x450")
+
+        controls = ttk.Frame(projection_window, padding=(10, 10))
+        controls.pack(fill=tk.X)
+        ttk.Label(controls, text="Anni:", font=("Arial", 10, "bold")).pack(side=tk.LEFT, padx=5)
+        years_entry = ttk.Entry(controls, width=8)
+        years_entry.insert(0, str(MONTE_CARLO_YEARS))
+        years_entry.pack(side=tk.LEFT, padx=5)
+        ttk.Label(controls, text="Percorsi:", font=("Arial", 10, "bold")).pack(side=tk.LEFT, padx=5)
+        paths_entry = ttk.Entry(controls, width=10)
+        paths_entry.insert(0, str(MONTE_CARLO_PATHS))
+        paths_entry.pack(side=tk.LEFT, padx=5)
+        calculate_button = ttk.Button(controls, text="Calcola", command=compute_projection)
+        calculate_button.pack(side=tk.LEFT, padx=10)
+
+        projection_columns = ("Data",) + tuple(f"{percentile}° percentile" for percentile in MONTE_CARLO_PERCENTILES)
+        projection_tree = ttk.Treeview(projection_window, columns=projection_columns, show="headings")
+        for col in projection_columns:
+            projection_tree.heading(col, text=col)
+            projection_tree.column(col, minwidth=0, width=140)
+        projection_tree.pack(fill=tk.BOTH, expand=True, padx=10)
+
+        summary_label = ttk.Label(projection_window, text="", font=("Arial", 10))
+        summary_label.pack(fill=tk.X, padx=10, pady=10)
+        compute_projection()
 
-        for immobile in self.data_manager.immobili_data["Immobili"]:
-            immobile_id = immobile["ID"]
-            tipo = immobile["Tipo"]
-            valore = immobile["Valore"]
-            mutuo = "Sì" if immobile["Mutuo"] else "No"
-            anticipo = immobile["Anticipo"]
-            valore_mutuo = immobile["Valore Mutuo"]
+    # ======================= Display Balances and Summary =======================
 
-            if immobile["Mutuo"]:
-                numero_rate = immobile["Numero Rate"]
-                importo_rata = immobile["Importo Rata"]
-                rate_pagate = immobile["Pagamenti Effettuati"]
-                investimento_totale = anticipo + (importo_rata * rate_pagate)
-            else:
-                numero_rate = "-"
-                importo_rata = "-"
-                rate_pagate = "-"
-                investimento_totale = anticipo
-
-            self.total_immobili_value += investimento_totale
-
-            self.immobili_tree.insert("", "end", values=(
-                immobile_id,
-                tipo,
-                f"{valore:,.2f} EUR",
-                mutuo,
-                f"{anticipo:,.2f} EUR",
-                f"{valore_mutuo:,.2f} EUR",
-                numero_rate,
-                f"{importo_rata:,.2f} EUR" if importo_rata != "-" else "-",
-                rate_pagate,
-                f"{investimento_totale:,.2f} EUR"
-            ))
-            
-        for currency, balance in self.balances.items():
-            if currency.startswith('ETF_'):
-                avg_price = self.avg_prices.get(currency, 'N/A')
-                etf_name = currency[4:]
-                etf_current_value = self.data_manager.manual_etf_prices.get(etf_name, self.data_manager.etf_mapping.get(etf_name, 'N/A'))
-
-                if isinstance(etf_current_value, (int, float)):
-                    total_value_eur = balance * etf_current_value
-                    self.total_current_value_eur += total_value_eur
-
-                    if avg_price != 'N/A':
-                        invested_eur = balance * avg_price
-                        self.total_invested_excluding_eur += invested_eur
-                    else:
-                        invested_eur = 'N/A'
-
-                    gain_loss = self.portfolio.calculate_percentage_gain(etf_current_value, avg_price)
-                    if isinstance(gain_loss, (int, float)):
-                        if gain_loss >= 0:
-                            gain_loss_text = f"▲ {gain_loss:.2f}%"
-                        else:
-                            gain_loss_text = f"▼ {abs(gain_loss):.2f}%"
-                    else:
-                        gain_loss_text = 'N/A'
-                else:
-                    total_value_eur = 'N/A'
-                    invested_eur = 'N/A'
-                    gain_loss_text = 'N/A'
-
-                self.etf_tree.insert("", "end", values=(
-                    etf_name,
-                    f"{balance:.6f}",
-                    f"{avg_price:.2f}" if avg_price != 'N/A' else 'N/A',
-                    f"{etf_current_value:.2f}" if isinstance(etf_current_value, (int, float)) else 'N/A',
-                    f"{total_value_eur:.2f}" if isinstance(total_value_eur, (int, float)) else 'N/A',
-                    gain_loss_text
-                ))
+    def display_balances(self):
+        self.snapshot = self.engine.valuation(self.current_crypto_prices)
+        self.display_deposits()
+        self.display_crypto_balances()
+        self.display_real_estate()
+        self.display_etf_balances()
+
+    def display_deposits(self):
+        # Le righe hanno un iid stabile e vengono sincronizzate con le Treeview,
+        # così un refresh tocca solo gli item effettivamente cambiati
+        self.deposito_tree_sync.sync([(str(index), (
+            position["Timestamp"],
+            position["Type"],
+            f"{position['Amount EUR']:.2f} EUR",
+            position["Expiry"]
+        )) for index, position in enumerate(self.snapshot["Deposits"])])
+
+    def display_real_estate(self):
+        self.immobili_tree_sync.sync([(str(position["ID"]), (
+            position["ID"],
+            position["Type"],
+            f"{position['Value EUR']:,.2f} EUR",
+            "Sì" if position["Mortgage"] else "No",
+            f"{position['Down Payment EUR']:,.2f} EUR",
+            f"{position['Mortgage Value EUR']:,.2f} EUR",
+            position["Instalments"] if position["Mortgage"] else "-",
+            f"{position['Instalment EUR']:,.2f} EUR" if position["Mortgage"] else "-",
+            position["Instalments Paid"] if position["Mortgage"] else "-",
+            f"{position['Invested EUR']:,.2f} EUR"
+        )) for position in self.snapshot["Real Estate"]])
+
+    def display_etf_balances(self):
+        self.etf_tree_sync.sync([(position["Asset"], (
+            position["Asset"],
+            f"{position['Units']:.6f}",
+            self.format_value(position["Avg Price EUR"], ".2f"),
+            self.format_value(position["Price EUR"], ".2f"),
+            self.format_value(position["Value EUR"], ".2f"),
+            self.format_gain_loss(position["Gain %"])
+        )) for position in self.snapshot["ETF"]])
 
     def display_summary(self):
-        for widget in self.percentuali_content.winfo_children():
-            widget.destroy()
+        totals = self.snapshot["Totals"]
+        self.recap_labels["saldo_finale"].config(text=f"{self.eur_balance:,.2f} EUR")
+        self.recap_labels["totale_depositi"].config(text=f"{totals['Deposits']:,.2f} EUR")
+        self.recap_labels["saldo_investito"].config(text=f"{totals['Invested']:,.2f} EUR")
+        self.recap_labels["valore_attuale"].config(text=f"{totals['Current Value']:,.2f} EUR")
+        self.recap_labels["valore_potenziale_vendita"].config(text=f"{totals['Potential Selling Value']:,.2f} EUR")
 
-        current_crypto_prices = self.data_manager.get_current_crypto_prices()
-        percentuali_target = self.data_manager.percentuali_target
+        self.allocation_view.sync(self.snapshot["Allocation"])
 
-        total_deposito_value = sum([float(deposito["Filled Amount"].replace(" EUR", "")) for deposito in self.data_manager.conto_deposito["Conto deposito"]])
-        total_liquidity = self.eur_balance + self.usdt_balance * current_crypto_prices.get('tether', {}).get('eur', 0)
-        total_portfolio_value = self.total_current_value_eur + total_liquidity + total_deposito_value + self.total_immobili_value
-        
-        total_potential_selling_value_eur = 0.0
-        for currency, selling_price_usd in self.selling_prices.items():
-            balance = self.balances.get(currency, 0.0)
-            if balance > 0 and selling_price_usd:
-                total_selling_value_usd = balance * selling_price_usd
-                usd_to_eur_rate = current_crypto_prices.get('tether', {}).get('eur', 0.0)
-                if usd_to_eur_rate > 0:
-                    total_selling_value_eur = total_selling_value_usd * usd_to_eur_rate
-                    total_potential_selling_value_eur += total_selling_value_eur
+# ======================= Main Application =======================
 
-        self.recap_labels["saldo_finale"].config(text=f"{self.eur_balance:,.2f} EUR")
-        self.recap_labels["totale_depositi"].config(text=f"{total_deposito_value:,.2f} EUR")
-        self.recap_labels["saldo_investito"].config(text=f"{self.total_invested_excluding_eur:,.2f} EUR")
-        self.recap_labels["valore_attuale"].config(text=f"{self.total_current_value_eur:,.2f} EUR")
-        self.recap_labels["valore_potenziale_vendita"].config(text=f"{total_potential_selling_value_eur:,.2f} EUR")
-
-        def create_progressbar(label_text, value, target_value):
-            frame = ttk.Frame(self.percentuali_content)
-            frame.pack(fill=tk.X, pady=5)
-
-            label = ttk.Label(frame, text=label_text, font=("Arial", 10, "bold"))
-            label.pack(side=tk.LEFT, padx=5)
-
-            progress_style = "custom.Horizontal.TProgressbar"
-
-            progress = ttk.Progressbar(frame, style=progress_style, orient='horizontal', length=300, mode='determinate')
-            progress['value'] = value
-            progress['maximum'] = 100
-            progress.pack(side=tk.LEFT, padx=5)
-
-            percent_label = ttk.Label(frame, text=f"{value:.2f}% / {target_value:.2f}%", font=("Arial", 10))
-            percent_label.pack(side=tk.LEFT, padx=5)
-
-        if total_portfolio_value > 0:
-            # Calcola le percentuali per le varie categorie
-            liquidity_percent = (total_liquidity / total_portfolio_value) * 100
-            deposito_percent = (total_deposito_value / total_portfolio_value) * 100
-            immobili_percent = (self.total_immobili_value / total_portfolio_value) * 100
-
-            # Crea le barre di progresso per Liquidity, Conto Deposito e Immobili
-            create_progressbar(f"Liquidità: {total_liquidity:,.2f} EUR", liquidity_percent, percentuali_target.get("liquidita", 0))
-            create_progressbar(f"Conto Deposito: {total_deposito_value:,.2f} EUR", deposito_percent, percentuali_target.get("Conto deposito", 0))
-            create_progressbar(f"Immobili: {self.total_immobili_value:,.2f} EUR", immobili_percent, percentuali_target.get("Immobili", 0))
-
-            # Calcolo dei valori degli ETF
-            etf_values = {}
-            for currency, balance in self.balances.items():
-                if currency.startswith('ETF_'):
-                    etf_name = currency[4:]
-                    etf_current_value = self.data_manager.manual_etf_prices.get(etf_name, 0)
-                    etf_value = balance * etf_current_value
-                    etf_values[etf_name] = etf_value
-
-            # Calcolo dei valori delle criptovalute
-            total_btc_value = 0
-            total_eth_value = 0
-            total_solana_value = 0
-            total_altcoins_value = 0
-
-            for currency, balance in self.balances.items():
-                current_price_eur = current_crypto_prices.get(self.data_manager.crypto_mapping.get(f"{currency}/USDT", ''), {}).get('eur', 0)
-                if currency == 'BTC':
-                    total_btc_value = balance * current_price_eur
-                elif currency == 'ETH':
-                    total_eth_value = balance * current_price_eur
-                elif currency == 'SOL':
-                    total_solana_value = balance * current_price_eur
-                elif currency != 'USDT' and not currency.startswith('ETF_'):
-                    total_altcoins_value += balance * current_price_eur
-
-            # Crea le barre di progresso per gli ETF
-            for etf_name, etf_value in etf_values.items():
-                etf_single_percent = (etf_value / total_portfolio_value) * 100
-                etf_target = percentuali_target["etf"].get(etf_name, 0)
-                create_progressbar(f"{etf_name}: {etf_value:,.2f} EUR", etf_single_percent, etf_target)
-
-            # Calcola le percentuali per le criptovalute
-            btc_percent = (total_btc_value / total_portfolio_value) * 100
-            eth_percent = (total_eth_value / total_portfolio_value) * 100
-            solana_percent = (total_solana_value / total_portfolio_value) * 100
-            altcoins_percent = (total_altcoins_value / total_portfolio_value) * 100
-
-            # Crea le barre di progresso per le criptovalute
-            create_progressbar(f"Bitcoin (BTC): {total_btc_value:,.2f} EUR", btc_percent, percentuali_target.get("BTC", 0))
-            create_progressbar(f"Ethereum (ETH): {total_eth_value:,.2f} EUR", eth_percent, percentuali_target.get("ETH", 0))
-            create_progressbar(f"Solana (SOL): {total_solana_value:,.2f} EUR", solana_percent, percentuali_target.get("SOL", 0))
-            create_progressbar(f"Altcoin (resto): {total_altcoins_value:,.2f} EUR", altcoins_percent, percentuali_target.get("altcoin", 0))
-        else:
-            ttk.Label(self.percentuali_content, text="Nessun dato disponibile per creare le barre di progresso.", font=("Arial", 10, "bold")).pack(pady=5)
+class StartupTimer:
+    # Durata di ogni fase dell'avvio, stampata su stderr con --startup-timing
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.started = self.last = time.perf_counter()
+        self.phases = []
 
-# ======================= Main Application =======================
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        if not self.enabled:
+            return
+        print("Tempi di avvio:", file=sys.stderr)
+        for phase, elapsed in self.phases:
+            print(f"  {phase:<24} {elapsed * 1000:10.2f} ms", file=sys.stderr)
+        print(f"  {'totale':<24} {(self.last - self.started) * 1000:10.2f} ms", file=sys.stderr)
+
+
+def create_data_manager(args):
+    data_manager = DataManager(create_storage(args.storage))
+    if args.price_sources or args.record_prices:
+        data_manager.price_provider = create_price_provider(args.price_sources, data_manager.price_history, args.record_prices)
+    return data_manager
+
+
+def run_headless(args, startup_timer=None):
+    startup_timer = startup_timer or StartupTimer()
+    data_manager = create_data_manager(args)
+    startup_timer.mark("data_manager")
+    engine = PortfolioEngine(data_manager)
+    engine.load()
+    startup_timer.mark("ledger")
+    prices = data_manager.get_current_crypto_prices() if args.refresh_prices else data_manager.get_cached_crypto_prices()
+    if data_manager.price_cache.last_error:
+        print(f"Attenzione: {data_manager.price_cache.last_error}", file=sys.stderr)
+    startup_timer.mark("prices")
+    if args.history:
+        snapshot = engine.history()
+        write_csv = write_history_csv
+    elif args.cost_basis:
+        snapshot = engine.cost_basis(args.cost_basis, prices)
+        write_csv = write_cost_basis_csv
+    elif args.projection:
+        snapshot = engine.projection(prices, args.years, args.paths, args.workers, args.seed)
+        write_csv = write_projection_csv
+    elif args.rebalance:
+        snapshot = engine.rebalance(prices, args.tolerance, args.min_trade)
+        write_csv = write_rebalance_csv
+    else:
+        snapshot = engine.valuation(prices)
+        write_csv = write_snapshot_csv
+    startup_timer.mark("valuation")
+
+    output = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+    try:
+        if args.format == "csv":
+            write_csv(snapshot, output)
+        else:
+            json.dump(snapshot, output, indent=4, default=datetime_to_string, ensure_ascii=False)
+            output.write("\n")
+    finally:
+        if args.output:
+            output.close()
+    startup_timer.mark("output")
+    startup_timer.report()
+
+
+def run_import(args):
+    data_manager = create_data_manager(args)
+    importer = CsvTransactionImporter(data_manager, data_manager.load_csv_import_mapping(args.mapping), args.delimiter)
+    result = importer.import_file(args.import_csv)
+    print(f"Transazioni importate: {result['Imported']}, duplicati ignorati: {result['Duplicates']}, righe non valide: {len(result['Errors'])}")
+    for line, error in result["Errors"]:
+        print(f"Errore alla riga {line}: {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gestione Portafoglio Investimenti")
+    parser.add_argument("--headless", action="store_true", help="calcola la valutazione senza avviare la GUI")
+    parser.add_argument("--format", choices=("json", "csv"), default="json", help="formato della valutazione in modalità headless")
+    parser.add_argument("--output", help="file in cui salvare la valutazione (default: stdout)")
+    parser.add_argument("--storage", choices=("json", "sqlite"), help="backend di salvataggio (default: WALLET_STORAGE o json)")
+    parser.add_argument("--refresh-prices", action="store_true", help="scarica i prezzi aggiornati invece di usare quelli salvati")
+    parser.add_argument("--price-sources", help="fonti dei prezzi in ordine di priorità, es. replay:prezzi.jsonl,coingecko,history (default: WALLET_PRICE_SOURCES o coingecko)")
+    parser.add_argument("--record-prices", metavar="FILE", help="registra i prezzi scaricati in un file riproducibile con la fonte replay")
+    parser.add_argument("--history", action="store_true", help="in modalità headless esporta la serie giornaliera del patrimonio")
+    parser.add_argument("--cost-basis", choices=LOT_METHODS, help="in modalità headless esporta il P&L realizzato e non realizzato calcolato con il metodo indicato")
+    parser.add_argument("--rebalance", action="store_true", help="in modalità headless esporta gli ordini che riportano l'allocazione dentro la banda di tolleranza dei target")
+    parser.add_argument("--tolerance", type=float, default=REBALANCE_TOLERANCE, help="banda di tolleranza del ribilanciamento in punti percentuali")
+    parser.add_argument("--min-trade", type=float, default=REBALANCE_MIN_TRADE_EUR, help="importo minimo in EUR di un ordine di ribilanciamento")
+    parser.add_argument("--projection", action="store_true", help="in modalità headless esporta le bande percentili del patrimonio futuro simulate con il metodo Monte Carlo")
+    parser.add_argument("--years", type=int, default=MONTE_CARLO_YEARS, help="orizzonte della proiezione in anni")
+    parser.add_argument("--paths", type=int, default=MONTE_CARLO_PATHS, help="numero di percorsi simulati")
+    parser.add_argument("--workers", type=int, default=0, help="processi paralleli per la simulazione (0 = nel processo principale)")
+    parser.add_argument("--seed", type=int, help="seed della simulazione, per risultati riproducibili")
+    parser.add_argument("--import-csv", metavar="FILE", help="importa le transazioni crypto da un export CSV dell'exchange")
+    parser.add_argument("--mapping", help="file JSON con la corrispondenza tra campi e colonne del CSV (default: data/csv_import_mapping.json)")
+    parser.add_argument("--delimiter", default=",", help="separatore di colonna del CSV")
+    parser.add_argument("--startup-timing", action="store_true", help="stampa su stderr la durata di ogni fase dell'avvio")
+    args = parser.parse_args(argv)
+    startup_timer = StartupTimer(args.startup_timing)
+
+    if args.import_csv:
+        run_import(args)
+        return
+
+    if args.headless:
+        run_headless(args, startup_timer)
+        return
 
-if __name__ == "__main__":
     root = tk.Tk()
-    app = ApplicationGUI(root)
+    startup_timer.mark("tk")
+    # Backend e fonti dei prezzi scelti da riga di comando valgono anche per la GUI
+    app = ApplicationGUI(root, create_data_manager(args), startup_timer)
     root.mainloop()
+
+
+if __name__ == "__main__":
+    main()